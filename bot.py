@@ -1,10 +1,12 @@
 # bot.py
+import time
+_BOOT_T0 = time.perf_counter()  # отсчёт холодного старта (см. BOOT_PHASES)
+
 import os
 import re
 import logging
 import asyncio
 import random
-import time
 import json, base64
 from dotenv import load_dotenv
 from aiogram.enums import ParseMode
@@ -26,22 +28,27 @@ if not TOKEN:
 # --- сторонние модули
 from payments import (
     create_order, build_checkout_link, activate_after_payment,
-    click_handle_callback, payme_handle_callback
+    click_handle_callback, payme_handle_callback, claim_order_for_trx,
 )
-from google.oauth2 import service_account
-import gspread
-from typing import Optional, Tuple, List, Dict
+# gspread/google-auth тяжёлые — импортируются при первом обращении к Sheets (_get_gs_client и др.)
+from typing import TYPE_CHECKING, Optional, Tuple, List, Dict
 from html import escape
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+if TYPE_CHECKING:  # только для аннотаций — в рантайме gspread грузится лениво
+    import gspread
+from types import SimpleNamespace
 from zoneinfo import ZoneInfo
 from datetime import datetime, timedelta, timezone
 from fastapi import FastAPI, Request, HTTPException, Header
-from fastapi.responses import JSONResponse
+from fastapi.responses import PlainTextResponse
 from payments import db as _pay_db  # реиспользуем подключение из слоя платежей
 
 # --- aiogram
-from aiogram import Bot, Dispatcher, F
+from aiogram import Bot, Dispatcher, F, BaseMiddleware
 from aiogram.types import (
     Message,
     CallbackQuery,
@@ -49,20 +56,55 @@ from aiogram.types import (
     KeyboardButton,
     InlineKeyboardMarkup,
     InlineKeyboardButton,
+    Update,
 )
 from aiogram.filters import Command  # aiogram v3.x
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import SendChatAction
 
 # --- psycopg
+import psycopg
 from psycopg import connect
 from psycopg.rows import dict_row
-
-# --- httpx и локальные утилиты
-import httpx
-from db_init import init_db, get_config, set_config  # конфиг из БД
+from psycopg.types.json import Jsonb
+
+# --- локальные утилиты
+from db_init import init_db, get_config, set_config, try_advisory_lock, lock_alive, advisory_lock  # конфиг из БД
+from utils.ratelimit import TokenBucket, BucketRegistry
+from utils.cache import LRUCache
+from utils.outbound import (
+    OutboundScheduler, outbound_priority, PRIO_ADMIN, PRIO_BULK
+)
+from utils.workpool import KeyedWorkerPool
+from utils.tiers import (
+    TIER_NAMES, TIER_SEARCH, classify_update as _classify_update, default_tier_limits, should_shed,
+)
+from utils.dedup import RecentIds
+from utils.chat_actions import TypingTicker
+from utils.digest import BurstDigest
+from utils.bulkhead import Bulkhead
+from utils.http import get_client, init_clients, aclose_all as close_http_clients
+from utils.metrics import REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from utils.db import InstrumentedCursor
+from utils.loopmon import LoopLagMonitor
+from utils.profiling import SlowProfiler
+from utils.memstat import MemoryRegistry, process_rss_bytes
+from utils.tracing import TRACER
+from utils.fastjson import FastJSONResponse, loads as fast_loads
 
 # ================= ЛОГИ =================
 logging.basicConfig(level=logging.INFO)
 
+# ===== Холодный старт: фазы от начала импорта (мс) =====
+BOOT_PHASES: Dict[str, float] = {}
+
+
+def _boot_mark(phase: str) -> None:
+    BOOT_PHASES[phase] = round((time.perf_counter() - _BOOT_T0) * 1000, 1)
+
+
+_boot_mark("imports")
+
 # ===== ПАМЯТЬ ДИАЛОГА =====
 LAST_RESULTS: dict[int, list[dict]] = {}   # user_id -> последние показанные туры
 LAST_QUERY_AT: dict[int, float] = {}       # user_id -> ts последнего показа
@@ -139,6 +181,16 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", os.getenv("WEBHOOK_URL", "https://tour-bot-rxi8.onrender.com"))
 WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
 WEBHOOK_URL = f"{WEBHOOK_HOST}{WEBHOOK_PATH}"
+# inline — обрабатываем апдейт внутри HTTP-запроса (как раньше);
+# queue — кладём в очередь и сразу отвечаем 200, обрабатывает пул воркеров
+WEBHOOK_MODE = (os.getenv("WEBHOOK_MODE", "queue") or "queue").strip().lower()
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_MAX = int(os.getenv("WEBHOOK_QUEUE_MAX", "2000"))
+WEBHOOK_SECRET = (os.getenv("WEBHOOK_SECRET") or "").strip()
+# Отсев повторных доставок: окно последних update_id в памяти; при нескольких
+# инстансах — ещё и общая таблица processed_updates (UPDATE_DEDUP_DB=1)
+UPDATE_DEDUP_WINDOW = int(os.getenv("UPDATE_DEDUP_WINDOW", "20000"))
+UPDATE_DEDUP_DB = os.getenv("UPDATE_DEDUP_DB", "0").strip().lower() in ("1", "true", "yes")
 
 LEADS_CHAT_ID_ENV = (os.getenv("LEADS_CHAT_ID") or "").strip()
 LEADS_TOPIC_ID = int(os.getenv("LEADS_TOPIC_ID", "0") or 0)
@@ -413,7 +465,126 @@ def filters_inline_kb(user_id: int | None = None):
 # ================= БОТ / APP =================
 bot = Bot(token=TELEGRAM_TOKEN, default=DefaultBotProperties(parse_mode="HTML"))
 dp = Dispatcher()
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)  # orjson для dict-ответов, если установлен
+
+# --- Защита от двойных нажатий инлайн-кнопок
+CALLBACK_DEDUP_WINDOW = float(os.getenv("CALLBACK_DEDUP_WINDOW_SEC", "1.5"))
+
+
+class CallbackDedupMiddleware(BaseMiddleware):
+    """
+    Схлопывает одинаковые (user_id, callback_data): пока первый обработчик
+    ещё работает, и ещё window секунд после него повтор просто подтверждается
+    call.answer() без повторного запроса в БД и отправки карточек.
+    """
+
+    def __init__(self, window: float = 1.5, max_keys: int = 5000):
+        self.window = window
+        self.max_keys = max_keys
+        self._inflight: set[tuple[int, str]] = set()
+        self._recent: "OrderedDict[tuple[int, str], float]" = OrderedDict()
+
+    def _prune(self, now: float) -> None:
+        while self._recent:
+            key, ts = next(iter(self._recent.items()))
+            if now - ts <= self.window and len(self._recent) <= self.max_keys:
+                break
+            self._recent.popitem(last=False)
+
+    async def __call__(self, handler, event: CallbackQuery, data: dict):
+        key = (event.from_user.id, event.data or "")
+        now = time.monotonic()
+        self._prune(now)
+        if key in self._inflight or key in self._recent:
+            try:
+                await event.answer()
+            except Exception:
+                pass
+            return None
+
+        self._inflight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._inflight.discard(key)
+            self._recent[key] = time.monotonic()
+            self._recent.move_to_end(key)
+
+
+dp.callback_query.outer_middleware(CallbackDedupMiddleware(window=CALLBACK_DEDUP_WINDOW))
+
+# --- Метрики хэндлеров: время и исход по имени функции-хэндлера
+HANDLER_SECONDS = REGISTRY.histogram("bot_handler_seconds", "Время хэндлера aiogram", ("handler", "status"))
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: к этому моменту фильтры пройдены и хэндлер известен."""
+
+    async def __call__(self, handler, event, data: dict):
+        h = data.get("handler")
+        name = getattr(getattr(h, "callback", None), "__name__", "unknown")
+        status = "ok"
+        t0 = time.perf_counter()
+        with TRACER.span(f"handler:{name}"):
+            try:
+                return await handler(event, data)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - t0, handler=name, status=status)
+
+
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+# --- Исходящие вызовы Telegram: лимиты на чат/глобально, приоритеты, RetryAfter
+TG_OUTBOUND = OutboundScheduler(
+    global_per_sec=float(os.getenv("TG_GLOBAL_PER_SEC", "28")),
+    global_burst=float(os.getenv("TG_GLOBAL_BURST", "28")),
+    chat_per_sec=float(os.getenv("TG_CHAT_PER_SEC", "1")),
+    chat_burst=float(os.getenv("TG_CHAT_BURST", "8")),
+    group_per_min=float(os.getenv("TG_GROUP_PER_MIN", "20")),
+    group_burst=float(os.getenv("TG_GROUP_BURST", "5")),
+    max_retries=int(os.getenv("TG_RETRY_AFTER_MAX", "3")),
+)
+
+
+class OutboundThrottleMiddleware(BaseRequestMiddleware):
+    """Пропускает каждый метод API, адресованный чату, через TG_OUTBOUND."""
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            # answerCallbackQuery, setWebhook, getMe… — лимиты чатов на них не распространяются
+            return await _timed_tg_call(make_request, bot, method)
+        # «печатает…» — мимо бакета чата: не отнимает у ответа токен 1 сообщение/с
+        chat_limited = not isinstance(method, SendChatAction)
+        return await TG_OUTBOUND.run(
+            chat_id, lambda: _timed_tg_call(make_request, bot, method), chat_limited=chat_limited,
+        )
+
+
+TG_API_SECONDS = REGISTRY.histogram(
+    "tg_api_seconds", "Время вызова Telegram Bot API (без ожидания в очереди)", ("method", "status")
+)
+
+
+async def _timed_tg_call(make_request, bot, method):
+    name = getattr(method, "__api_method__", type(method).__name__)
+    status = "ok"
+    t0 = time.perf_counter()
+    with TRACER.span(f"tg:{name}", kind="CLIENT"):
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            status = type(e).__name__
+            raise
+        finally:
+            TG_API_SECONDS.observe(time.perf_counter() - t0, method=name, status=status)
+
+
+bot.session.middleware(OutboundThrottleMiddleware())
 
 # --- Динамическая проверка колонок схемы
 SCHEMA_COLS: set[str] = set()
@@ -426,12 +597,14 @@ def _select_tours_clause() -> str:
     extras = []
     extras.append("board" if _has_cols("board") else "NULL AS board")
     extras.append("includes" if _has_cols("includes") else "NULL AS includes")
+    # xmin меняется при каждом UPDATE строки — используем как версию для кэша рендера
+    extras.append("xmin::text AS row_version")
     return f"{base}, {', '.join(extras)}"
 
 # ================= БД =================
 
 def get_conn():
-    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row)
+    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row, cursor_factory=InstrumentedCursor)
 
 
 def ensure_pending_wants_table():
@@ -499,6 +672,86 @@ def ensure_questions_schema():
         )
         cur.execute("CREATE INDEX IF NOT EXISTS questions_user_id_idx ON questions(user_id);")
 
+def ensure_lead_jobs_schema():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS lead_jobs (
+                id BIGSERIAL PRIMARY KEY,
+                lead_id BIGINT NOT NULL,
+                kind TEXT NOT NULL,                       -- notify | sheet
+                payload JSONB NOT NULL DEFAULT '{}'::jsonb,
+                status TEXT NOT NULL DEFAULT 'pending',   -- pending | done | failed
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                last_error TEXT,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                done_at TIMESTAMPTZ,
+                UNIQUE (lead_id, kind)
+            );
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS lead_jobs_pending_idx ON lead_jobs(next_attempt_at) WHERE status = 'pending';"
+        )
+
+
+def ensure_tour_media_schema():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS tour_media (
+                photo_url TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_unique_id TEXT,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+
+
+def ensure_processed_updates_schema():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS processed_updates (
+                update_id BIGINT PRIMARY KEY,
+                received_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+        cur.execute(
+            "CREATE INDEX IF NOT EXISTS processed_updates_received_idx ON processed_updates(received_at);"
+        )
+
+
+def ensure_tours_notify_trigger():
+    """UPDATE/DELETE в tours → NOTIFY tours_changed '<id>' (сброс кэша карточек)."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE OR REPLACE FUNCTION tours_notify_change() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify('tours_changed', (CASE WHEN TG_OP = 'DELETE' THEN OLD.id ELSE NEW.id END)::text);
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql;
+            """
+        )
+        cur.execute(
+            """
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'tours_notify_change_trg') THEN
+                    CREATE TRIGGER tours_notify_change_trg
+                        AFTER UPDATE OR DELETE ON tours
+                        FOR EACH ROW EXECUTE FUNCTION tours_notify_change();
+                END IF;
+            END
+            $$;
+            """
+        )
+
 def ensure_orders_columns():
     try:
         with _pay_db() as conn, conn.cursor() as cur:
@@ -551,12 +804,21 @@ def get_payme_kb() -> InlineKeyboardMarkup:
 
 # ============== GOOGLE SHEETS ==============
 _gs_client = None
+# прогрев и запросы зовут _get_gs_client из разных потоков; только из потоков — не из корутин
+_GS_CLIENT_LOCK = threading.Lock()
 
 
 def _get_gs_client():
-    global _gs_client
     if _gs_client is not None:
         return _gs_client
+    with _GS_CLIENT_LOCK:
+        return _init_gs_client()
+
+
+def _init_gs_client():
+    global _gs_client
+    if _gs_client is not None:  # пока ждали блокировку, клиент создал другой поток
+        return _gs_client
     if not (SHEETS_CREDENTIALS_B64 and SHEETS_SPREADSHEET_ID):
         logging.info("GS: credentials or spreadsheet id not set")
         _gs_client = None
@@ -571,6 +833,9 @@ def _get_gs_client():
             "https://www.googleapis.com/auth/spreadsheets",
             "https://www.googleapis.com/auth/drive",
         ]
+        import gspread
+        from google.oauth2 import service_account
+
         creds = service_account.Credentials.from_service_account_info(info, scopes=scopes)
         _gs_client = gspread.authorize(creds)
         logging.info("✅ Google Sheets авторизация успешно выполнена")
@@ -581,7 +846,9 @@ def _get_gs_client():
         return None
 
 
-def _ensure_ws(spreadsheet, title: str, header: list[str]) -> gspread.Worksheet:
+def _ensure_ws(spreadsheet, title: str, header: list[str]) -> "gspread.Worksheet":
+    import gspread
+
     try:
         ws = spreadsheet.worksheet(title)
         return ws
@@ -615,32 +882,40 @@ def _ensure_header(ws, header: list[str]) -> None:
 
 
 async def load_kb_context(max_rows: int = 60) -> str:
+    # импорт gspread, авторизация и чтение листа — блокирующие; на loop не держим,
+    # в т.ч. ожидание _GS_CLIENT_LOCK, пока прогрев авторизуется в своём потоке
     try:
-        gc = _get_gs_client()
-        if not gc:
-            return ""
-        sh = gc.open_by_key(SHEETS_SPREADSHEET_ID)
-        try:
-            ws = sh.worksheet(KB_SHEET_NAME)
-        except gspread.exceptions.WorksheetNotFound:
-            return ""
-        rows = ws.get_all_records()
-        lines = []
-        for r in rows[:max_rows]:
-            topic = (r.get("topic") or r.get("Тема") or r.get("topic/country") or "").strip()
-            fact = (r.get("fact") or r.get("Факт") or r.get("note") or "").strip()
-            if not fact:
-                continue
-            if topic:
-                lines.append(f"- [{topic}] {fact}")
-            else:
-                lines.append(f"- {fact}")
-        return "\n".join(lines)
+        return await asyncio.to_thread(_load_kb_context_sync, max_rows)
     except Exception as e:
         logging.warning(f"KB load failed: {e}")
         return ""
 
 
+def _load_kb_context_sync(max_rows: int) -> str:
+    gc = _get_gs_client()
+    if not gc:
+        return ""
+    import gspread
+
+    sh = gc.open_by_key(SHEETS_SPREADSHEET_ID)
+    try:
+        ws = sh.worksheet(KB_SHEET_NAME)
+    except gspread.exceptions.WorksheetNotFound:
+        return ""
+    rows = ws.get_all_records()
+    lines = []
+    for r in rows[:max_rows]:
+        topic = (r.get("topic") or r.get("Тема") or r.get("topic/country") or "").strip()
+        fact = (r.get("fact") or r.get("Факт") or r.get("note") or "").strip()
+        if not fact:
+            continue
+        if topic:
+            lines.append(f"- [{topic}] {fact}")
+        else:
+            lines.append(f"- {fact}")
+    return "\n".join(lines)
+
+
 async def load_recent_tours_context(max_rows: int = 12, hours: int = 120) -> str:
     try:
         cutoff = datetime.now(timezone.utc) - timedelta(hours=hours)
@@ -681,68 +956,97 @@ async def load_recent_tours_context(max_rows: int = 12, hours: int = 120) -> str
 
 def append_lead_to_sheet(lead_id: int, user, phone: str, t: dict):
     try:
-        gc = _get_gs_client()
-        if not gc:
-            return
-        sh = gc.open_by_key(SHEETS_SPREADSHEET_ID)
-        header = [
-            "created_utc",
-            "lead_id",
-            "username",
-            "full_name",
-            "phone",
-            "country",
-            "city",
-            "hotel",
-            "price",
-            "currency",
-            "dates",
-            "source_url",
-            "posted_local",
-            "board",
-            "includes",
-        ]
-        ws = _ensure_ws(sh, WORKSHEET_NAME, header)
-        _ensure_header(ws, header)
-
-        full_name = f"{(getattr(user, 'first_name', '') or '').strip()} {(getattr(user, 'last_name', '') or '').strip()}".strip()
-        username = f"@{user.username}" if getattr(user, "username", None) else ""
-        posted_local = localize_dt(t.get("posted_at"))
-        hotel_text = t.get("hotel") or derive_hotel_from_description(t.get("description")) or "Пакетный тур"
-        hotel_clean = clean_text_basic(strip_trailing_price_from_hotel(hotel_text))
-
-        ws.append_row(
-            [
-                datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                int(lead_id),
-                username,
-                full_name,
-                phone,
-                t.get("country") or "",
-                t.get("city") or "",
-                hotel_clean,
-                t.get("price") or "",
-                (t.get("currency") or "").upper(),
-                t.get("dates") or "",
-                t.get("source_url") or "",
-                posted_local,
-                (t.get("board") or ""),
-                (t.get("includes") or ""),
-            ],
-            value_input_option="USER_ENTERED",
-        )
+        _append_lead_row(lead_id, user, phone, t)
     except Exception as e:
         logging.error(f"append_lead_to_sheet failed: {e}")
 
 
+SHEETS_WRITE_SECONDS = REGISTRY.histogram("sheets_write_seconds", "Запись заявки в Google Sheets", ("status",))
+
+
+def _append_lead_row(lead_id: int, user, phone: str, t: dict, skip_if_present: bool = False) -> None:
+    """Пишет строку заявки в лист; ошибки пробрасывает (для ретраев outbox)."""
+    status = "ok"
+    t0 = time.perf_counter()
+    try:
+        _write_lead_row(lead_id, user, phone, t, skip_if_present)
+    except Exception:
+        status = "error"
+        raise
+    finally:
+        SHEETS_WRITE_SECONDS.observe(time.perf_counter() - t0, status=status)
+
+
+def _write_lead_row(lead_id: int, user, phone: str, t: dict, skip_if_present: bool) -> None:
+    gc = _get_gs_client()
+    if not gc:
+        return
+    sh = gc.open_by_key(SHEETS_SPREADSHEET_ID)
+    header = [
+        "created_utc",
+        "lead_id",
+        "username",
+        "full_name",
+        "phone",
+        "country",
+        "city",
+        "hotel",
+        "price",
+        "currency",
+        "dates",
+        "source_url",
+        "posted_local",
+        "board",
+        "includes",
+    ]
+    ws = _ensure_ws(sh, WORKSHEET_NAME, header)
+    _ensure_header(ws, header)
+    # повтор после сбоя: строка могла уже записаться — не дублируем
+    if skip_if_present and ws.find(str(int(lead_id)), in_column=2):
+        logging.info(f"GS: lead {lead_id} already in sheet, skip")
+        return
+
+    full_name = f"{(getattr(user, 'first_name', '') or '').strip()} {(getattr(user, 'last_name', '') or '').strip()}".strip()
+    username = f"@{user.username}" if getattr(user, "username", None) else ""
+    posted_local = localize_dt(t.get("posted_at"))
+    hotel_text = t.get("hotel") or derive_hotel_from_description(t.get("description")) or "Пакетный тур"
+    hotel_clean = clean_text_basic(strip_trailing_price_from_hotel(hotel_text))
+
+    ws.append_row(
+        [
+            datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+            int(lead_id),
+            username,
+            full_name,
+            phone,
+            t.get("country") or "",
+            t.get("city") or "",
+            hotel_clean,
+            t.get("price") or "",
+            (t.get("currency") or "").upper(),
+            t.get("dates") or "",
+            t.get("source_url") or "",
+            posted_local,
+            (t.get("board") or ""),
+            (t.get("includes") or ""),
+        ],
+        value_input_option="USER_ENTERED",
+    )
+
+
 # ================= УТИЛИТЫ КОНФИГА =================
 
+_LEADS_CHAT_ID_SEEN = 0  # последнее прочитанное значение — для classify_update без запроса в БД
+
+
 def resolve_leads_chat_id() -> int:
+    global _LEADS_CHAT_ID_SEEN
     val = get_config("LEADS_CHAT_ID", LEADS_CHAT_ID_ENV)
     try:
-        return int(val) if val else 0
+        _LEADS_CHAT_ID_SEEN = int(val) if val else 0
     except Exception:
-        return 0
+        _LEADS_CHAT_ID_SEEN = 0
+    return _LEADS_CHAT_ID_SEEN
 
 def main_menu_kb(user_id: int) -> ReplyKeyboardMarkup:
     return ReplyKeyboardMarkup(
@@ -989,67 +1293,67 @@ async def get_weather_text(place: str, lang: str = "ru") -> str:
         return cached["text"]
 
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            geo_r = await client.get(
-                "https://geocoding-api.open-meteo.com/v1/search",
-                params={"name": place, "count": 1, "language": lang},
-            )
-            if geo_r.status_code != 200 or not geo_r.json().get("results"):
-                return texts["not_found"][lang].format(q=escape(place))
-
-            g = geo_r.json()["results"][0]
-            lat, lon = g["latitude"], g["longitude"]
-            label_parts = [g.get("name")]
-            if g.get("admin1"):
-                label_parts.append(g["admin1"])
-            if g.get("country"):
-                label_parts.append(g["country"])
-            label = ", ".join([p for p in label_parts if p])
-
-            params = {
-                "latitude": lat,
-                "longitude": lon,
-                "current": "temperature_2m,apparent_temperature,relative_humidity_2m,precipitation,weather_code,wind_speed_10m",
-                "hourly": "precipitation_probability",
-                "timezone": "auto",
-            }
-            w_r = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
-            if w_r.status_code != 200:
-                return texts["fetch_fail"][lang].format(q=escape(label))
-
-            data = w_r.json()
-            cur = data.get("current", {})
-            code = int(cur.get("weather_code", 0))
-            desc = wmo_text(code, lang)
-            t = cur.get("temperature_2m")
-            feels = cur.get("apparent_temperature")
-            rh = cur.get("relative_humidity_2m")
-            wind = cur.get("wind_speed_10m")
-
-            prob = None
-            hourly = data.get("hourly", {})
-            times = hourly.get("time", [])
-            probs = hourly.get("precipitation_probability", [])
-            if times and probs:
-                today = (datetime.now(timezone.utc).astimezone()).strftime("%Y-%m-%d")
-                prob = max((p for tt, p in zip(times, probs) if tt.startswith(today)), default=None)
-
-            parts = [f"{texts['label'][lang]}: <b>{escape(label)}</b>", desc]
-            if t is not None:
-                tmp = f"{t:.0f}°C"
-                if feels is not None and abs(feels - t) >= 1:
-                    tmp += f" ({texts['feels'][lang]} {feels:.0f}°C)"
-                parts.append(f"{texts['now'][lang]}: {tmp}")
-            if rh is not None:
-                parts.append(f"{texts['humidity'][lang]}: {int(rh)}%")
-            if wind is not None:
-                parts.append(f"{texts['wind'][lang]}: {wind:.1f} м/с")
-            if prob is not None:
-                parts.append(f"{texts['precip_prob'][lang]}: {int(prob)}%")
-
-            txt = " | ".join(parts)
-            WEATHER_CACHE[key] = (time.time(), {"text": txt})
-            return txt
+        client = get_client("open_meteo")
+        geo_r = await client.get(
+            "https://geocoding-api.open-meteo.com/v1/search",
+            params={"name": place, "count": 1, "language": lang},
+        )
+        if geo_r.status_code != 200 or not geo_r.json().get("results"):
+            return texts["not_found"][lang].format(q=escape(place))
+
+        g = geo_r.json()["results"][0]
+        lat, lon = g["latitude"], g["longitude"]
+        label_parts = [g.get("name")]
+        if g.get("admin1"):
+            label_parts.append(g["admin1"])
+        if g.get("country"):
+            label_parts.append(g["country"])
+        label = ", ".join([p for p in label_parts if p])
+
+        params = {
+            "latitude": lat,
+            "longitude": lon,
+            "current": "temperature_2m,apparent_temperature,relative_humidity_2m,precipitation,weather_code,wind_speed_10m",
+            "hourly": "precipitation_probability",
+            "timezone": "auto",
+        }
+        w_r = await client.get("https://api.open-meteo.com/v1/forecast", params=params)
+        if w_r.status_code != 200:
+            return texts["fetch_fail"][lang].format(q=escape(label))
+
+        data = w_r.json()
+        cur = data.get("current", {})
+        code = int(cur.get("weather_code", 0))
+        desc = wmo_text(code, lang)
+        t = cur.get("temperature_2m")
+        feels = cur.get("apparent_temperature")
+        rh = cur.get("relative_humidity_2m")
+        wind = cur.get("wind_speed_10m")
+
+        prob = None
+        hourly = data.get("hourly", {})
+        times = hourly.get("time", [])
+        probs = hourly.get("precipitation_probability", [])
+        if times and probs:
+            today = (datetime.now(timezone.utc).astimezone()).strftime("%Y-%m-%d")
+            prob = max((p for tt, p in zip(times, probs) if tt.startswith(today)), default=None)
+
+        parts = [f"{texts['label'][lang]}: <b>{escape(label)}</b>", desc]
+        if t is not None:
+            tmp = f"{t:.0f}°C"
+            if feels is not None and abs(feels - t) >= 1:
+                tmp += f" ({texts['feels'][lang]} {feels:.0f}°C)"
+            parts.append(f"{texts['now'][lang]}: {tmp}")
+        if rh is not None:
+            parts.append(f"{texts['humidity'][lang]}: {int(rh)}%")
+        if wind is not None:
+            parts.append(f"{texts['wind'][lang]}: {wind:.1f} м/с")
+        if prob is not None:
+            parts.append(f"{texts['precip_prob'][lang]}: {int(prob)}%")
+
+        txt = " | ".join(parts)
+        WEATHER_CACHE[key] = (time.time(), {"text": txt})
+        return txt
     except Exception as e:
         logging.warning(f"get_weather_text failed: {e}")
         return texts["retry"][lang]
@@ -1235,24 +1539,6 @@ def unset_favorite(user_id: int, tour_id: int):
         cur.execute("DELETE FROM favorites WHERE user_id=%s AND tour_id=%s;", (user_id, tour_id))
 
 
-def create_lead(tour_id: int, phone: Optional[str], full_name: str, note: Optional[str] = None):
-    try:
-        with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(
-                """
-                INSERT INTO leads (full_name, phone, tour_id, note)
-                VALUES (%s, %s, %s, %s)
-                RETURNING id;
-                """,
-                (full_name, phone, tour_id, note),
-            )
-            row = cur.fetchone()
-            return row["id"] if row else None
-    except Exception as e:
-        logging.error(f"create_lead failed: {e}")
-        return None
-
-
 def _tours_has_cols(*cols: str) -> Dict[str, bool]:
     with get_conn() as conn, conn.cursor() as cur:
         cur.execute(
@@ -1479,7 +1765,7 @@ async def fetch_tours(
         )
 
         with get_conn() as conn, conn.cursor() as cur:
-            cur.execute(sql_recent, recent_params + [lim_recent])
+            cur.execute(sql_recent, recent_params + [lim_recent], name="fetch_tours.recent")
             rows = cur.fetchall()
             if rows or strict_recent:
                 return rows, True
@@ -1492,7 +1778,7 @@ async def fetch_tours(
                 + ("WHERE " + " AND ".join(where72) if where72 else "")
                 + f" {order_clause} LIMIT %s"
             )
-            cur.execute(sql72, params72 + [lim_recent])
+            cur.execute(sql72, params72 + [lim_recent], name="fetch_tours.72h")
             rows72 = cur.fetchall()
             if rows72:
                 return rows72, False
@@ -1503,7 +1789,7 @@ async def fetch_tours(
                 + ("WHERE " + " AND ".join(where) if where else "")
                 + f" {order_clause} LIMIT %s"
             )
-            cur.execute(sql_fb, params + [lim_fb])
+            cur.execute(sql_fb, params + [lim_fb], name="fetch_tours.fallback")
             return cur.fetchall(), False
 
     except Exception:
@@ -1584,7 +1870,91 @@ async def fetch_tours_page(
         return []
 
 # ================= GPT =================
-last_gpt_call = defaultdict(float)
+# Лимиты на GPT: токен-бакет на пользователя (по тарифу) + общий бюджет на процесс.
+# Значения — запросов в минуту / размер бёрста.
+GPT_PLAN_LIMITS = {
+    "basic_m": (float(os.getenv("GPT_BASIC_PER_MIN", "4")), float(os.getenv("GPT_BASIC_BURST", "2"))),
+    "pro_m":   (float(os.getenv("GPT_PRO_PER_MIN", "10")),  float(os.getenv("GPT_PRO_BURST", "4"))),
+}
+GPT_GLOBAL_PER_MIN = float(os.getenv("GPT_GLOBAL_PER_MIN", "60"))
+GPT_GLOBAL_BURST = float(os.getenv("GPT_GLOBAL_BURST", "10"))
+GPT_MAX_QUEUE_WAIT = float(os.getenv("GPT_MAX_QUEUE_WAIT_SEC", "4"))
+GPT_MAX_USERS = int(os.getenv("GPT_MAX_TRACKED_USERS", "10000"))
+GPT_PLAN_TTL_SEC = float(os.getenv("GPT_PLAN_TTL_SEC", "300"))
+
+# user_id -> (plan_code подписки или None, когда прочитан); LRU — активные не вытесняются,
+# по истечении TTL тариф перечитывается из subscriptions (только для пропущенных запросов)
+GPT_USER_PLAN = LRUCache(maxsize=GPT_MAX_USERS)
+
+
+def _gpt_cached_plan(user_id: int) -> Tuple[Optional[str], bool]:
+    """(plan_code, свежий ли) из кэша; (None, False) — тариф ещё не читали."""
+    entry = GPT_USER_PLAN.get(user_id)
+    if entry is None:
+        return None, False
+    plan, fetched_at = entry
+    return plan, time.monotonic() - fetched_at < GPT_PLAN_TTL_SEC
+
+
+async def _gpt_refresh_plan(user_id: int) -> None:
+    try:
+        plan = await asyncio.to_thread(_subscription_plan, user_id)
+    except Exception as e:
+        logging.warning(f"subscription plan lookup failed for {user_id}: {e}")
+        return
+    GPT_USER_PLAN.put(user_id, (plan, time.monotonic()))
+
+
+def _gpt_user_bucket_factory(user_id) -> TokenBucket:
+    plan, _ = _gpt_cached_plan(user_id)
+    per_min, burst = GPT_PLAN_LIMITS.get(plan or "basic_m", GPT_PLAN_LIMITS["basic_m"])
+    return TokenBucket(rate=per_min / 60.0, capacity=burst)
+
+
+GPT_USER_BUCKETS = BucketRegistry(_gpt_user_bucket_factory, max_keys=GPT_MAX_USERS)
+GPT_GLOBAL_BUCKET = TokenBucket(rate=GPT_GLOBAL_PER_MIN / 60.0, capacity=GPT_GLOBAL_BURST)
+
+
+def _gpt_denied(wait_user: float, wait_global: float) -> str:
+    if wait_user >= wait_global:
+        return f"😮‍💨 Слишком много вопросов подряд — попробуй через {int(wait_user) + 1} сек."
+    return "😮‍💨 Сейчас очень много вопросов к ИИ. Попробуй через минутку."
+
+
+async def _gpt_admit(user_id: int, plan_code: str) -> Optional[str]:
+    """
+    Пропускает запрос к GPT через бакеты. Если токена нет, но ждать недолго —
+    подождём (очередь); иначе вернём текст вежливого отказа.
+    """
+    plan = plan_code if plan_code in GPT_PLAN_LIMITS else "basic_m"
+    ub = GPT_USER_BUCKETS.get(user_id)
+    per_min, burst = GPT_PLAN_LIMITS[plan]
+    ub.rate, ub.capacity = per_min / 60.0, burst   # тариф мог смениться
+
+    for _ in range(2):
+        wait_user = ub.wait_time()
+        wait_global = GPT_GLOBAL_BUCKET.wait_time()
+        if wait_user == 0 and wait_global == 0:
+            ub.consume()
+            GPT_GLOBAL_BUCKET.consume()
+            return None
+        if max(wait_user, wait_global) > GPT_MAX_QUEUE_WAIT:
+            return _gpt_denied(wait_user, wait_global)
+        await asyncio.sleep(max(wait_user, wait_global))
+    # дождались, но токен успел уйти другому запросу — это тот же лимит, а не «занятость»
+    return _gpt_denied(ub.wait_time(), GPT_GLOBAL_BUCKET.wait_time())
+
+
+def _subscription_plan(user_id: int) -> Optional[str]:
+    """ plan_code активной подписки пользователя или None. """
+    with _pay_db() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT plan_code FROM subscriptions "
+            "WHERE user_id=%s AND status='active' AND current_period_end > NOW();",
+            (user_id,),
+        )
+        row = cur.fetchone()
+        return row["plan_code"] if row else None
 
 def get_order_safe(order_id: int) -> dict | None:
     with _pay_db() as conn, conn.cursor() as cur:
@@ -1599,11 +1969,20 @@ def fmt_sub_until(user_id: int) -> str:
             return "—"
         return row["current_period_end"].astimezone(TZ).strftime("%d.%m.%Y")
 
-async def ask_gpt(prompt: str, *, user_id: int, premium: bool = False) -> List[str]:
-    now = time.monotonic()
-    if now - last_gpt_call[user_id] < 12.0:
-        return ["😮‍💨 Подожди пару секунд — я ещё обрабатываю твой предыдущий запрос."]
-    last_gpt_call[user_id] = now
+async def ask_gpt(
+    prompt: str, *, user_id: int, premium: bool = False, plan_code: Optional[str] = None
+) -> List[str]:
+    # лимиты проверяем ДО загрузки контекста, HTTP и БД: тариф — явный, из кэша или по умолчанию,
+    # так что отклонённый запрос ничего не стоит
+    fresh = True
+    if plan_code is None:
+        plan_code, fresh = _gpt_cached_plan(user_id)
+    denied = await _gpt_admit(user_id, plan_code or ("pro_m" if premium else "basic_m"))
+    if denied:
+        return [denied]
+    if not fresh:
+        # тариф из subscriptions — не чаще раза в GPT_PLAN_TTL_SEC; следующий запрос получит его лимиты
+        await _gpt_refresh_plan(user_id)
 
     kb_text = await load_kb_context(max_rows=80)
     recent_text = await load_recent_tours_context(max_rows=12, hours=120)
@@ -1634,40 +2013,40 @@ async def ask_gpt(prompt: str, *, user_id: int, premium: bool = False) -> List[s
     }
 
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            for attempt in range(5):
-                r = await client.post(
-                    "https://api.openai.com/v1/chat/completions",
-                    headers={
-                        "Authorization": f"Bearer {OPENAI_API_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json=payload,
-                )
-                if r.status_code == 200:
-                    data = r.json()
-                    msg = (data.get("choices") or [{}])[0].get("message", {}).get("content")
-                    if not msg:
-                        logging.error(f"OpenAI no choices/message: {data}")
-                        break
-                    answer = msg.strip()
-                    hint = ""
-                    if premium:
-                        hint = "\n\n🔗 Источники доступны: канал(ы) партнёров и база свежих объявлений."
-                    else:
-                        if _should_hint_premium(user_id):
-                            hint = "\n\n✨ Нужны прямые ссылки на посты-источники? Подключи Premium доступ TripleA."
-                    answer += hint
-
-                    MAX_LEN = 3800
-                    return [answer[i : i + MAX_LEN] for i in range(0, len(answer), MAX_LEN)]
-
-                if r.status_code in (429, 500, 502, 503, 504):
-                    delay = min(20.0, (2 ** attempt) + random.random())
-                    await asyncio.sleep(delay)
-                    continue
-                logging.error(f"OpenAI error {r.status_code}: {r.text[:400]}")
-                break
+        client = get_client("openai")
+        for attempt in range(5):
+            r = await client.post(
+                "https://api.openai.com/v1/chat/completions",
+                headers={
+                    "Authorization": f"Bearer {OPENAI_API_KEY}",
+                    "Content-Type": "application/json",
+                },
+                json=payload,
+            )
+            if r.status_code == 200:
+                data = r.json()
+                msg = (data.get("choices") or [{}])[0].get("message", {}).get("content")
+                if not msg:
+                    logging.error(f"OpenAI no choices/message: {data}")
+                    break
+                answer = msg.strip()
+                hint = ""
+                if premium:
+                    hint = "\n\n🔗 Источники доступны: канал(ы) партнёров и база свежих объявлений."
+                else:
+                    if _should_hint_premium(user_id):
+                        hint = "\n\n✨ Нужны прямые ссылки на посты-источники? Подключи Premium доступ TripleA."
+                answer += hint
+
+                MAX_LEN = 3800
+                return [answer[i : i + MAX_LEN] for i in range(0, len(answer), MAX_LEN)]
+
+            if r.status_code in (429, 500, 502, 503, 504):
+                delay = min(20.0, (2 ** attempt) + random.random())
+                await asyncio.sleep(delay)
+                continue
+            logging.error(f"OpenAI error {r.status_code}: {r.text[:400]}")
+            break
     except Exception as e:
         logging.exception(f"GPT call failed: {e}")
 
@@ -1678,67 +2057,142 @@ async def ask_gpt(prompt: str, *, user_id: int, premium: bool = False) -> List[s
 
 # ================= КАРТОЧКИ/УВЕДОМЛЕНИЯ =================
 
-def tour_inline_kb(tour: dict, is_fav: bool, user_id: Optional[int] = None) -> InlineKeyboardMarkup:
-    lang = _lang(user_id) if user_id else DEFAULT_LANG
-    tr = TRANSLATIONS[lang]
-    rows = []
+# ================= КЭШ РЕНДЕРА КАРТОЧЕК =================
+# (tour_id, row_version) -> очищенные поля карточки без дат; row_version = xmin строки,
+# так что изменённый тур сам получает новый ключ, а NOTIFY tours_changed просто чистит старьё.
+# Язык в ключ не входит: текст карточки не локализуется (подписи на русском), переводятся только кнопки.
+CARD_RENDER_CACHE = LRUCache(maxsize=int(os.getenv("CARD_CACHE_SIZE", "4000")), group=lambda k: k[0])
+# (lang, is_fav, is_admin) -> скелет клавиатуры: ряды из (text, url|None, callback-шаблон|None)
+TOUR_KB_SKELETONS: dict[tuple[str, bool, bool], tuple] = {}
 
-    # 🔒 ссылку видит только администратор
-    url = (tour.get("source_url") or "").strip()
-    if url and user_id == ADMIN_USER_ID:
-        rows.append([InlineKeyboardButton(text=tr["btn.admin_open"], url=url)])
 
-    # кнопки
-    ask_btn = InlineKeyboardButton(text=tr["btn.ask"], callback_data=f"ask:{tour['id']}")
+def _render_key(t: dict) -> Optional[tuple]:
+    tid, ver = t.get("id"), t.get("row_version")
+    if tid is None or ver is None:
+        return None
+    return (tid, ver)
+
 
-    fav_btn = InlineKeyboardButton(
-        text=(tr["btn.fav.rm"] if is_fav else tr["btn.fav.add"]),
-        callback_data=f"fav:{'rm' if is_fav else 'add'}:{tour['id']}",
-    )
+def invalidate_tour_render(tour_id: int) -> None:
+    CARD_RENDER_CACHE.invalidate_group(tour_id)
+
+
+async def tours_change_listener():
+    """LISTEN tours_changed: при правке/удалении тура (коллектор, edits) сбрасываем его рендер."""
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as aconn:
+                await aconn.execute("LISTEN tours_changed")
+                async for n in aconn.notifies():
+                    try:
+                        invalidate_tour_render(int(n.payload))
+                    except ValueError:
+                        continue
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"tours_change_listener: {e}; reconnect in 5s")
+            await asyncio.sleep(5)
 
-    want_btn = InlineKeyboardButton(text=tr["btn.want"], callback_data=f"want:{tour['id']}")
 
+def _tour_kb_skeleton(lang: str, is_fav: bool, is_admin: bool) -> tuple:
+    key = (lang, is_fav, is_admin)
+    sk = TOUR_KB_SKELETONS.get(key)
+    if sk is not None:
+        return sk
+    tr = TRANSLATIONS[lang]
+    rows = []
+    # 🔒 ссылку видит только администратор
+    if is_admin:
+        rows.append(((tr["btn.admin_open"], "{url}", None),))
+    rows.append(((tr["btn.ask"], None, "ask:{id}"),))
+    rows.append((
+        (tr["btn.fav.rm"] if is_fav else tr["btn.fav.add"], None, f"fav:{'rm' if is_fav else 'add'}:{{id}}"),
+        (tr["btn.want"], None, "want:{id}"),
+    ))
     # новая кнопка "погода"
-    place = tour.get("city") or tour.get("country") or ""
-    wx_btn = InlineKeyboardButton(text=tr["btn.weather"], callback_data=f"wx:{place}")
+    rows.append(((tr["btn.weather"], None, "wx:{place}"),))
+    rows.append(((tr["back"], None, "back_filters"),))
+    sk = tuple(rows)
+    TOUR_KB_SKELETONS[key] = sk
+    return sk
 
-    back_btn = InlineKeyboardButton(text=tr["back"], callback_data="back_filters")
 
-    # собираем ряды
-    rows.append([ask_btn])
-    rows.append([fav_btn, want_btn])
-    rows.append([wx_btn])
-    rows.append([back_btn])
+def tour_inline_kb(tour: dict, is_fav: bool, user_id: Optional[int] = None) -> InlineKeyboardMarkup:
+    lang = _lang(user_id) if user_id else DEFAULT_LANG
+    url = (tour.get("source_url") or "").strip()
+    is_admin = bool(url) and user_id == ADMIN_USER_ID
+    values = {"id": tour["id"], "url": url, "place": tour.get("city") or tour.get("country") or ""}
 
+    rows = []
+    for spec_row in _tour_kb_skeleton(lang, is_fav, is_admin):
+        row = []
+        for text, url_tpl, cb_tpl in spec_row:
+            if url_tpl is not None:
+                row.append(InlineKeyboardButton(text=text, url=url_tpl.format(**values)))
+            else:
+                row.append(InlineKeyboardButton(text=text, callback_data=cb_tpl.format(**values)))
+        rows.append(row)
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
-def build_card_text(t: dict, lang: str = "ru") -> str:
-    hotel   = safe_title(t)  # ← вся логика заголовка внутри safe_title
-    country = (t.get("country") or "—").strip()
-    city    = (t.get("city") or "—").strip()
-    price   = fmt_price(t.get("price"), t.get("currency"))
-    dates   = normalize_dates_for_display(t.get("dates")) if t.get("dates") else "—"
-    board   = (t.get("board") or "").strip()
-    inc     = (t.get("includes") or "").strip()
+def build_card_fields(t: dict) -> dict:
+    """Поля карточки, уже почищенные/отформатированные (общие для карточки и компактного списка)."""
+    key = _render_key(t)
+    with TRACER.span("cache:card_fields") as sp:
+        static = CARD_RENDER_CACHE.get(key) if key is not None else None
+        sp.tag("hit", static is not None)
+        if static is None:
+            static = _build_static_card_fields(t)
+            if key is not None:
+                CARD_RENDER_CACHE.put(key, static)
+    # кэшируется только то, что зависит от строки тура; даты — на каждый показ,
+    # копия — чтобы вызывающий не испортил общий элемент кэша
     when_dt = t.get("posted_at")
-    when    = f"🕒 {localize_dt(when_dt)}" if when_dt else ""
+    return {
+        **static,
+        "dates": normalize_dates_for_display(t.get("dates")) if t.get("dates") else "—",
+        "when":  f"🕒 {localize_dt(when_dt)}" if when_dt else "",
+    }
+
+
+def _build_static_card_fields(t: dict) -> dict:
+    return {
+        "hotel":   safe_title(t),  # ← вся логика заголовка внутри safe_title
+        "country": (t.get("country") or "—").strip(),
+        "city":    (t.get("city") or "—").strip(),
+        "price":   fmt_price(t.get("price"), t.get("currency")),
+        "board":   (t.get("board") or "").strip(),
+        "inc":     (t.get("includes") or "").strip(),
+    }
+
+
+def build_card_text(t: dict) -> str:
+    f = build_card_fields(t)
 
     lines = [
-        f"🏨 <b>{hotel}</b>",
-        f"📍 {country} — {city}",
-        f"💵 {price}",
-        f"🗓 {dates}",
+        f"🏨 <b>{f['hotel']}</b>",
+        f"📍 {f['country']} — {f['city']}",
+        f"💵 {f['price']}",
+        f"🗓 {f['dates']}",
     ]
-    if board:
-        lines.append(f"🍽 Питание: {board}")
-    if inc:
-        lines.append(f"✅ Включено: {inc}")
-    if when:
-        lines.append(when)
+    if f["board"]:
+        lines.append(f"🍽 Питание: {f['board']}")
+    if f["inc"]:
+        lines.append(f"✅ Включено: {f['inc']}")
+    if f["when"]:
+        lines.append(f["when"])
 
     return "\n".join(lines)
 
 
+def build_compact_line(n: int, t: dict) -> str:
+    f = build_card_fields(t)
+    line = f"<b>{n}. {f['hotel']}</b>\n📍 {f['country']} — {f['city']} · 💵 {f['price']} · 🗓 {f['dates']}"
+    if f["board"]:
+        line += f" · 🍽 {f['board']}"
+    return line
+
+
 def _letters_digits_ratio(s: str) -> float:
     import re
     if not s:
@@ -1762,27 +2216,86 @@ def safe_title(t: dict) -> str:
 async def send_tour_card(chat_id: int, user_id: int, tour: dict):
     fav = is_favorite(user_id, tour["id"]) 
     kb = tour_inline_kb(tour, fav, user_id)
-    caption = build_card_text(tour, lang=_lang(user_id))
+    caption = build_card_text(tour)
     await bot.send_message(chat_id, caption, reply_markup=kb, disable_web_page_preview=True)
 
-import asyncio
-from typing import List
+# ================= КОМПАКТНЫЙ СПИСОК =================
+# "cards" — по карточке на тур (как раньше), "list" — вся страница одним сообщением
+RESULTS_VIEW = (os.getenv("RESULTS_VIEW", "cards") or "cards").strip().lower()
+
+
+def favorite_ids(user_id: int, tour_ids: list[int]) -> set[int]:
+    if not tour_ids:
+        return set()
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT tour_id FROM favorites WHERE user_id=%s AND tour_id = ANY(%s);",
+            (user_id, list(tour_ids)),
+        )
+        return {r["tour_id"] for r in cur.fetchall()}
+
+
+def _list_fav_btn(n: int, tour_id: int, is_fav: bool) -> InlineKeyboardButton:
+    return InlineKeyboardButton(
+        text=f"{'❤️' if is_fav else '🤍'} {n}",
+        callback_data=f"lfav:{'rm' if is_fav else 'add'}:{tour_id}",
+    )
+
+
+def compact_page_kb(rows: list[dict], fav: set[int], token: str, next_offset: int, uid: int,
+                    start: int) -> InlineKeyboardMarkup:
+    kb_rows = []
+    for i, tour in enumerate(rows, start=start):
+        tid = tour["id"]
+        kb_rows.append([
+            InlineKeyboardButton(text=f"🔎 {i}", callback_data=f"open:{tid}"),
+            _list_fav_btn(i, tid, tid in fav),
+            InlineKeyboardButton(text=f"📝 {i}", callback_data=f"want:{tid}"),
+        ])
+    kb_rows.append([InlineKeyboardButton(text=t(uid, "more.next"), callback_data=f"more:{token}:{next_offset}")])
+    kb_rows.append([InlineKeyboardButton(text=t(uid, "back"), callback_data="back_filters")])
+    return InlineKeyboardMarkup(inline_keyboard=kb_rows)
+
+
+async def send_batch_list(chat_id: int, user_id: int, rows: list[dict], token: str, next_offset: int):
+    """Страница подборки одним HTML-сообщением: 1 вызов API вместо 7."""
+    start = max(1, next_offset - len(rows) + 1)
+    lines = [build_compact_line(i, tour) for i, tour in enumerate(rows, start=start)]
+    lines.append(f"\n{t(user_id, 'more.title')}")
+    fav = favorite_ids(user_id, [r["id"] for r in rows])
+
+    LAST_RESULTS[user_id] = rows
+    LAST_QUERY_AT[user_id] = time.monotonic()
+
+    with outbound_priority(PRIO_BULK):
+        await bot.send_message(
+            chat_id,
+            "\n\n".join(lines),
+            reply_markup=compact_page_kb(rows, fav, token, next_offset, user_id, start),
+            disable_web_page_preview=True,
+        )
+    return True
+
 
 async def send_batch_cards(chat_id: int, user_id: int, rows: list[dict], token: str, next_offset: int):
     if not rows:
         return False
-    for t in rows:
-        await send_tour_card(chat_id, user_id, t)
-        await asyncio.sleep(0)
+    if RESULTS_VIEW == "list":
+        return await send_batch_list(chat_id, user_id, rows, token, next_offset)
 
-    LAST_RESULTS[user_id] = rows
-    LAST_QUERY_AT[user_id] = time.monotonic()
+    # пачка карточек — низкий приоритет: ответы другим пользователям пойдут раньше
+    with outbound_priority(PRIO_BULK):
+        for t in rows:
+            await send_tour_card(chat_id, user_id, t)
 
-    await bot.send_message(
-        chat_id,
-        "Продолжить подборку?",
-        reply_markup=more_kb(token, next_offset, user_id),
-    )
+        LAST_RESULTS[user_id] = rows
+        LAST_QUERY_AT[user_id] = time.monotonic()
+
+        await bot.send_message(
+            chat_id,
+            "Продолжить подборку?",
+            reply_markup=more_kb(token, next_offset, user_id),
+        )
     return True
 
 # ===== Общие хелперы для админ-уведомлений =====
@@ -1823,7 +2336,71 @@ def _compose_tour_block(t: dict) -> tuple[str, str | None]:
     return text, photo
 
 
-async def _send_to_admin_group(text: str, photo: str | None, pin: bool = False):
+# ===== file_id фото туров: Telegram скачивает картинку по URL один раз =====
+# photo_url → file_id; пустая строка в кэше — «в БД нет» (чтобы не ходить в БД повторно)
+TOUR_MEDIA_CACHE = LRUCache(maxsize=int(os.getenv("TOUR_MEDIA_CACHE_SIZE", "5000")))
+
+
+def _load_file_id(photo_url: str) -> Optional[str]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT file_id FROM tour_media WHERE photo_url=%s;", (photo_url,))
+        row = cur.fetchone()
+        return row["file_id"] if row else None
+
+
+def _store_file_id(photo_url: str, file_id: str, file_unique_id: Optional[str]) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            INSERT INTO tour_media (photo_url, file_id, file_unique_id) VALUES (%s, %s, %s)
+            ON CONFLICT (photo_url) DO UPDATE
+               SET file_id = EXCLUDED.file_id, file_unique_id = EXCLUDED.file_unique_id, updated_at = now();
+            """,
+            (photo_url, file_id, file_unique_id),
+        )
+
+
+async def _photo_file_id(photo_url: str) -> Optional[str]:
+    cached = TOUR_MEDIA_CACHE.get(photo_url)
+    TRACER.current_span().tag("tour_media.cache_hit", cached is not None)
+    if cached is not None:
+        return cached or None
+    try:
+        file_id = await asyncio.to_thread(_load_file_id, photo_url)
+    except Exception as e:
+        logging.warning(f"tour_media lookup failed: {e}")
+        return None
+    TOUR_MEDIA_CACHE.put(photo_url, file_id or "")
+    return file_id
+
+
+async def _remember_file_id(photo_url: str, msg) -> None:
+    sizes = getattr(msg, "photo", None) or []
+    if not sizes:
+        return
+    best = sizes[-1]  # самое большое превью
+    TOUR_MEDIA_CACHE.put(photo_url, best.file_id)
+    try:
+        await asyncio.to_thread(_store_file_id, photo_url, best.file_id, best.file_unique_id)
+    except Exception as e:
+        logging.warning(f"tour_media store failed: {e}")
+
+
+async def send_tour_photo(chat_id, photo_url: str, **kwargs):
+    """send_photo с переиспользованием file_id; протухший file_id → повтор по URL."""
+    file_id = await _photo_file_id(photo_url)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id, photo=file_id, **kwargs)
+        except TelegramBadRequest as e:
+            logging.info(f"cached file_id rejected for {photo_url}: {e}")
+            TOUR_MEDIA_CACHE.put(photo_url, "")
+    msg = await bot.send_photo(chat_id, photo=photo_url, **kwargs)
+    await _remember_file_id(photo_url, msg)
+    return msg
+
+
+async def _send_to_admin_group(text: str, photo: str | None, pin: bool = False):
     chat_id = resolve_leads_chat_id()
     if not chat_id:
         logging.warning("admin notify: LEADS_CHAT_ID не задан")
@@ -1831,34 +2408,71 @@ async def _send_to_admin_group(text: str, photo: str | None, pin: bool = False):
     kwargs = {}
     if LEADS_TOPIC_ID:
         kwargs["message_thread_id"] = LEADS_TOPIC_ID
-    if photo:
-        # телега ограничивает длину подписи, страхуемся
-        short = text if len(text) <= 1000 else (text[:990].rstrip() + "…")
-        msg = await bot.send_photo(chat_id, photo=photo, caption=short, parse_mode="HTML", **kwargs)
-    else:
-        msg = await bot.send_message(
-            chat_id, text, parse_mode="HTML", disable_web_page_preview=True, **kwargs
-        )
-    if pin:
-        try:
-            await bot.pin_chat_message(chat_id, msg.message_id, disable_notification=True)
-        except Exception as e:
-            logging.warning(f"pin failed: {e}")
+    with outbound_priority(PRIO_ADMIN):
+        if photo:
+            # телега ограничивает длину подписи, страхуемся
+            short = text if len(text) <= 1000 else (text[:990].rstrip() + "…")
+            msg = await send_tour_photo(chat_id, photo, caption=short, parse_mode="HTML", **kwargs)
+        else:
+            msg = await bot.send_message(
+                chat_id, text, parse_mode="HTML", disable_web_page_preview=True, **kwargs
+            )
+        if pin:
+            try:
+                await bot.pin_chat_message(chat_id, msg.message_id, disable_notification=True)
+            except Exception as e:
+                logging.warning(f"pin failed: {e}")
+
+
+# ===== Дайджест всплесков в админ-группу =====
+# первые ADMIN_DIGEST_IMMEDIATE событий за окно — отдельными сообщениями, остальное — одним списком
+async def _send_admin_digest(lines: list[str]):
+    # длину держит сам BurstDigest (max_chars): строки целые, HTML-теги не рвутся
+    text = f"📦 <b>Сводка: {len(lines)} событий</b>\n\n" + "\n".join(lines)
+    await _send_to_admin_group(text, None, pin=False)
+
+
+ADMIN_DIGEST = BurstDigest(
+    _send_admin_digest,
+    window=float(os.getenv("ADMIN_DIGEST_WINDOW_SEC", "60")),
+    max_immediate=int(os.getenv("ADMIN_DIGEST_IMMEDIATE", "5")),
+    max_lines=int(os.getenv("ADMIN_DIGEST_MAX_LINES", "25")),
+    max_chars=3900,  # лимит Telegram 4096 минус заголовок сводки
+)
+
+
+def _tour_short(t: dict) -> str:
+    return f"{safe(t.get('country'))} — {safe(t.get('city'))}, {fmt_price(t.get('price'), t.get('currency'))}"
 
 
 # ===== Конкретные уведомления =====
 
 async def notify_leads_group(t: dict, *, lead_id: int, user, phone: str, pin: bool = False):
     try:
-        user_label = _admin_user_label(user)
-        tour_block, photo = _compose_tour_block(t)
-        head = f"🆕 <b>Заявка №{lead_id}</b>\n👤 {escape(user_label)}\n📞 {escape(phone)}"
-        text = f"{head}\n{tour_block}"
-        await _send_to_admin_group(text, photo, pin=pin)
+        await _notify_leads_group(t, lead_id=lead_id, user=user, phone=phone, pin=pin)
     except Exception as e:
         logging.error(f"notify_leads_group failed: {e}")
 
 
+async def _notify_leads_group(t: dict, *, lead_id: int, user, phone: str, pin: bool = False):
+    user_label = _admin_user_label(user)
+    tour_block, photo = _compose_tour_block(t)
+    head = f"🆕 <b>Заявка №{lead_id}</b>\n👤 {escape(user_label)}\n📞 {escape(phone)}"
+    text = f"{head}\n{tour_block}"
+    line = f"🆕 <b>№{lead_id}</b> · {escape(user_label)} · {escape(phone)} · {_tour_short(t)}"
+    await ADMIN_DIGEST.submit(lambda: _send_to_admin_group(text, photo, pin=pin), line)
+
+
+# якорь ключа ответа в сообщениях бота; в тексте (без HTML) выглядит как «🔑#ключ» —
+# по нему и ищем, чтобы #хэштеги из текста вопроса не принимались за ключ.
+# <code>#ключ — прежний формат: реплаи на сообщения, отправленные до обновления (убрать через релиз)
+ANSWER_ANCHOR_RE = re.compile(r"(?:🔑|<code>)#([A-Za-z0-9_\-]{5,})")
+
+
+def _answer_anchor(answer_key: str) -> str:
+    return f"🔑<code>#{answer_key}</code>"
+
+
 async def notify_question_group(t: dict, *, user, question: str, answer_key: str):
     try:
         user_label = _admin_user_label(user)
@@ -1867,14 +2481,160 @@ async def notify_question_group(t: dict, *, user, question: str, answer_key: str
             f"❓ <b>Вопрос по туру</b>\n"
             f"👤 от {escape(user_label)}\n"
             f"📝 {escape(question)}\n\n"
-            f"🧩 Ответьте реплаем на это сообщение и начните с <code>#{answer_key}</code>"
+            f"🧩 Ответьте реплаем на это сообщение: {_answer_anchor(answer_key)}"
         )
         text = f"{head}\n\n{tour_block}"
-        await _send_to_admin_group(text, photo, pin=False)
+        # в сводке ключей несколько — реплай на неё должен начинаться с явного #ключа
+        line = (
+            f"❓ {escape(user_label)}: {escape(question[:200])} · {_tour_short(t)} · "
+            f"{_answer_anchor(answer_key)}"
+        )
+        await ADMIN_DIGEST.submit(lambda: _send_to_admin_group(text, photo, pin=False), line, wait=False)
     except Exception as e:
         logging.error(f"notify_question_group failed: {e}")
 
 
+# ===== Outbox заявок: уведомление админам + Google Sheets в фоне =====
+# Заявка и её задачи пишутся одной транзакцией; пользователь получает «Принято!» сразу,
+# а воркер доставляет побочные эффекты с ретраями. UNIQUE(lead_id, kind) — идемпотентность.
+LEAD_JOB_KINDS = ("notify", "sheet")
+LEAD_JOB_MAX_ATTEMPTS = int(os.getenv("LEAD_JOB_MAX_ATTEMPTS", "8"))
+LEAD_JOBS_POLL_SEC = float(os.getenv("LEAD_JOBS_POLL_SEC", "10"))
+# аренда взятой задачи: дольше окна дайджеста, иначе задачу, ждущую сводку, подберёт второй воркер
+LEAD_JOB_LEASE_SEC = float(os.getenv("LEAD_JOB_LEASE_SEC", str(int(ADMIN_DIGEST.window) + 60)))
+# пауза перед повтором упавшей задачи: LEAD_JOB_BACKOFF_MIN_SEC * 2^(попытка-1), не больше 15 минут
+LEAD_JOB_BACKOFF_MIN_SEC = float(os.getenv("LEAD_JOB_BACKOFF_MIN_SEC", "10"))
+LEAD_JOBS_WAKE = asyncio.Event()
+LEAD_JOBS_STOP = asyncio.Event()  # остановка: дорабатываем взятую пачку и выходим
+
+
+def create_lead_with_jobs(tour_id: int, phone: Optional[str], full_name: str, user,
+                          note: Optional[str] = None) -> Optional[int]:
+    payload = {
+        "tour_id": tour_id,
+        "phone": phone,
+        "user": {
+            "id": getattr(user, "id", None),
+            "username": getattr(user, "username", None),
+            "first_name": getattr(user, "first_name", None),
+            "last_name": getattr(user, "last_name", None),
+        },
+    }
+    try:
+        with get_conn() as conn, conn.transaction(), conn.cursor() as cur:
+            cur.execute(
+                """
+                INSERT INTO leads (full_name, phone, tour_id, note)
+                VALUES (%s, %s, %s, %s)
+                RETURNING id;
+                """,
+                (full_name, phone, tour_id, note),
+            )
+            lead_id = cur.fetchone()["id"]
+            cur.executemany(
+                """
+                INSERT INTO lead_jobs (lead_id, kind, payload) VALUES (%s, %s, %s)
+                ON CONFLICT (lead_id, kind) DO NOTHING;
+                """,
+                [(lead_id, kind, Jsonb(payload)) for kind in LEAD_JOB_KINDS],
+            )
+            return lead_id
+    except Exception as e:
+        logging.error(f"create_lead_with_jobs failed: {e}")
+        return None
+
+
+def _claim_lead_jobs(limit: int = 10) -> list[dict]:
+    """Берём готовые задачи; сдвиг next_attempt_at работает как аренда (упали — подберём позже)."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE lead_jobs
+               SET attempts = attempts + 1,
+                   next_attempt_at = now() + make_interval(secs => %s)
+             WHERE id IN (
+                   SELECT id FROM lead_jobs
+                    WHERE status = 'pending' AND next_attempt_at <= now()
+                    ORDER BY id
+                    LIMIT %s
+                    FOR UPDATE SKIP LOCKED)
+            RETURNING id, lead_id, kind, payload, attempts;
+            """,
+            (LEAD_JOB_LEASE_SEC, limit),
+        )
+        return cur.fetchall()
+
+
+def _finish_lead_job(job_id: int, attempts: int, error: Optional[str] = None) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        if error is None:
+            cur.execute("UPDATE lead_jobs SET status='done', done_at=now(), last_error=NULL WHERE id=%s;", (job_id,))
+        else:
+            status = "failed" if attempts >= LEAD_JOB_MAX_ATTEMPTS else "pending"
+            # аренда отработала — повтор по своему бэкоффу, а не через LEAD_JOB_LEASE_SEC
+            cur.execute(
+                """
+                UPDATE lead_jobs
+                   SET status=%s, last_error=%s,
+                       next_attempt_at = now() + make_interval(
+                           secs => LEAST(900, %s * power(2, GREATEST(attempts - 1, 0))))
+                 WHERE id=%s;
+                """,
+                (status, error[:500], LEAD_JOB_BACKOFF_MIN_SEC, job_id),
+            )
+
+
+def _fetch_tour_sync(tour_id: int) -> Optional[dict]:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT {_select_tours_clause()} FROM tours WHERE id=%s;", (tour_id,))
+        return cur.fetchone()
+
+
+async def _run_lead_job(job: dict) -> None:
+    payload = job["payload"] or {}
+    lead_id = int(job["lead_id"])
+    error = None
+    try:
+        t = await asyncio.to_thread(_fetch_tour_sync, int(payload.get("tour_id") or 0))
+        if t:  # тура нет — слать нечего (как и раньше)
+            u = payload.get("user") or {}
+            user = SimpleNamespace(
+                id=u.get("id"), username=u.get("username"),
+                first_name=u.get("first_name") or "", last_name=u.get("last_name") or "",
+            )
+            phone = payload.get("phone") or ""
+            if job["kind"] == "notify":
+                await _notify_leads_group(t, lead_id=lead_id, user=user, phone=phone, pin=False)
+            elif job["kind"] == "sheet":
+                await asyncio.to_thread(
+                    _append_lead_row, lead_id, user, phone, t, skip_if_present=job["attempts"] > 1
+                )
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        logging.warning(f"lead job #{job['id']} ({job['kind']}, lead {lead_id}) attempt {job['attempts']} failed: {error}")
+    await asyncio.to_thread(_finish_lead_job, job["id"], job["attempts"], error)
+
+
+async def lead_jobs_worker():
+    while not LEAD_JOBS_STOP.is_set():
+        LEAD_JOBS_WAKE.clear()
+        try:
+            jobs = await asyncio.to_thread(_claim_lead_jobs, 10)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"lead_jobs_worker: claim failed: {e}")
+            jobs = []
+        # параллельно: уведомления, попавшие в дайджест, уходят одним сообщением
+        await asyncio.gather(*(_run_lead_job(job) for job in jobs))
+        if jobs:
+            continue
+        try:
+            await asyncio.wait_for(LEAD_JOBS_WAKE.wait(), timeout=LEAD_JOBS_POLL_SEC)
+        except asyncio.TimeoutError:
+            pass
+
+
 def _format_q_header(qid: int) -> str:
     return f"❓ <b>Вопрос по туру</b>  [Q#{qid}]"
 
@@ -1908,13 +2668,17 @@ def _is_menu_text(txt: str) -> bool:
 
 
 # === helper: «пульс» индикатора набора ===
-async def _typing_pulse(chat_id: int):
-    try:
-        while True:
-            await bot.send_chat_action(chat_id, "typing")
-            await asyncio.sleep(4.0)
-    except asyncio.CancelledError:
-        pass
+async def _send_typing(chat_id: int):
+    with outbound_priority(PRIO_BULK):
+        await bot.send_chat_action(chat_id, "typing")
+
+
+# один цикл на все чаты: «печатает…» раз в 4 с, пока чат занят
+TYPING = TypingTicker(
+    _send_typing,
+    interval=float(os.getenv("TYPING_INTERVAL_SEC", "4")),
+    skip=TG_OUTBOUND.is_paused,
+)
 
 # ==== ЯЗЫК/LOCALE ХЕЛПЕРЫ ====
 
@@ -1997,8 +2761,23 @@ async def cmd_setleadgroup(message: Message):
         await message.reply("Неверный chat_id.")
         return
     set_config("LEADS_CHAT_ID", new_id)
+    resolve_leads_chat_id()  # обновить id для classify_update
     await message.reply(f"LEADS_CHAT_ID обновлён: {new_id}")
 
+@dp.message(Command("outq"))
+async def cmd_outq(message: Message):
+    if message.from_user.id != ADMIN_USER_ID:
+        await message.reply("Недостаточно прав.")
+        return
+    st = {
+        "outbound": TG_OUTBOUND.stats(),
+        "admin_digest": ADMIN_DIGEST.stats(),
+        "updates": {**UPDATE_POOL.stats(), "duplicates": RECENT_UPDATES.duplicates},
+        "typing": TYPING.stats(),
+        "tiers": TIER_STATS,
+    }
+    await message.reply(f"<pre>{escape(json.dumps(st, ensure_ascii=False, indent=1))}</pre>")
+
 @dp.message(Command("leadstest"))
 async def cmd_leadstest(message: Message):
     if message.from_user.id != ADMIN_USER_ID:
@@ -2153,14 +2932,8 @@ async def cb_country(call: CallbackQuery):
         await call.answer()
         return
 
+    # кнопку «показать ещё» send_batch_cards добавляет сам
     await send_batch_cards(call.message.chat.id, uid, rows, token, len(rows))
-
-    kb_more = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text=t(uid, "more.next"),
-                              callback_data=f"more:{token}:{len(rows)}")],
-        [InlineKeyboardButton(text=t(uid, "back"), callback_data="back_filters")],
-    ])
-    await call.message.answer(t(uid, "more.title"), reply_markup=kb_more)
     await call.answer()
 
 @dp.callback_query(F.data.startswith("sub:"))
@@ -2289,8 +3062,6 @@ async def cb_budget(call: CallbackQuery):
         return
 
     await send_batch_cards(call.message.chat.id, uid, rows, token, len(rows))
-    await call.message.answer("Продолжить подборку?",
-                              reply_markup=more_kb(token, len(rows), uid))
     await call.answer()
 
 @dp.callback_query(F.data == "sort:price_asc")
@@ -2391,6 +3162,58 @@ async def cb_fav_rm(call: CallbackQuery):
         # после удаления показываем кнопку «добавить», т.е. is_fav=False
         await call.message.edit_reply_markup(reply_markup=tour_inline_kb(t, False, call.from_user.id))
 
+@dp.callback_query(F.data.startswith("open:"))
+async def cb_open(call: CallbackQuery):
+    """Из компактного списка — полная карточка тура."""
+    try:
+        tour_id = int(call.data.split(":", 1)[1])
+    except Exception:
+        await call.answer("Не удалось открыть тур.", show_alert=False)
+        return
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(f"SELECT {_select_tours_clause()} FROM tours WHERE id=%s;", (tour_id,))
+        tour = cur.fetchone()
+    if not tour:
+        await call.answer("Тур уже недоступен.", show_alert=False)
+        return
+    await call.answer()
+    await send_tour_card(call.message.chat.id, call.from_user.id, tour)
+
+
+@dp.callback_query(F.data.startswith("lfav:"))
+async def cb_list_fav(call: CallbackQuery):
+    """Избранное из компактного списка: меняем только одну кнопку в клавиатуре страницы."""
+    try:
+        _, action, tid_s = call.data.split(":", 2)
+        tour_id = int(tid_s)
+    except Exception:
+        await call.answer("Ошибка избранного.", show_alert=False)
+        return
+    uid = call.from_user.id
+    if action == "add":
+        set_favorite(uid, tour_id)
+        await call.answer("Добавлено в избранное ❤️", show_alert=False)
+    else:
+        unset_favorite(uid, tour_id)
+        await call.answer("Убрано из избранного 🤍", show_alert=False)
+
+    markup = call.message.reply_markup
+    if not markup:
+        return
+    rows = []
+    for row in markup.inline_keyboard:
+        new_row = []
+        for btn in row:
+            if btn.callback_data == call.data:
+                n = int((btn.text or "0").split()[-1] or 0)
+                btn = _list_fav_btn(n, tour_id, action == "add")
+            new_row.append(btn)
+        rows.append(new_row)
+    try:
+        await call.message.edit_reply_markup(reply_markup=InlineKeyboardMarkup(inline_keyboard=rows))
+    except TelegramBadRequest:
+        pass
+
 from aiogram.types import CallbackQuery, ReplyKeyboardRemove
 
 @dp.callback_query(F.data.startswith("lang:"))
@@ -2416,7 +3239,7 @@ async def cb_lang(call: CallbackQuery):
         last_tours = []
     if last_tours:
         tour = last_tours[0]
-        caption = build_card_text(tour, lang=lang)
+        caption = build_card_text(tour)
         fav = is_favorite(uid, tour["id"])
         kb = tour_inline_kb(tour, fav, uid)
         try:
@@ -2517,21 +3340,11 @@ async def on_contact(message: Message):
             or (f"@{message.from_user.username}" if message.from_user.username else "Telegram user")
         )
 
-    lead_id = create_lead(tour_id, phone, full_name, note="from contact share")
+    # заявка + задачи outbox одной транзакцией; уведомление и Sheets доставит lead_jobs_worker
+    lead_id = create_lead_with_jobs(tour_id, phone, full_name, message.from_user, note="from contact share")
 
-    with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(
-            f"""
-            SELECT {_select_tours_clause()}
-            FROM tours WHERE id=%s;
-        """,
-            (tour_id,),
-        )
-        t = cur.fetchone()
-
-    if t and lead_id:
-        await notify_leads_group(t, lead_id=lead_id, user=message.from_user, phone=phone, pin=False)
-        append_lead_to_sheet(lead_id, message.from_user, phone, t)
+    if lead_id:
+        LEAD_JOBS_WAKE.set()
         await message.answer(
             f"Принято! Заявка №{lead_id}. Менеджер скоро свяжется 📞",
             reply_markup=main_kb_for(message.from_user.id)
@@ -2643,9 +3456,8 @@ async def smart_router(message: Message):
     if any(is_menu_label(user_text, k) for k in ("menu_find", "menu_gpt", "menu_sub", "menu_settings")):
         return
 
-    # пульс «печатает…» на время обработки
-    pulse = asyncio.create_task(_typing_pulse(message.chat.id))
-    try:
+    # «печатает…» на время обработки
+    async with TYPING.busy(message.chat.id):
         # быстрые источники по фразам «ссылка/источник»
         if re.search(r"\b((дай\s+)?ссылк\w*|источник\w*|link)\b", user_text, flags=re.I):
             last = LAST_RESULTS.get(message.from_user.id) or []
@@ -2769,9 +3581,6 @@ async def smart_router(message: Message):
         )
         return
 
-    finally:
-        pulse.cancel()
-
 # ---- helpers ----
 def _extract_answer_key_from_message(msg: Message) -> Optional[str]:
     """Ищем #ключ в самом сообщении и/или в том, на которое ответили (text/caption)."""
@@ -2787,9 +3596,13 @@ def _extract_answer_key_from_message(msg: Message) -> Optional[str]:
         return key
 
     # 2) пробуем в исходном сообщении, на которое сделали reply
+    #    (в сводке ключей несколько — тогда без явного #ключа в ответе не угадываем)
     r = getattr(msg, "reply_to_message", None)
     if r:
-        return _find(getattr(r, "text", None)) or _find(getattr(r, "caption", None))
+        # html_text восстанавливает <code> из entities — так находится и якорь старого формата
+        src = getattr(r, "html_text", None) or getattr(r, "text", None) or getattr(r, "caption", None) or ""
+        keys = ANSWER_ANCHOR_RE.findall(src)
+        return keys[0] if len(set(keys)) == 1 else None
     return None
 
 # ответ админа из группы: ДОЛЖЕН быть reply на сообщение бота (ключ можно не писать)
@@ -2837,38 +3650,619 @@ async def on_admin_group_answer(message: Message):
 async def root():
     return {"status": "ok", "message": "TripleA Travel Bot is running!"}
 
-@app.post(WEBHOOK_PATH)
-async def webhook(request: Request):
+def _update_chat_key(update: Update) -> int:
+    """Ключ упорядочивания: чат события, иначе автор, иначе сам update_id."""
+    event = update.event
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    if chat is not None:
+        return chat.id
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    return update.update_id
+
+
+RECENT_UPDATES = RecentIds(UPDATE_DEDUP_WINDOW)
+_DEDUP_DB_CLAIMS = 0
+
+
+def _claim_update_db(update_id: int) -> bool:
+    """True — апдейт видим впервые (на любом инстансе)."""
+    global _DEDUP_DB_CLAIMS
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "INSERT INTO processed_updates (update_id) VALUES (%s) ON CONFLICT DO NOTHING RETURNING update_id;",
+            (update_id,),
+        )
+        fresh = cur.fetchone() is not None
+        _DEDUP_DB_CLAIMS += 1
+        if _DEDUP_DB_CLAIMS % 1000 == 0:
+            # Telegram повторяет доставку максимум сутки — старше хранить незачем
+            cur.execute("DELETE FROM processed_updates WHERE received_at < now() - interval '2 days';")
+        return fresh
+
+
+def _unclaim_update_db(update_id: int) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM processed_updates WHERE update_id=%s;", (update_id,))
+
+
+async def _release_update(update_id: Optional[int]) -> None:
+    """Снять отметку «уже видели» (память и БД), чтобы повторная доставка Telegram отработала."""
+    if update_id is None:
+        return
+    RECENT_UPDATES.discard(update_id)
+    if UPDATE_DEDUP_DB:
+        try:
+            await asyncio.to_thread(_unclaim_update_db, update_id)
+        except Exception as e:
+            logging.warning(f"update dedup (db) release failed for {update_id}: {e}")
+
+
+async def _is_new_update(update_id: Optional[int]) -> bool:
+    if update_id is None:
+        return True
+    if not RECENT_UPDATES.add(update_id):
+        return False
+    if UPDATE_DEDUP_DB:
+        try:
+            if not await asyncio.to_thread(_claim_update_db, update_id):
+                RECENT_UPDATES.duplicates += 1
+                return False
+        except Exception as e:
+            logging.warning(f"update dedup (db) failed, processing anyway: {e}")
+    return True
+
+
+# --- Апдейты, не обработанные к остановке, сохраняем в БД и доигрываем на старте
+# (Telegram уже получил 200 и повторно их не пришлёт)
+_DRAINING = False
+
+
+def ensure_webhook_spool_schema():
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            CREATE TABLE IF NOT EXISTS webhook_spool (
+                update_id  BIGINT PRIMARY KEY,
+                payload    JSONB NOT NULL,
+                spooled_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+            """
+        )
+        # аренда при доигрывании: строка удаляется только после обработки апдейта
+        cur.execute("ALTER TABLE webhook_spool ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;")
+
+
+def _spool_updates_sync(rows: list[tuple[int, dict]]) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        # уже взятая в аренду строка (не успели доиграть) снова становится свободной
+        cur.executemany(
+            "INSERT INTO webhook_spool (update_id, payload) VALUES (%s, %s) "
+            "ON CONFLICT (update_id) DO UPDATE SET claimed_at = NULL;",
+            [(uid, Jsonb(payload)) for uid, payload in rows],
+            name="webhook_spool.put",
+        )
+
+
+def _take_spooled_sync(limit: int) -> list[dict]:
+    """Взять строки в аренду на SPOOL_LEASE_SEC; удаляются после обработки (_spool_ack_sync).
+    Упали между арендой и обработкой — по истечении аренды строку доиграет любой инстанс."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            """
+            UPDATE webhook_spool SET claimed_at = now()
+             WHERE update_id IN (
+                   SELECT update_id FROM webhook_spool
+                    WHERE claimed_at IS NULL OR claimed_at < now() - make_interval(secs => %s)
+                    ORDER BY update_id LIMIT %s FOR UPDATE SKIP LOCKED)
+            RETURNING update_id, payload;
+            """,
+            (SPOOL_LEASE_SEC, limit),
+            name="webhook_spool.take",
+        )
+        return sorted(cur.fetchall(), key=lambda r: r["update_id"])
+
+
+def _spool_ack_sync(update_id: int) -> None:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM webhook_spool WHERE update_id=%s;", (update_id,), name="webhook_spool.ack")
+
+
+async def _spool_ack(update_id: int) -> None:
+    _SPOOL_CLAIMED.discard(update_id)
     try:
-        update = await request.json()
-        await dp.feed_webhook_update(bot, update)
-        await asyncio.sleep(0)
+        await asyncio.to_thread(_spool_ack_sync, update_id)
     except Exception as e:
-        logging.error(f"Webhook error: {e}")
-        return JSONResponse({"status": "error", "message": str(e)}, status_code=500)
-    return JSONResponse({"status": "ok"})
+        logging.warning(f"webhook spool: ack {update_id} failed, will replay after lease: {e}")
 
 
-# ================= START/STOP =================
-@app.on_event("startup")
-async def on_startup():
+async def _spool_unfinished(items: list[tuple]) -> int:
+    rows = [(u.update_id, u.model_dump(mode="json", exclude_none=True)) for u, _tier, _at in items]
+    if not rows:
+        return 0
     try:
-        init_db()
+        await asyncio.to_thread(_spool_updates_sync, rows)
     except Exception as e:
-        logging.error(f"Ошибка init_db(): {e}")
+        logging.error(f"webhook spool: {len(rows)} updates lost: {e}")
+        return 0
+    return len(rows)
+
+
+SPOOL_REPLAY_SEC = float(os.getenv("WEBHOOK_SPOOL_REPLAY_SEC", "30"))
+SPOOL_REPLAY_BATCH = 200
+SPOOL_LEASE_SEC = float(os.getenv("WEBHOOK_SPOOL_LEASE_SEC", "300"))
+_SPOOL_CLAIMED: set[int] = set()  # update_id, взятые этим инстансом из спула и ещё не обработанные
 
+
+async def replay_spooled_updates() -> int:
+    """Перекладывать сохранённые апдейты в пул, пока в спуле есть свободные строки (аренда +
+    SKIP LOCKED — каждый достанется одному инстансу). Берём не больше, чем есть места в очереди."""
+    done = 0
+    while not _DRAINING:
+        room = min(SPOOL_REPLAY_BATCH, UPDATE_POOL.max_queue // 2 - UPDATE_POOL.depth())
+        if room <= 0:
+            await asyncio.sleep(1)
+            continue
+        try:
+            rows = await asyncio.to_thread(_take_spooled_sync, room)
+        except Exception as e:
+            logging.warning(f"webhook spool replay failed: {e}")
+            break
+        if not rows:
+            break
+        back = []
+        # от новых к старым и в голову очереди чата: доигрываемые апдейты старше живых, уже
+        # ждущих в пуле, и должны обработаться раньше них (порядок внутри чата — как у Telegram)
+        for r in reversed(rows):
+            try:
+                update = Update.model_validate(r["payload"], context={"bot": bot})
+            except Exception as e:
+                logging.error(f"webhook spool: bad update {r['update_id']}: {e}")
+                await _spool_ack(r["update_id"])
+                continue
+            item = (update, classify_update(update), time.monotonic())
+            key = _update_chat_key(update)
+            _SPOOL_CLAIMED.add(update.update_id)
+            if UPDATE_POOL.submit(key, item, priority=item[1], front=UPDATE_POOL.has_key(key)):
+                RECENT_UPDATES.add(update.update_id)
+                done += 1
+            else:
+                _SPOOL_CLAIMED.discard(update.update_id)
+                back.append(item)
+        if back:  # очередь заполнили вебхуки — вернём и подождём
+            await _spool_unfinished(back)
+            await asyncio.sleep(1)
+    return done
+
+
+async def webhook_spool_replayer():
+    """Спул пополняется и после нашего старта (старый инстанс при rolling-деплое) — проверяем периодически."""
+    while True:
+        n = await replay_spooled_updates()
+        if n:
+            logging.info(f"♻️ Доигрываю {n} апдейтов из webhook_spool")
+        await asyncio.sleep(SPOOL_REPLAY_SEC)
+
+
+# ===== Приоритеты апдейтов и сброс нагрузки =====
+# тиры и классификация — utils.tiers; здесь — настройки и привязка к состоянию бота
+# лимиты одновременной обработки по тирам проверяются пулом ДО выдачи воркера (см. KeyedWorkerPool)
+_tier_env = os.getenv("UPDATE_TIER_CONCURRENCY", "").strip()
+TIER_LIMITS = [int(x) for x in _tier_env.split(",")][: len(TIER_NAMES)] if _tier_env else default_tier_limits(WEBHOOK_WORKERS)
+TIER_LIMITS += TIER_LIMITS[-1:] * (len(TIER_NAMES) - len(TIER_LIMITS))
+if sum(TIER_LIMITS[1:]) >= WEBHOOK_WORKERS:
+    logging.warning(f"UPDATE_TIER_CONCURRENCY={TIER_LIMITS}: не-core тиры могут занять все {WEBHOOK_WORKERS} воркеров")
+# если апдейт ждал в очереди дольше порога — тиры от SHED_MIN_TIER получают быстрый «занят»
+SHED_LATENCY_SEC = float(os.getenv("SHED_LATENCY_SEC", "8"))
+SHED_MIN_TIER = int(os.getenv("SHED_MIN_TIER", str(TIER_SEARCH)))
+TIER_STATS = {name: {"done": 0, "shed": 0, "wait_max_ms": 0.0} for name in TIER_NAMES}
+
+
+def _is_leads_chat(chat_id: int) -> bool:
+    # без похода в БД на горячем пути: id, который видели в последний раз; пока не видели —
+    # любая группа (в личке reply пользователя остаётся обычным тиром)
+    return chat_id == _LEADS_CHAT_ID_SEEN if _LEADS_CHAT_ID_SEEN else chat_id < 0
+
+
+def classify_update(update: Update) -> int:
+    return _classify_update(
+        update, is_admin_chat=_is_leads_chat, asking=ASK_STATE.__contains__, is_menu=_is_menu_text,
+    )
+
+
+async def _shed_update(update: Update):
+    busy = "⏳ Сейчас очень много запросов — попробуй ещё раз через минуту."
     try:
-        ensure_orders_columns()
+        if update.callback_query is not None:
+            await update.callback_query.answer(busy, show_alert=False)
+        elif update.message is not None:
+            await bot.send_message(update.message.chat.id, busy)
     except Exception as e:
-        logging.error(f"orders ensure failed: {e}")
+        logging.debug(f"shed reply failed: {e}")
+
+
+# Трассировка апдейтов и RPC Payme (TRACING=1): спаны в формате Zipkin v2, по строке JSON в TRACE_FILE;
+# TRACE_COLLECTOR_URL — дополнительно слать батчи в Zipkin/Jaeger (…/api/v2/spans)
+TRACER.configure(
+    enabled=os.getenv("TRACING", "0").strip().lower() in ("1", "true", "yes"),
+    sample_rate=float(os.getenv("TRACE_SAMPLE_RATE", "0.1")),
+    path=os.getenv("TRACE_FILE", "/tmp/bot_traces.jsonl"),
+    max_bytes=int(os.getenv("TRACE_FILE_MAX_MB", "20")) * 1024 * 1024,
+    collector_url=os.getenv("TRACE_COLLECTOR_URL", ""),
+    service="tour-bot",
+)
+
+# Выборочный профиль медленных апдейтов (PROFILE_SLOW_UPDATES=1); отчёт — /debug/profile
+PROFILER = SlowProfiler(
+    enabled=os.getenv("PROFILE_SLOW_UPDATES", "0").strip().lower() in ("1", "true", "yes"),
+    threshold=float(os.getenv("PROFILE_SLOW_MS", "1000")) / 1000,
+    sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0.2")),
+    out_path=os.getenv("PROFILE_DUMP_PATH", "/tmp/bot_profile.txt"),
+)
+
 
+async def _process_update(item: tuple):
+    uid = item[0].update_id
+    if uid not in _SPOOL_CLAIMED:
+        return await _handle_update(item)
+    # из спула: строку удаляем, только когда апдейт обработан (или упал с ошибкой —
+    # повтор не поможет); прерванный остановкой доиграется после аренды
     try:
-        ensure_pending_wants_table()
-        ensure_leads_schema()
-        ensure_favorites_schema()
-        ensure_questions_schema()
+        await _handle_update(item)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        await _spool_ack(uid)
+        raise
+    await _spool_ack(uid)
+
+
+async def _handle_update(item: tuple):
+    update, tier, enqueued_at = item
+    st = TIER_STATS[TIER_NAMES[tier]]
+    waited = time.monotonic() - enqueued_at
+    st["wait_max_ms"] = max(st["wait_max_ms"], round(waited * 1000, 1))
+    with TRACER.trace(
+        f"tg.update:{TIER_NAMES[tier]}", update_id=update.update_id, queue_wait_ms=round(waited * 1000, 1)
+    ) as sp:
+        if should_shed(tier, waited, min_tier=SHED_MIN_TIER, latency=SHED_LATENCY_SEC):
+            st["shed"] += 1
+            sp.tag("shed", True)
+            await _shed_update(update)
+            return
+        await PROFILER.run_async(f"update:{TIER_NAMES[tier]}", dp.feed_update, bot, update)
+    st["done"] += 1
+
+
+UPDATE_POOL = KeyedWorkerPool(
+    _process_update, workers=WEBHOOK_WORKERS, max_queue=WEBHOOK_QUEUE_MAX, name="updates", limits=TIER_LIMITS
+)
+
+
+@app.post(WEBHOOK_PATH)
+async def webhook(request: Request):
+    if WEBHOOK_SECRET and not secrets.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET
+    ):
+        return FastJSONResponse({"status": "forbidden"}, status_code=403)
+
+    if _DRAINING:
+        # останавливаемся — пусть Telegram повторит доставку (новому инстансу)
+        return FastJSONResponse({"status": "draining"}, status_code=503)
+
+    if WEBHOOK_MODE != "queue":
+        update_id = None
+        try:
+            # сырые байты сразу в pydantic-модель: без промежуточного dict и повторной валидации
+            update = Update.model_validate_json(await request.body(), context={"bot": bot})
+            update_id = update.update_id
+            if not await _is_new_update(update_id):
+                return FastJSONResponse({"status": "duplicate"})
+            with TRACER.trace("tg.update", update_id=update_id):
+                await PROFILER.run_async("update", dp.feed_webhook_update, bot, update)
+            await asyncio.sleep(0)
+        except Exception as e:
+            logging.error(f"Webhook error: {e}")
+            await _release_update(update_id)  # пусть повторная доставка отработает
+            return FastJSONResponse({"status": "error", "message": str(e)}, status_code=500)
+        return FastJSONResponse({"status": "ok"})
+
+    try:
+        update = Update.model_validate_json(await request.body(), context={"bot": bot})
     except Exception as e:
-        logging.error(f"Schema ensure failed: {e}")
+        # битый апдейт повторная доставка не починит — подтверждаем и забываем
+        logging.error(f"Webhook: invalid update: {e}")
+        return FastJSONResponse({"status": "ignored"})
+
+    if not await _is_new_update(update.update_id):
+        return FastJSONResponse({"status": "duplicate"})
+
+    tier = classify_update(update)
+    if not UPDATE_POOL.submit(_update_chat_key(update), (update, tier, time.monotonic()), priority=tier):
+        # 503 — Telegram повторит доставку позже, когда очередь разгрузится
+        await _release_update(update.update_id)
+        logging.warning(f"Webhook: queue full ({UPDATE_POOL.depth()}), update {update.update_id} deferred")
+        return FastJSONResponse({"status": "busy"}, status_code=503)
+    return FastJSONResponse({"status": "ok"})
+
+
+# ================= METRICS =================
+METRICS_TOKEN = (os.getenv("METRICS_TOKEN") or "").strip()
+# /debug/* отдают стеки и внутренности — без токена не открываем вовсе
+DEBUG_TOKEN = (os.getenv("DEBUG_TOKEN") or METRICS_TOKEN).strip()
+
+
+def _token_ok(request: Request, expected: str) -> bool:
+    token = request.query_params.get("token") or request.headers.get("Authorization", "").removeprefix("Bearer ")
+    return secrets.compare_digest(token, expected)
+
+# Лаг event loop + атрибуция блокирующих вызовов (сторож снимает стек при залипании)
+LOOP_MONITOR = LoopLagMonitor(
+    interval=float(os.getenv("LOOP_MONITOR_INTERVAL_SEC", "0.1")),
+    threshold=float(os.getenv("LOOP_STALL_MS", "200")) / 1000,
+    roots=[os.path.dirname(os.path.abspath(__file__))],
+)
+
+_METRIC_CACHES = {"card_render": CARD_RENDER_CACHE, "tour_media": TOUR_MEDIA_CACHE}
+REGISTRY.gauge("cache_hit_ratio", "Доля попаданий кэша", ("cache",),
+               fn=lambda: {name: c.hit_ratio() for name, c in _METRIC_CACHES.items()})
+REGISTRY.gauge("cache_size", "Число элементов в кэше", ("cache",),
+               fn=lambda: {**{name: len(c) for name, c in _METRIC_CACHES.items()}, "weather": len(WEATHER_CACHE)})
+REGISTRY.gauge("queue_depth", "Глубина очередей", ("queue",), fn=lambda: {
+    "updates": UPDATE_POOL.depth(),
+    "updates_busy": UPDATE_POOL.busy,
+    **{f"outbound_{k}": v for k, v in TG_OUTBOUND.queue_depth().items()},
+    "admin_digest": ADMIN_DIGEST.pending(),
+    "typing_chats": TYPING.busy_chats(),
+})
+# монотонные счётчики объектов — TYPE counter, чтобы rate()/increase() работали и переживали рестарт
+REGISTRY.counter_func("updates_by_tier_total", "Обработано/сброшено апдейтов по тиру", ("tier", "outcome"), fn=lambda: {
+    (tier, outcome): st[outcome] for tier, st in TIER_STATS.items() for outcome in ("done", "shed")
+})
+REGISTRY.counter_func("loop_stalls_total", "Сколько раз loop залипал дольше порога", fn=lambda: LOOP_MONITOR.stalls_total)
+REGISTRY.counter_func("updates_duplicates_total", "Отсеянные повторные доставки", fn=lambda: RECENT_UPDATES.duplicates)
+REGISTRY.counter_func("tg_outbound_retry_after_total", "Сколько раз ловили RetryAfter",
+                      fn=lambda: TG_OUTBOUND.retry_after_hits)
+
+
+@app.get("/metrics")
+async def metrics(request: Request):
+    if METRICS_TOKEN and not _token_ok(request, METRICS_TOKEN):
+        raise HTTPException(status_code=403)
+    return PlainTextResponse(REGISTRY.render(), media_type=METRICS_CONTENT_TYPE)
+
+
+# Реестр контейнеров состояния/кэшей для /debug/memory (геттеры — переприсваивание глобалов не ломает)
+MEMORY = MemoryRegistry()
+for _name, _getter in {
+    "LAST_RESULTS": lambda: LAST_RESULTS,
+    "LAST_QUERY_AT": lambda: LAST_QUERY_AT,
+    "LAST_QUERY_TEXT": lambda: LAST_QUERY_TEXT,
+    "LAST_PREMIUM_HINT_AT": lambda: LAST_PREMIUM_HINT_AT,
+    "ASK_STATE": lambda: ASK_STATE,
+    "ANSWER_MAP": lambda: ANSWER_MAP,
+    "PAGER_STATE": lambda: PAGER_STATE,
+    "WEATHER_CACHE": lambda: WEATHER_CACHE,
+    "TRX_STORE": lambda: TRX_STORE,
+    "GPT_USER_PLAN": lambda: GPT_USER_PLAN,
+    "GPT_USER_BUCKETS": lambda: GPT_USER_BUCKETS,
+    "_RECENT_GREETING": lambda: _RECENT_GREETING,
+    "CARD_RENDER_CACHE": lambda: CARD_RENDER_CACHE,
+    "TOUR_MEDIA_CACHE": lambda: TOUR_MEDIA_CACHE,
+    "TOUR_KB_SKELETONS": lambda: TOUR_KB_SKELETONS,
+    "RECENT_UPDATES": lambda: RECENT_UPDATES,
+}.items():
+    MEMORY.register(_name, _getter)
+
+REGISTRY.gauge("process_rss_bytes", "RSS процесса", fn=lambda: process_rss_bytes() or 0)
+REGISTRY.gauge("state_entries", "Число записей в контейнерах состояния", ("name",),
+               fn=lambda: {r["name"]: r.get("entries", 0) for r in MEMORY.report()})
+
+
+@app.get("/debug/memory")
+async def debug_memory(request: Request, deep: bool = False, top: int = 20, action: Optional[str] = None):
+    """action: start — включить tracemalloc и снять базу; baseline — новая база; stop — выключить."""
+    if not DEBUG_TOKEN or not _token_ok(request, DEBUG_TOKEN):
+        raise HTTPException(status_code=403)
+    if action == "start":
+        MEMORY.start_tracing()
+    elif action == "baseline":
+        MEMORY.set_baseline()
+    elif action == "stop":
+        MEMORY.stop_tracing()
+    # контейнеры копируем здесь, на loop (в потоке они меняются под ногами);
+    # глубокая оценка по копии и снимок tracemalloc — CPU-работа, не держим ею loop
+    snap = MEMORY.snapshot(deep)
+    return FastJSONResponse(await asyncio.to_thread(MEMORY.summary, deep, top, snap))
+
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, name: Optional[str] = None, top: int = 30,
+                        sort: str = "cumulative", reset: bool = False):
+    if not DEBUG_TOKEN or not _token_ok(request, DEBUG_TOKEN):
+        raise HTTPException(status_code=403)
+    text = PROFILER.report(name=name, top=top, sort=sort)
+    PROFILER.dump(name=name, top=top, sort=sort)
+    if reset:
+        PROFILER.reset()
+    return PlainTextResponse(text)
+
+
+@app.get("/debug/loop")
+async def debug_loop(request: Request, top: int = 15, reset: bool = False):
+    if not DEBUG_TOKEN or not _token_ok(request, DEBUG_TOKEN):
+        raise HTTPException(status_code=403)
+    report = LOOP_MONITOR.report(top=top)
+    if reset:
+        LOOP_MONITOR.reset()
+    return FastJSONResponse(report)
+
+
+# ================= HEALTH =================
+# /healthz — процесс жив и loop отвечает (liveness: перезапускать только если это не так).
+# /readyz — инстанс реально может обслуживать: БД и пул потоков отвечают, loop не залип,
+# очередь апдейтов не забита, синтетический поиск проходит. Свежесть данных коллектора
+# по умолчанию только отчётная (данные общие для всех инстансов — снимать с балансировки
+# все разом бессмысленно); READY_FRESHNESS_CRITICAL=1 делает её блокирующей.
+# Render по healthCheckPath ещё и перезапускает инстансы, поэтому там /healthz: всплеск нагрузки
+# или короткий сбой БД не должен отнимать мощность рестартами. /readyz — только для мониторинга
+# (алерты, дашборды) и балансировщиков, которые лишь снимают трафик; в деплой его не подключаем.
+READY_TIMEOUT_SEC = float(os.getenv("READY_TIMEOUT_SEC", "2"))
+READY_MAX_LOOP_LAG_SEC = float(os.getenv("READY_MAX_LOOP_LAG_MS", "500")) / 1000
+READY_MAX_QUEUE_RATIO = float(os.getenv("READY_MAX_QUEUE_RATIO", "0.8"))
+READY_MAX_DATA_AGE_SEC = float(os.getenv("READY_MAX_DATA_AGE_MIN", "360")) * 60
+READY_FRESHNESS_CRITICAL = os.getenv("READY_FRESHNESS_CRITICAL", "0").strip().lower() in ("1", "true", "yes")
+READY_PROBE_TTL_SEC = float(os.getenv("READY_PROBE_TTL_SEC", "30"))
+READY_FAIL_TTL_SEC = float(os.getenv("READY_FAIL_TTL_SEC", "2"))
+
+_READY_CACHE: Dict[str, dict] = {}  # имя проверки -> {"at": monotonic, "res": dict}
+# имя проверки -> ещё не вернувшийся поток; частые /readyz и зависшая БД не плодят потоки
+_READY_INFLIGHT: Dict[str, asyncio.Future] = {}
+
+
+def _readiness_db_sync() -> dict:
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute("SELECT max(posted_at) AS last_post FROM tours;", name="readyz.tours_freshness")
+        last_post = (cur.fetchone() or {}).get("last_post")
+        last_cp = None
+        cur.execute("SELECT to_regclass('collect_checkpoints') IS NOT NULL AS ok;", name="readyz.has_checkpoints")
+        if (cur.fetchone() or {}).get("ok"):
+            cur.execute("SELECT max(updated_at) AS last_cp FROM collect_checkpoints;", name="readyz.checkpoint_freshness")
+            last_cp = (cur.fetchone() or {}).get("last_cp")
+    return {"last_post": last_post, "last_checkpoint": last_cp}
+
+
+def _search_probe_sync() -> int:
+    """Тот же запрос, что у поиска (схема, индекс по свежести, select-лист), но LIMIT 1."""
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            f"SELECT {_select_tours_clause()} FROM tours ORDER BY {RECENT_EXPR} DESC NULLS LAST LIMIT 1",
+            name="readyz.search_probe",
+        )
+        return len(cur.fetchall())
+
+
+async def _cached_check(name: str, ttl: float, fn) -> dict:
+    """Проверка через пул потоков с бюджетом READY_TIMEOUT_SEC; успех кэшируется на ttl,
+    провал — только на READY_FAIL_TTL_SEC (короткий сбой БД не должен держать инстанс «unready»).
+    Single-flight: пока поток проверки не вернулся (даже после таймаута), новый не запускаем —
+    параллельные запросы ждут тот же future."""
+    hit = _READY_CACHE.get(name)
+    if hit and time.monotonic() - hit["at"] < (ttl if hit["res"]["ok"] else min(ttl, READY_FAIL_TTL_SEC)):
+        return hit["res"]
+    fut = _READY_INFLIGHT.get(name)
+    if fut is None:
+        fut = _READY_INFLIGHT[name] = asyncio.ensure_future(asyncio.to_thread(fn))
+
+        def _done(f: asyncio.Future) -> None:
+            _READY_INFLIGHT.pop(name, None)
+            if not f.cancelled():
+                f.exception()  # результат после таймаута никто не ждёт — не шумим «never retrieved»
+
+        fut.add_done_callback(_done)
+    t0 = time.perf_counter()
+    try:
+        # занятый пул потоков тоже даёт таймаут — это и есть «нет свободных рук»;
+        # shield — таймаут одного запроса не отменяет общий future
+        value = await asyncio.wait_for(asyncio.shield(fut), timeout=READY_TIMEOUT_SEC)
+        res = {"ok": True, "value": value}
+    except asyncio.TimeoutError:
+        res = {"ok": False, "error": "timeout"}
+    except Exception as e:
+        res = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+    res["ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    _READY_CACHE[name] = {"at": time.monotonic(), "res": res}
+    return res
+
+
+def _age_sec(dt) -> Optional[float]:
+    if not dt:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (datetime.now(timezone.utc) - dt).total_seconds())
+
+
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok", "uptime_sec": round(time.perf_counter() - _BOOT_T0, 1)}
+
+
+@app.get("/readyz")
+async def readyz():
+    if _DRAINING:
+        return FastJSONResponse({"status": "draining"}, status_code=503)
+    checks: Dict[str, dict] = {}
+
+    if LOOP_MONITOR.running:
+        lag = LOOP_MONITOR.lag_now()
+    else:  # монитор выключен (LOOP_MONITOR=0) — меряем один проход loop
+        t0 = time.monotonic()
+        await asyncio.sleep(0)
+        lag = time.monotonic() - t0
+    checks["loop"] = {"ok": lag <= READY_MAX_LOOP_LAG_SEC, "lag_ms": round(lag * 1000, 1)}
+
+    depth = UPDATE_POOL.depth()
+    checks["queue"] = {
+        "ok": depth <= WEBHOOK_QUEUE_MAX * READY_MAX_QUEUE_RATIO,
+        "depth": depth, "max": WEBHOOK_QUEUE_MAX, "busy": UPDATE_POOL.busy,
+    }
+
+    db, probe = await asyncio.gather(
+        _cached_check("db", min(5.0, READY_PROBE_TTL_SEC), _readiness_db_sync),
+        _cached_check("search_probe", READY_PROBE_TTL_SEC, _search_probe_sync),
+    )
+    checks["db"] = {k: v for k, v in db.items() if k != "value"}
+    checks["search_probe"] = {"ok": probe["ok"], "ms": probe["ms"], **({"error": probe["error"]} if not probe["ok"] else {})}
+
+    fresh = {"ok": False, "critical": READY_FRESHNESS_CRITICAL}
+    if db["ok"]:
+        post_age = _age_sec(db["value"]["last_post"])
+        cp_age = _age_sec(db["value"]["last_checkpoint"])
+        ages = [a for a in (post_age, cp_age) if a is not None]
+        fresh.update({
+            "ok": bool(ages) and min(ages) <= READY_MAX_DATA_AGE_SEC,
+            "last_post_age_min": round(post_age / 60, 1) if post_age is not None else None,
+            "checkpoint_age_min": round(cp_age / 60, 1) if cp_age is not None else None,
+        })
+    checks["freshness"] = fresh
+
+    ready = all(c["ok"] for n, c in checks.items() if n != "freshness") and (fresh["ok"] or not READY_FRESHNESS_CRITICAL)
+    status = "ready" if ready else "unready"
+    if ready and not fresh["ok"]:
+        status = "degraded"
+    return FastJSONResponse({"status": status, "checks": checks}, status_code=200 if ready else 503)
+
+
+# ================= START/STOP =================
+_TOURS_LISTENER_TASK: Optional[asyncio.Task] = None
+_LEAD_JOBS_TASK: Optional[asyncio.Task] = None
+_LEADER_WATCH_TASK: Optional[asyncio.Task] = None
+_GS_WARMUP_TASK: Optional[asyncio.Task] = None
+_SPOOL_REPLAY_TASK: Optional[asyncio.Task] = None
+
+# Лидер (держатель advisory lock) делает работу «на кластер»: схема/DDL, прогрев Sheets,
+# set_webhook и фоновые задачи. Остальные процессы сразу обслуживают апдейты — только дешёвая
+# проверка to_regclass; если нужных таблиц нет (новая версия при rolling-деплое стартовала
+# follower'ом), follower сам прогоняет ensure под той же DDL-блокировкой.
+#
+# set_webhook (а с ним и secret_token) регистрирует только лидер. При смене WEBHOOK_SECRET
+# инстансы с новым секретом отвечают 403 на апдейты со старым, пока новый лидер не
+# перерегистрирует вебхук; Telegram держит недоставленные апдейты и повторяет, так что это
+# задержка, а не потеря. Меняйте секрет только вместе с рестартом всех инстансов.
+LEADER_LOCK_KEY = int(os.getenv("LEADER_LOCK_KEY", "7270001"))
+SCHEMA_LOCK_KEY = int(os.getenv("SCHEMA_LOCK_KEY", str(LEADER_LOCK_KEY + 1)))
+LEADER_RETRY_SEC = float(os.getenv("LEADER_RETRY_SEC", "15"))
+_LEADER_CONN = None
+
+
+def is_leader() -> bool:
+    return _LEADER_CONN is not None and not _LEADER_CONN.closed
+
+
+def _gs_warmup_sync():
+    import gspread
 
     try:
         gc = _get_gs_client()
@@ -2913,6 +4307,72 @@ async def on_startup():
     except Exception as e:
         logging.error(f"GS warmup failed (generic): {e}")
 
+
+async def _gs_warmup():
+    t0 = time.perf_counter()
+    await asyncio.to_thread(_gs_warmup_sync)
+    BOOT_PHASES["gs_warmup_bg"] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+# таблицы, без которых инстанс не может обслуживать апдейты (колонки проверяет лидер)
+REQUIRED_TABLES = (
+    "tours", "orders", "subscriptions", "app_config", "leads", "lead_jobs", "favorites",
+    "questions", "pending_wants", "tour_media", "webhook_spool",
+)
+
+
+def _ensure_schema_sync():
+    with advisory_lock(SCHEMA_LOCK_KEY):
+        _ensure_schema_locked()
+
+
+def _missing_tables_sync() -> list[str]:
+    tables = REQUIRED_TABLES + (("processed_updates",) if UPDATE_DEDUP_DB else ())
+    with get_conn() as conn, conn.cursor() as cur:
+        cur.execute(
+            "SELECT t FROM unnest(%s::text[]) AS t WHERE to_regclass(t) IS NULL;", (list(tables),)
+        )
+        return [r["t"] for r in cur.fetchall()]
+
+
+def _follower_schema_sync():
+    """Follower: без DDL, если схема на месте; иначе — ensure под блокировкой (ждёт DDL лидера)."""
+    missing = _missing_tables_sync()
+    if not missing:
+        return
+    logging.info(f"Схема неполная ({', '.join(missing)}) — прогоняю ensure под DDL-блокировкой")
+    _ensure_schema_sync()
+
+
+def _ensure_schema_locked():
+    try:
+        init_db()
+    except Exception as e:
+        logging.error(f"Ошибка init_db(): {e}")
+
+    try:
+        ensure_orders_columns()
+    except Exception as e:
+        logging.error(f"orders ensure failed: {e}")
+
+    try:
+        ensure_pending_wants_table()
+        ensure_leads_schema()
+        ensure_favorites_schema()
+        ensure_questions_schema()
+        ensure_lead_jobs_schema()
+        ensure_tour_media_schema()
+        ensure_webhook_spool_schema()
+        if UPDATE_DEDUP_DB:
+            ensure_processed_updates_schema()
+    except Exception as e:
+        logging.error(f"Schema ensure failed: {e}")
+
+    try:
+        ensure_tours_notify_trigger()
+    except Exception as e:
+        logging.warning(f"tours notify trigger ensure failed: {e}")
+
     try:
         with get_conn() as conn, conn.cursor() as cur:
             cur.execute("ALTER TABLE IF EXISTS tours ADD COLUMN IF NOT EXISTS board TEXT;")
@@ -2920,6 +4380,108 @@ async def on_startup():
     except Exception as e:
         logging.warning(f"Ensure tours columns failed: {e}")
 
+
+async def _cluster_startup():
+    global _GS_WARMUP_TASK
+    # прогрев Sheets — в фоне, чтобы не задерживать set_webhook
+    _GS_WARMUP_TASK = asyncio.create_task(_gs_warmup())
+
+    try:
+        await asyncio.to_thread(_ensure_schema_sync)
+    except Exception as e:
+        logging.error(f"schema ensure failed: {e}")
+
+    if WEBHOOK_URL:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None)
+        logging.info(f"✅ Webhook установлен: {WEBHOOK_URL}")
+    else:
+        logging.warning("WEBHOOK_URL не указан — бот не получит апдейты.")
+
+
+def _start_leader_jobs():
+    global _LEAD_JOBS_TASK
+    if _LEAD_JOBS_TASK is None or _LEAD_JOBS_TASK.done():
+        _LEAD_JOBS_TASK = asyncio.create_task(lead_jobs_worker())
+
+
+def _stop_leader_jobs():
+    global _LEAD_JOBS_TASK
+    if _LEAD_JOBS_TASK:
+        _LEAD_JOBS_TASK.cancel()
+        _LEAD_JOBS_TASK = None
+
+
+async def _finish_leader_jobs(timeout: float):
+    """Мягкая остановка outbox: взятая пачка доделывается; не успели — аренда истечёт, подберёт другой."""
+    global _LEAD_JOBS_TASK
+    task, _LEAD_JOBS_TASK = _LEAD_JOBS_TASK, None
+    if task is None:
+        return
+    LEAD_JOBS_STOP.set()
+    LEAD_JOBS_WAKE.set()
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout=max(0.1, timeout))
+    except asyncio.TimeoutError:
+        task.cancel()
+    except Exception as e:
+        logging.warning(f"lead_jobs_worker stopped with error: {e}")
+
+
+async def leader_watch():
+    """Следим за лидерством: лидер проверяет своё соединение, остальные пытаются перехватить блокировку."""
+    global _LEADER_CONN
+    while True:
+        await asyncio.sleep(LEADER_RETRY_SEC)
+        try:
+            if _LEADER_CONN is not None:
+                if not await asyncio.to_thread(lock_alive, _LEADER_CONN):
+                    logging.warning("👑 Лидерство потеряно (соединение с БД оборвалось)")
+                    _stop_leader_jobs()
+                    try:
+                        _LEADER_CONN.close()
+                    except Exception:
+                        pass
+                    _LEADER_CONN = None
+                continue
+            _LEADER_CONN = await asyncio.to_thread(try_advisory_lock, LEADER_LOCK_KEY)
+            if _LEADER_CONN is not None:
+                logging.info("👑 Этот процесс стал лидером — выполняю стартовые задачи кластера")
+                await _cluster_startup()
+                _start_leader_jobs()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.warning(f"leader_watch: {e}")
+
+
+@app.on_event("startup")
+async def on_startup():
+    global _LEADER_CONN, _TOURS_LISTENER_TASK, _LEADER_WATCH_TASK, _SPOOL_REPLAY_TASK
+    if os.getenv("LOOP_MONITOR", "1").strip().lower() in ("1", "true", "yes"):
+        LOOP_MONITOR.start()  # до стартовых задач — их блокирующие вызовы тоже попадут в отчёт
+    if os.getenv("MEM_TRACE", "0").strip().lower() in ("1", "true", "yes"):
+        MEMORY.start_tracing()  # база — сразу после импорта; дифф покажет рост за время жизни
+    try:
+        _LEADER_CONN = await asyncio.to_thread(try_advisory_lock, LEADER_LOCK_KEY)
+    except Exception as e:
+        logging.error(f"leader election failed: {e}")
+        _LEADER_CONN = None
+
+    _boot_mark("leader_election")
+
+    if _LEADER_CONN is not None:
+        logging.info("👑 Лидер: выполняю стартовые задачи кластера")
+        await _cluster_startup()
+        _start_leader_jobs()
+        _boot_mark("cluster_startup")
+    else:
+        logging.info("Не лидер: пропускаю стартовые задачи кластера")
+        try:
+            await asyncio.to_thread(_follower_schema_sync)
+        except Exception as e:
+            logging.error(f"schema check failed: {e}")
+        _boot_mark("schema_check")
+
     try:
         with get_conn() as conn, conn.cursor() as cur:
             info = conn.info
@@ -2941,14 +4503,64 @@ async def on_startup():
     except Exception as e:
         logging.error(f"❌ Ошибка при проверке колонок: {e}")
 
-    if WEBHOOK_URL:
-        await bot.set_webhook(WEBHOOK_URL)
-        logging.info(f"✅ Webhook установлен: {WEBHOOK_URL}")
-    else:
-        logging.warning("WEBHOOK_URL не указан — бот не получит апдейты.")
+    _TOURS_LISTENER_TASK = asyncio.create_task(tours_change_listener())
+    _LEADER_WATCH_TASK = asyncio.create_task(leader_watch())
+    UPDATE_POOL.start()
+    init_clients()
+    _SPOOL_REPLAY_TASK = asyncio.create_task(webhook_spool_replayer())
+    _boot_mark("ready")
+    logging.info("⏱ Холодный старт (мс от начала импорта): " + ", ".join(f"{k}={v}" for k, v in BOOT_PHASES.items()))
+
+SHUTDOWN_DRAIN_SEC = float(os.getenv("SHUTDOWN_DRAIN_SEC", os.getenv("WEBHOOK_DRAIN_SEC", "20")))
+
 
 @app.on_event("shutdown")
 async def on_shutdown():
+    """Остановка по шагам в пределах SHUTDOWN_DRAIN_SEC: приём → апдейты → outbox → буферы → клиенты."""
+    global _DRAINING
+    _DRAINING = True  # 1) вебхук и /readyz отвечают 503
+    deadline = time.monotonic() + SHUTDOWN_DRAIN_SEC
+
+    def left() -> float:
+        return max(0.0, deadline - time.monotonic())
+
+    for task in (_TOURS_LISTENER_TASK, _LEADER_WATCH_TASK, _GS_WARMUP_TASK, _SPOOL_REPLAY_TASK):
+        if task:
+            task.cancel()
+
+    # 2) апдейты: часть бюджета обрабатываем очередь, не начатые — в webhook_spool
+    await UPDATE_POOL.drain(timeout=left() * 0.5)
+    pending = UPDATE_POOL.take_pending()
+    if pending:
+        logging.warning(f"Остановка: в webhook_spool сохранено {await _spool_unfinished(pending)} из {len(pending)} апдейтов")
+    # начатые не сохраняем (повтор задвоил бы заявки/сообщения) — даём им доработать в бюджете
+    await UPDATE_POOL.drain(timeout=left() * 0.6)
+    interrupted = await UPDATE_POOL.stop()
+    if interrupted:
+        logging.error(
+            "Остановка: прерваны посреди обработки апдейты "
+            + ", ".join(str(u.update_id) for u, _tier, _at in interrupted)
+        )
+
+    # 3) outbox лидов (Sheets, уведомления группе)
+    await _finish_leader_jobs(left() * 0.5)
+
+    # 4) буферы исходящих сообщений
+    try:
+        await asyncio.wait_for(ADMIN_DIGEST.drain(), timeout=max(0.1, left()))
+    except Exception as e:
+        logging.warning(f"admin digest drain failed: {e}")
+    if not await TG_OUTBOUND.drain(timeout=left()):
+        logging.warning("Остановка: не все исходящие сообщения успели уйти")
+
+    # 5) пулы и клиенты
+    await close_http_clients()
+    PAYME_EXECUTOR.shutdown(wait=False)
+    if _LEADER_CONN is not None:
+        _LEADER_CONN.close()  # блокировка отпускается вместе с сессией
+    LOOP_MONITOR.stop()
+    PROFILER.dump()
+    await asyncio.to_thread(TRACER.flush)  # ждёт поток записи — не на loop
     await bot.session.close()
 
 # ====== Payme JSON-RPC helpers ======
@@ -3038,6 +4650,13 @@ def _order_amount_tiyin(o: dict) -> int | None:
 #   "create_time": int, "perform_time": int, "cancel_time": int,
 #   "reason": int }
 TRX_STORE: dict[str, dict] = {}
+# RPC выполняются в пуле PAYME_EXECUTOR — запись и обход кэша только под замком
+TRX_STORE_LOCK = threading.Lock()
+
+
+def _trx_put(trx_id: str, data: dict) -> None:
+    with TRX_STORE_LOCK:
+        TRX_STORE[trx_id] = data
 
 def _trx_from_db(trx_id: str) -> dict | None:
     """
@@ -3068,7 +4687,7 @@ def _trx_from_db(trx_id: str) -> dict | None:
                 "cancel_time": int(r["cancel_time"] or 0),
                 "reason": int(r["reason"] or 0),
             }
-            TRX_STORE[trx_id] = data
+            _trx_put(trx_id, data)
             return data
     except Exception:
         return None
@@ -3087,11 +4706,36 @@ async def payme_mock_new(amount: int = 4900000):
 
 # ---- основной JSON-RPC обработчик ----
 from fastapi import Header
-from fastapi.responses import JSONResponse
+
+# ===== Bulkhead для платёжных эндпоинтов =====
+# Свой пул потоков (= свой набор DB-соединений), лимит параллелизма и бюджет времени:
+# всплеск поиска/GPT не должен отодвинуть CreateTransaction/PerformTransaction за дедлайн Payme.
+PAYME_WORKERS = int(os.getenv("PAYME_WORKERS", "4"))
+PAYME_TIMEOUT_SEC = float(os.getenv("PAYME_TIMEOUT_SEC", "5"))
+PAYME_EXECUTOR = ThreadPoolExecutor(max_workers=PAYME_WORKERS, thread_name_prefix="payme")
+# слот держится до конца потока, даже если ответ уже ушёл по таймауту (см. utils.bulkhead)
+PAYME_BULKHEAD = Bulkhead(PAYME_EXECUTOR, limit=PAYME_WORKERS * 2, timeout=PAYME_TIMEOUT_SEC)
+
+
+async def _payme_bulkhead(fn, *args):
+    """Выполнить fn(*args) в пуле платежей; asyncio.TimeoutError — если не уложились в бюджет."""
+    return await PAYME_BULKHEAD.run(fn, *args)
+
 
 @app.post("/payme/merchant")
 async def payme_merchant(request: Request, x_auth: str | None = Header(default=None)):
-    body    = await request.json()
+    body = fast_loads(await request.body())
+    with TRACER.trace(f"payme.{body.get('method') or 'unknown'}", rpc_id=body.get("id")) as sp:
+        try:
+            return await _payme_bulkhead(_payme_merchant_sync, request, body)
+        except asyncio.TimeoutError:
+            # поток мог довести операцию до конца — повтор от Payme отработает идемпотентно
+            sp.tag("error", "timeout")
+            logging.error("[Payme] timeout: method=%s id=%s", body.get("method"), body.get("id"))
+            return FastJSONResponse(_rpc_err(body.get("id"), -32400, "Системная ошибка"))
+
+
+def _payme_merchant_sync(request: Request, body: dict):
     req_id  = body.get("id")
     method  = (body.get("method") or "").strip()
     params  = body.get("params") or {}
@@ -3099,7 +4743,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
 
     auth_ok = _payme_auth_check(request.headers)
     if not auth_ok:
-        return JSONResponse(_rpc_err(req_id, -32504, "Недопустимая авторизация"))
+        return FastJSONResponse(_rpc_err(req_id, -32504, "Недопустимая авторизация"))
 
     amount_in = params.get("amount")
     trx_id_in = params.get("id")
@@ -3120,24 +4764,24 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
     # ================== METHOD SWITCH ==================
     if method == "CheckPerformTransaction":
         if not order:
-            return JSONResponse(_rpc_err(req_id, -31050, "Заказ не найден"))
+            return FastJSONResponse(_rpc_err(req_id, -31050, "Заказ не найден"))
         expected = _order_amount_tiyin(order)
         if expected is None:
-            return JSONResponse(_rpc_err(req_id, -31008, "Сумма в заказе не задана"))
+            return FastJSONResponse(_rpc_err(req_id, -31008, "Сумма в заказе не задана"))
         try:
             sent = int(amount_in)
         except Exception:
-            return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+            return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
         if sent != expected:
             logging.warning("[Payme] amount mismatch: sent=%s expected=%s order_id=%s", sent, expected, order_id)
-            return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
-        return JSONResponse(_rpc_ok(req_id, {"allow": True}))
+            return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+        return FastJSONResponse(_rpc_ok(req_id, {"allow": True}))
     
     elif method == "CreateTransaction":
         payme_trx = str(trx_id_in or "").strip()
         client_ms = int(params.get("time") or 0)   # ВАЖНО: время от Paycom
         if not payme_trx or client_ms <= 0:
-            return JSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
+            return FastJSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
     
         # 1) идемпотентность
         snap = TRX_STORE.get(payme_trx) or _trx_from_db(payme_trx)
@@ -3145,10 +4789,10 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
             try:
                 sent = int(amount_in)
             except Exception:
-                return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+                return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
             if snap.get("amount") not in (None, sent):
-                return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
-            return JSONResponse(_rpc_ok(req_id, {
+                return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+            return FastJSONResponse(_rpc_ok(req_id, {
                 "create_time": int(snap.get("create_time") or 0),
                 "transaction": payme_trx,
                 "state": 2 if int(snap.get("state") or 1) == 2 else 1
@@ -3156,66 +4800,42 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
     
         # 2) проверка заказа/суммы
         if not order:
-            return JSONResponse(_rpc_err(req_id, -31050, "Заказ не найден"))
+            return FastJSONResponse(_rpc_err(req_id, -31050, "Заказ не найден"))
     
         order_status = (order.get("status") or "").strip().lower()
         if order_status in {"paid", "canceled", "canceled_after_perform"}:
-            return JSONResponse(_rpc_err(req_id, -31099, "Невозможно создать транзакцию для данного заказа"))
+            return FastJSONResponse(_rpc_err(req_id, -31099, "Невозможно создать транзакцию для данного заказа"))
     
         expected = _order_amount_tiyin(order)
         if expected is None:
-            return JSONResponse(_rpc_err(req_id, -31008, "Сумма в заказе не задана"))
+            return FastJSONResponse(_rpc_err(req_id, -31008, "Сумма в заказе не задана"))
     
         try:
             sent = int(amount_in)
         except Exception:
-            return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+            return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
     
         if sent != expected:
             logging.warning(f"[Payme] Create mismatch: sent={sent} expected={expected} order_id={order_id}")
-            return JSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
+            return FastJSONResponse(_rpc_err(req_id, -31001, "Неверная сумма"))
     
         # 3) запись trx — фиксируем created_at из client_ms (params.time)
         create_time = int(params.get("time") or 0)
         if create_time <= 0:
-            return JSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
+            return FastJSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
         
         try:
             with _pay_db() as conn, conn.cursor(row_factory=dict_row) as cur:
-                cur.execute("SELECT provider_trx_id FROM orders WHERE id=%s;", (int(order_id),))
-                row = cur.fetchone()
-                if row and row.get("provider_trx_id") and row["provider_trx_id"] != payme_trx:
-                    return JSONResponse(_rpc_err(req_id, -31099, "Транзакция уже существует для этого заказа"))
-        
-                cur.execute(
-                    """
-                    UPDATE orders
-                       SET provider_trx_id=%s,
-                           status=%s,
-                           created_at = COALESCE(created_at, to_timestamp(%s/1000.0))
-                     WHERE id=%s
-                    """,
-                    (payme_trx, "created", create_time, int(order_id)),
-                )
-                # ← читаем create_ms из БД с округлением, чтобы везде был ОДИНАКОВЫЙ int
-                cur.execute(
-                    """
-                    SELECT ROUND(EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT AS create_ms
-                      FROM orders
-                     WHERE provider_trx_id=%s
-                     LIMIT 1
-                    """,
-                    (payme_trx,),
-                )
-                row2 = cur.fetchone()
-                db_create_ms = int(row2["create_ms"] or create_time)
+                db_create_ms = claim_order_for_trx(cur, int(order_id), payme_trx, create_time)
                 conn.commit()
+            if db_create_ms is None:
+                return FastJSONResponse(_rpc_err(req_id, -31099, "Транзакция уже существует для этого заказа"))
         except Exception:
             logging.exception("[Payme] DB error in CreateTransaction")
-            return JSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (create)"))
+            return FastJSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (create)"))
         
         # синхронизируем кэш ровно этим же значением
-        TRX_STORE[payme_trx] = {
+        _trx_put(payme_trx, {
             "order_id": int(order_id),
             "amount": sent,
             "state": 1,
@@ -3223,9 +4843,9 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
             "perform_time": 0,
             "cancel_time": 0,
             "reason": None,
-        }
+        })
         
-        return JSONResponse(_rpc_ok(req_id, {
+        return FastJSONResponse(_rpc_ok(req_id, {
             "create_time": db_create_ms,
             "transaction": payme_trx,
             "state": 1
@@ -3237,10 +4857,10 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
         payme_trx = str(trx_id_in or "").strip()
         trx = _trx_from_db(payme_trx) or TRX_STORE.get(payme_trx)
         if not trx:
-            return JSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
+            return FastJSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
     
         if int(trx.get("state") or 1) == 2:
-            return JSONResponse(_rpc_ok(req_id, {
+            return FastJSONResponse(_rpc_ok(req_id, {
                 "perform_time": int(trx.get("perform_time") or 0),
                 "transaction": payme_trx,
                 "state": 2
@@ -3256,13 +4876,12 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
                 conn.commit()
         except Exception:
             logging.exception("[Payme] DB error in PerformTransaction")
-            return JSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (perform)"))
+            return FastJSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (perform)"))
     
-        trx.update({"state": 2, "perform_time": perform_ms})
-        TRX_STORE[payme_trx] = trx
+        _trx_put(payme_trx, {**trx, "state": 2, "perform_time": perform_ms})
     
         logging.info(f"[Payme] PerformTransaction OK trx_id={payme_trx}")
-        return JSONResponse(_rpc_ok(req_id, {
+        return FastJSONResponse(_rpc_ok(req_id, {
             "perform_time": perform_ms,
             "transaction": payme_trx,
             "state": 2
@@ -3272,7 +4891,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
     elif method == "CancelTransaction":
         payme_trx = str(trx_id_in or "").strip()
         if not payme_trx:
-            return JSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
+            return FastJSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
     
         cancel_reason = params.get("reason")
         try:
@@ -3283,7 +4902,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
         try:
             trx = _trx_from_db(payme_trx) or TRX_STORE.get(payme_trx)
             if not trx:
-                return JSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
+                return FastJSONResponse(_rpc_err(req_id, -31003, "Транзакция не найдена"))
     
             cur_state     = int(trx.get("state", 1))
             create_time   = int(trx.get("create_time", 0)) or _now_ms()
@@ -3293,7 +4912,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
     
             # идемпотентность
             if cur_state == -1:
-                return JSONResponse(_rpc_ok(req_id, {
+                return FastJSONResponse(_rpc_ok(req_id, {
                     "cancel_time": cancel_time,
                     "transaction": payme_trx,
                     "state": -1,
@@ -3331,9 +4950,9 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
                 "state": new_state,                 # только -1
                 "reason": cancel_reason if cancel_reason is not None else stored_reason,
             }
-            TRX_STORE[payme_trx] = trx
+            _trx_put(payme_trx, trx)
     
-            return JSONResponse(_rpc_ok(req_id, {
+            return FastJSONResponse(_rpc_ok(req_id, {
                 "cancel_time": cancel_time,
                 "transaction": payme_trx,
                 "state": -1,
@@ -3342,13 +4961,13 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
     
         except Exception:
             logging.exception("[Payme] CancelTransaction error")
-            return JSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (cancel)"))
+            return FastJSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (cancel)"))
     
     elif method == "CheckTransaction":
         try:
             payme_trx = str(params.get("id") or "").strip()
             if not payme_trx:
-                return JSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
+                return FastJSONResponse(_rpc_err(req_id, -32602, "Invalid params"))
     
             # 1) ПЕРВЫМ делом — кэш (идентичен между вызовами)
             trx = TRX_STORE.get(payme_trx)
@@ -3362,7 +4981,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
                 }
                 if payload["state"] < 0:
                     payload["reason"] = int(trx.get("reason") or 0)
-                return JSONResponse(_rpc_ok(req_id, payload))
+                return FastJSONResponse(_rpc_ok(req_id, payload))
     
             # 2) Фолбэк — БД (кэш не найден, например после рестарта)
             with _pay_db() as conn, conn.cursor(row_factory=dict_row) as cur:
@@ -3380,7 +4999,7 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
                 r = cur.fetchone()
     
             if not r:
-                return JSONResponse(_rpc_err(req_id, -31003, "Transaction not found"))
+                return FastJSONResponse(_rpc_err(req_id, -31003, "Transaction not found"))
     
             s = (r["status"] or "").strip().lower()
             state = 2 if s in ("paid", "performed", "done") else (-1 if s in ("canceled_after_perform","refunded","canceled") else 1)
@@ -3395,22 +5014,22 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
             if state < 0:
                 payload["reason"] = int(r.get("reason") or 0)
     
-            return JSONResponse(_rpc_ok(req_id, payload))
+            return FastJSONResponse(_rpc_ok(req_id, payload))
     
         except Exception:
             logging.exception("[Payme] CheckTransaction fatal")
-            return JSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (check)"))
+            return FastJSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (check)"))
     
     # -------- GetStatement --------
     elif method == "GetStatement":
         if not (auth_ok or _payme_sandbox_ok(request)):
-            return JSONResponse(_rpc_err(req_id, -32504, "Insufficient privileges"))
+            return FastJSONResponse(_rpc_err(req_id, -32504, "Insufficient privileges"))
     
         try:
             frm = int(params.get("from"))
             to  = int(params.get("to"))
         except Exception:
-            return JSONResponse(_rpc_err(req_id, -32602, "Неверные параметры (from/to)"))
+            return FastJSONResponse(_rpc_err(req_id, -32602, "Неверные параметры (from/to)"))
     
         if to < frm:
             frm, to = to, frm
@@ -3422,7 +5041,9 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
             return 1
     
         txs = []
-        for trx_id, t in (TRX_STORE or {}).items():
+        with TRX_STORE_LOCK:
+            trx_items = list(TRX_STORE.items())
+        for trx_id, t in trx_items:
             ctime = int(t.get("create_time") or 0)
             if frm <= ctime <= to:
                 state = int(t.get("state") or 1)
@@ -3483,38 +5104,48 @@ async def payme_merchant(request: Request, x_auth: str | None = Header(default=N
             conn.commit()
         except Exception:
             logging.exception("[Payme] DB error in GetStatement")
-            return JSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (getStatement)"))
+            return FastJSONResponse(_rpc_err(req_id, -32400, "Внутренняя ошибка (getStatement)"))
     
         logging.info("[Payme] GetStatement OUT: %d tx(s)", len(txs))
-        return JSONResponse(_rpc_ok(req_id, {"transactions": txs}))
+        return FastJSONResponse(_rpc_ok(req_id, {"transactions": txs}))
     
     # неизвестный метод
-    return JSONResponse(_rpc_err(req_id, -32601, "Метод не найден"))
+    return FastJSONResponse(_rpc_err(req_id, -32601, "Метод не найден"))
 
 # ---- callback (как было) ----
 @app.post("/payme/callback")
 async def payme_cb(request: Request):
     form = dict(await request.form())
-    ok, msg, order_id, trx = payme_handle_callback(form, dict(request.headers))
-    if ok and order_id:
+    with TRACER.trace("payme.callback") as sp:
         try:
-            activate_after_payment(order_id)
-            o = get_order_safe(order_id)
-            if o:
-                await bot.send_message(
-                    o["user_id"], f"✔️ Оплата принята. Подписка активна до {fmt_sub_until(o['user_id'])}"
-                )
-        except Exception:
-            pass
-    return JSONResponse({"status": "ok" if ok else "error", "message": msg})
+            ok, msg, order_id, trx = await _payme_bulkhead(payme_handle_callback, form, dict(request.headers))
+        except asyncio.TimeoutError:
+            sp.tag("error", "timeout")
+            logging.error("[Payme] callback timeout")
+            return FastJSONResponse({"status": "error", "message": "timeout"}, status_code=503)
+        sp.tag("ok", ok)
+        if ok and order_id:
+            try:
+                await _payme_bulkhead(activate_after_payment, order_id)
+                o = await _payme_bulkhead(get_order_safe, order_id)
+                if o:
+                    await bot.send_message(
+                        o["user_id"], f"✔️ Оплата принята. Подписка активна до {fmt_sub_until(o['user_id'])}"
+                    )
+            except Exception:
+                pass
+    return FastJSONResponse({"status": "ok" if ok else "error", "message": msg})
 
 @app.get("/pay/success")
 async def pay_success():
-    return JSONResponse(
+    return FastJSONResponse(
         {"status": "ok", "html": "<h3>Оплата принята. Можно закрыть окно и вернуться в бота ✨</h3>"}
     )
 
 
 @app.get("/pay/cancel")
 async def pay_cancel():
-    return JSONResponse({"status": "canceled", "html": "<h3>Платёж отменён. Попробуйте снова из бота.</h3>"})
+    return FastJSONResponse({"status": "canceled", "html": "<h3>Платёж отменён. Попробуйте снова из бота.</h3>"})
+
+
+_boot_mark("module")
@@ -36,6 +36,7 @@ import os
 import re
 import logging
 import asyncio
+import signal
 from datetime import datetime, timedelta, timezone
 from typing import List, Optional, Tuple, Dict
 
@@ -49,6 +50,8 @@ from utils.sanitazer import (
     San, TourDraft, build_tour_key,
     safe_run, RetryPolicy
 )
+from utils.profiling import SlowProfiler
+from utils.db import InstrumentedCursor
 
 # ======================= ЛОГИ =======================
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -66,6 +69,14 @@ REQUIRE_PRICE = os.getenv("REQUIRE_PRICE", "1") == "1"
 BATCH_SIZE = int(os.getenv("BATCH_SIZE", "30"))
 SLEEP_BASE = int(os.getenv("SLEEP_BASE_SEC", "900"))
 
+# Выборочный профиль медленных проходов/разборов (COLLECTOR_PROFILE=1), отчёт пишется в файл
+PROFILER = SlowProfiler(
+    enabled=os.getenv("COLLECTOR_PROFILE", "0") == "1",
+    threshold=float(os.getenv("COLLECTOR_PROFILE_SLOW_MS", "50")) / 1000,
+    sample_rate=float(os.getenv("COLLECTOR_PROFILE_SAMPLE_RATE", "0.1")),
+    out_path=os.getenv("COLLECTOR_PROFILE_PATH", "/tmp/collector_profile.txt"),
+)
+
 if not (API_ID and API_HASH and SESSION_B64 and DATABASE_URL and CHANNELS_RAW.strip()):
     raise ValueError("❌ Проверь TG_API_ID, TG_API_HASH, TG_SESSION_B64, DATABASE_URL и CHANNELS в .env")
 
@@ -86,7 +97,7 @@ CH_NAME2ID: Dict[str, int] = {}
 
 # ======================= БД =======================
 def get_conn():
-    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row)
+    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row, cursor_factory=InstrumentedCursor)
 
 def ensure_schema_and_indexes():
     """Гарантируем всё нужное в БД один раз при запуске."""
@@ -122,7 +133,9 @@ def ensure_schema_and_indexes():
 
 def _get_cp(chat: str) -> int:
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute("SELECT last_msg_id FROM collect_checkpoints WHERE source_chat=%s;", (chat,))
+        cur.execute(
+            "SELECT last_msg_id FROM collect_checkpoints WHERE source_chat=%s;", (chat,), name="checkpoint.get"
+        )
         row = cur.fetchone()
         return int(row["last_msg_id"]) if row and row["last_msg_id"] else 0
 
@@ -134,7 +147,7 @@ def _set_cp(chat: str, last_id: int):
             ON CONFLICT (source_chat) DO UPDATE SET
                 last_msg_id=EXCLUDED.last_msg_id,
                 updated_at=now();
-        """, (chat, int(last_id)))
+        """, (chat, int(last_id)), name="checkpoint.set")
 
 # ======================= UPSERT/SELECT =======================
 SQL_UPSERT_TOUR = """
@@ -168,14 +181,14 @@ def save_tours_bulk(rows: list[dict]):
         return
     try:
         with get_conn() as conn, conn.cursor() as cur:
-            cur.executemany(SQL_UPSERT_TOUR, rows)
+            cur.executemany(SQL_UPSERT_TOUR, rows, name="tours.upsert_batch")
         logging.info("💾 Сохранил/обновил батч: %d шт.", len(rows))
     except Exception as e:
         logging.warning("⚠️ Bulk upsert failed, fallback to single. Reason: %s", e)
         for r in rows:
             try:
                 with get_conn() as conn, conn.cursor() as cur:
-                    cur.execute(SQL_UPSERT_TOUR, r)
+                    cur.execute(SQL_UPSERT_TOUR, r, name="tours.upsert_one")
             except Exception as ee:
                 logging.error("❌ Ошибка при сохранении тура (msg_id=%s chat=%s): %s",
                               r.get("message_id"), r.get("source_chat"), ee)
@@ -186,7 +199,7 @@ def get_existing_rows(source_chat: str, message_id: int) -> List[dict]:
             SELECT *
               FROM tours
              WHERE source_chat=%s AND message_id=%s
-        """, (source_chat, message_id))
+        """, (source_chat, message_id), name="tours.by_message")
         return cur.fetchall() or []
 
 def delete_rows_not_in(source_chat: str, message_id: int, keep_stable_keys: List[str]):
@@ -206,7 +219,7 @@ def delete_rows_not_in(source_chat: str, message_id: int, keep_stable_keys: List
              WHERE source_chat=%s AND message_id=%s
         """
     with get_conn() as conn, conn.cursor() as cur:
-        cur.execute(sql, params)
+        cur.execute(sql, params, name="tours.delete_stale_variants")
 
 # ======================= СЛОВАРИ/РЕГЕКС =======================
 WHITELIST_SUFFIXES = [
@@ -554,12 +567,19 @@ def parse_post(text: str, link: str, msg_id: int, chat: str, posted_at: datetime
     return payload_base, (hotels if hotels else [hotel] if hotel else [])
 
 # ======================= COLLECT ONCE =======================
+# SIGTERM/SIGINT (деплой, рестарт): дочитываем текущее сообщение, сбрасываем батч
+# и сохраняем чекпоинт — после рестарта продолжим с того же места без перечитывания
+STOP_EVENT = asyncio.Event()
+
+
 async def collect_once(client: TelegramClient):
     """Один проход по всем каналам с батч-сохранением и фильтрами актуальности."""
     now_utc = datetime.now(timezone.utc)
     cutoff = now_utc - timedelta(days=MAX_POST_AGE_DAYS)
 
     for channel in CHANNELS:
+        if STOP_EVENT.is_set():
+            break
         logging.info("📥 Канал: %s", channel)
         batch: list[dict] = []
         last_id = _get_cp(channel)
@@ -567,6 +587,9 @@ async def collect_once(client: TelegramClient):
 
         # читаем только новее чекпоинта, в прямом порядке (старые → новые)
         async for msg in client.iter_messages(channel, min_id=last_id, reverse=True, limit=FETCH_LIMIT):
+            if STOP_EVENT.is_set():
+                logging.info("🛑 %s: остановка — сохраняю батч и чекпоинт", channel)
+                break
             text = (msg.text or "").strip()
             if not text:
                 continue
@@ -577,8 +600,8 @@ async def collect_once(client: TelegramClient):
 
             def _make_rows() -> List[dict]:
                 link = f"https://t.me/{channel.lstrip('@')}/{msg.id}"
-                base, hotels = parse_post(
-                    text, link, msg.id, channel,
+                base, hotels = PROFILER.run_sync(
+                    "parse_post", parse_post, text, link, msg.id, channel,
                     msg.date if msg.date.tzinfo else msg.date.replace(tzinfo=timezone.utc),
                 )
                 rows: List[dict] = []
@@ -685,8 +708,8 @@ async def handle_edit_event(event: events.MessageEdited.Event):
     except Exception:
         link = f"https://t.me/{channel.lstrip('@')}/{event.message.id}" if channel.startswith("@") else ""
 
-    base, hotels = parse_post(
-        text, link, event.message.id, channel,
+    base, hotels = PROFILER.run_sync(
+        "parse_post", parse_post, text, link, event.message.id, channel,
         event.message.date if event.message.date.tzinfo else event.message.date.replace(tzinfo=timezone.utc)
     )
 
@@ -748,15 +771,29 @@ async def run_collector():
     # Подписываемся на edits глобально и фильтруем по нашим каналам внутри.
     client.add_event_handler(handle_edit_event, events.MessageEdited())
 
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(sig, STOP_EVENT.set)
+        except (NotImplementedError, RuntimeError):  # Windows / не главный поток
+            pass
+
     logging.info("✅ Collector запущен. Каналы: %s", ", ".join(CHANNELS))
 
-    while True:
+    while not STOP_EVENT.is_set():
         try:
-            await collect_once(client)
+            await PROFILER.run_async("collect_once", collect_once, client)
         except Exception as e:
             logging.error("❌ Ошибка в коллекторе: %s", e)
+        PROFILER.dump()
         # лёгкий джиттер, чтобы не совпадать с другими процессами по минутам
-        await asyncio.sleep(SLEEP_BASE + int(10 * (os.getpid() % 3)))
+        try:
+            await asyncio.wait_for(STOP_EVENT.wait(), timeout=SLEEP_BASE + int(10 * (os.getpid() % 3)))
+        except asyncio.TimeoutError:
+            pass
+
+    logging.info("🛑 Collector остановлен: батч и чекпоинты сохранены")
+    await client.disconnect()
 
 if __name__ == "__main__":
     asyncio.run(run_collector())
@@ -2,13 +2,16 @@
 
 import os
 import logging
+from contextlib import contextmanager
 from psycopg import connect
 from psycopg.rows import dict_row
 
+from utils.db import InstrumentedCursor
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 def get_conn():
-    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row)
+    return connect(DATABASE_URL, autocommit=True, row_factory=dict_row, cursor_factory=InstrumentedCursor)
 
 def init_db():
     with get_conn() as conn, conn.cursor() as cur:
@@ -162,5 +165,43 @@ def set_config(key: str, val: str):
             ON CONFLICT(key) DO UPDATE SET val=EXCLUDED.val;
         """, (key, val))
 
+# ===== Выбор лидера через advisory lock =====
+@contextmanager
+def advisory_lock(key: int):
+    """
+    Блокирующая сессионная advisory-блокировка на время блока: сериализует, например,
+    DDL при одновременном старте нескольких инстансов. Снимается вместе с сессией.
+    """
+    conn = connect(DATABASE_URL, autocommit=True)
+    try:
+        conn.execute("SELECT pg_advisory_lock(%s);", (key,))
+        yield
+    finally:
+        conn.close()
+
+def try_advisory_lock(key: int):
+    """
+    Сессионная advisory-блокировка Postgres. Вернёт открытое соединение, которое держит
+    блокировку (держите его, пока вы лидер), или None, если блокировка уже у другого процесса.
+    """
+    conn = connect(DATABASE_URL, autocommit=True, row_factory=dict_row)
+    try:
+        row = conn.execute("SELECT pg_try_advisory_lock(%s) AS ok;", (key,)).fetchone()
+    except Exception:
+        conn.close()
+        raise
+    if row and row["ok"]:
+        return conn
+    conn.close()
+    return None
+
+def lock_alive(conn) -> bool:
+    """Соединение-держатель живо (иначе блокировка уже отпущена сервером)."""
+    try:
+        conn.execute("SELECT 1;")
+        return True
+    except Exception:
+        return False
+
 if __name__ == "__main__":
     init_db()
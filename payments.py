@@ -12,6 +12,8 @@ from datetime import datetime, timedelta, timezone
 from psycopg import connect
 from psycopg.rows import dict_row
 
+from utils.db import InstrumentedCursor
+
 DB_URL = os.getenv("DATABASE_URL")
 
 # ===== провайдеры =====
@@ -30,7 +32,7 @@ PAYME_CANCEL_URL    = os.getenv("PAYME_CANCEL_URL", "")          # https://<ва
 
 # ===== вспомогательные =====
 def db():
-    return connect(DB_URL, autocommit=True, row_factory=dict_row)
+    return connect(DB_URL, autocommit=True, row_factory=dict_row, cursor_factory=InstrumentedCursor)
 
 def now_utc() -> datetime:
     return datetime.now(timezone.utc)
@@ -71,6 +73,30 @@ def mark_order_paid(order_id: int, provider_trx_id: str, raw: dict):
             WHERE id=%s;
         """, (provider_trx_id, json.dumps(raw), order_id))
 
+def claim_order_for_trx(cur, order_id: int, provider_trx_id: str, create_ms: int) -> Optional[int]:
+    """
+    Захват заказа транзакцией Payme одним UPDATE: параллельный Create с другим id Payme
+    не перезапишет наш. Повтор с тем же id — идемпотентен. Возвращает create_time (мс,
+    из БД с округлением — везде одинаковый int) или None, если заказ занят/не найден.
+    """
+    cur.execute(
+        """
+        UPDATE orders
+           SET provider_trx_id=%s,
+               status=%s,
+               created_at = COALESCE(created_at, to_timestamp(%s/1000.0))
+         WHERE id=%s
+           AND (provider_trx_id IS NULL OR provider_trx_id=%s)
+        RETURNING ROUND(EXTRACT(EPOCH FROM created_at) * 1000)::BIGINT AS create_ms
+        """,
+        (provider_trx_id, "created", create_ms, int(order_id), provider_trx_id),
+        name="payme.create_claim",
+    )
+    row = cur.fetchone()
+    if not row:
+        return None
+    return int(row["create_ms"] or create_ms)
+
 def upsert_subscription(user_id: int, plan_code: str, provider: str, payment_token: Optional[str], days: int):
     """Создаёт или продлевает подписку."""
     with db() as conn, conn.cursor() as cur:
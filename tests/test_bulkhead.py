@@ -0,0 +1,42 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.bulkhead import Bulkhead
+
+
+def test_returns_result_and_propagates_errors():
+    async def main():
+        bh = Bulkhead(ThreadPoolExecutor(max_workers=1), limit=1, timeout=1.0)
+        assert await bh.run(lambda a, b: a + b, 2, 3) == 5
+        with pytest.raises(ZeroDivisionError):
+            await bh.run(lambda: 1 / 0)
+        return bh
+
+    assert asyncio.run(main()).busy == 0
+
+
+def test_timeout_keeps_slot_until_thread_finishes():
+    release = threading.Event()
+
+    async def main():
+        bh = Bulkhead(ThreadPoolExecutor(max_workers=2), limit=1, timeout=0.1)
+        with pytest.raises(asyncio.TimeoutError):
+            await bh.run(release.wait)
+        # поток ещё работает — слот занят, следующий вызов не пролезет сверх лимита
+        assert bh.busy == 1
+        with pytest.raises(asyncio.TimeoutError):
+            await bh.run(lambda: "late")
+        release.set()
+        for _ in range(50):
+            if bh.busy == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert bh.busy == 0
+        assert await bh.run(lambda: "ok") == "ok"
+        return bh
+
+    bh = asyncio.run(main())
+    assert bh.timeouts == 2
@@ -0,0 +1,37 @@
+from utils.cache import LRUCache
+
+
+def test_get_refreshes_recency():
+    c = LRUCache(maxsize=2)
+    c.put("a", 1)
+    c.put("b", 2)
+    assert c.get("a") == 1
+    c.put("c", 3)
+    assert "a" in c and "b" not in c
+    assert c.evictions == 1
+    assert c.get("b", "miss") == "miss"
+    assert (c.hits, c.misses) == (1, 1)
+
+
+def test_eviction_keeps_groups_consistent():
+    c = LRUCache(maxsize=3, group=lambda k: k[0])
+    c.put((1, "ru"), "a")
+    c.put((1, "en"), "b")
+    c.put((2, "ru"), "c")
+    c.put((3, "ru"), "d")  # вытесняет (1, "ru")
+    assert (1, "ru") not in c
+    assert c.invalidate_group(1) == 1
+    assert (1, "en") not in c
+    assert len(c) == 2
+    c.put((2, "en"), "e")
+    c.put((4, "ru"), "f")  # вытесняет (2, "ru"), в группе 2 остаётся (2, "en")
+    assert c.invalidate_group(2) == 1
+    assert (2, "en") not in c
+    assert len(c) == 2
+
+
+def test_pop_forgets_group():
+    c = LRUCache(maxsize=4, group=lambda k: k[0])
+    c.put((1, "ru"), "a")
+    assert c.pop((1, "ru")) == "a"
+    assert c.invalidate_group(1) == 0
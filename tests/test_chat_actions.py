@@ -0,0 +1,44 @@
+import asyncio
+
+from utils.chat_actions import TypingTicker
+
+
+def test_one_action_per_interval_for_nested_busy_blocks():
+    async def main():
+        sent = []
+
+        async def send(chat_id):
+            sent.append(chat_id)
+
+        ticker = TypingTicker(send, interval=0.2)
+        async with ticker.busy(1):
+            async with ticker.busy(1):  # вторая обработка в том же чате — без лишних вызовов
+                await asyncio.sleep(0.5)
+        await asyncio.sleep(0.3)  # после выхода — больше не шлём
+        return sent, ticker
+
+    sent, ticker = asyncio.run(main())
+    assert sent == [1, 1, 1]
+    assert ticker.busy_chats() == 0
+
+
+def test_stuck_chat_does_not_delay_others_and_paused_chat_is_skipped():
+    async def main():
+        sent = []
+
+        async def send(chat_id):
+            if chat_id == "stuck":
+                await asyncio.sleep(10)
+            sent.append(chat_id)
+
+        ticker = TypingTicker(send, interval=0.2, timeout=0.05, skip=lambda c: c == "paused")
+        async with ticker.busy("stuck"), ticker.busy("ok"), ticker.busy("paused"):
+            await asyncio.sleep(0.5)
+        await asyncio.sleep(0.1)
+        return sent, ticker.stats()
+
+    sent, stats = asyncio.run(main())
+    assert sent == ["ok", "ok", "ok"]
+    assert stats["errors"] == 3  # таймауты «stuck»
+    assert stats["skipped"] == 3
+    assert stats["sending"] == 0
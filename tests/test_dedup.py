@@ -0,0 +1,31 @@
+from utils.dedup import RecentIds
+
+
+def test_add_reports_duplicates():
+    r = RecentIds(maxlen=10)
+    assert r.add(1)
+    assert not r.add(1)
+    assert r.duplicates == 1
+    assert 1 in r and len(r) == 1
+
+
+def test_window_evicts_oldest():
+    r = RecentIds(maxlen=3)
+    for i in range(4):
+        r.add(i)
+    assert 0 not in r
+    assert [i in r for i in (1, 2, 3)] == [True, True, True]
+    assert r.add(0)  # вытесненный id снова принимается
+
+
+def test_discard_lets_id_come_again():
+    r = RecentIds(maxlen=3)
+    r.add("a")
+    r.add("b")
+    r.discard("a")
+    r.discard("missing")
+    assert "a" not in r and len(r) == 1
+    assert r.add("a")
+    # discard убрал id и из порядка: окно не вытесняет лишнего
+    r.add("c")
+    assert ["a" in r, "b" in r, "c" in r] == [True, True, True]
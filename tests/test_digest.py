@@ -0,0 +1,55 @@
+import asyncio
+
+from utils.digest import BurstDigest
+
+
+def _run_burst(digest_kwargs, lines, *, fail_on=None):
+    async def main():
+        singles, digests = [], []
+
+        async def send_digest(chunk):
+            if fail_on is not None and fail_on in chunk:
+                raise RuntimeError("send failed")
+            digests.append(list(chunk))
+
+        d = BurstDigest(send_digest, window=0.05, **digest_kwargs)
+
+        async def single(line):
+            singles.append(line)
+
+        results = await asyncio.gather(
+            *(d.submit(lambda line=line: single(line), line) for line in lines), return_exceptions=True
+        )
+        return singles, digests, results, d
+
+    return asyncio.run(main())
+
+
+def test_first_events_go_immediately_rest_are_digested():
+    singles, digests, results, d = _run_burst({"max_immediate": 2}, [f"l{i}" for i in range(5)])
+    assert singles == ["l0", "l1"]
+    assert digests == [["l2", "l3", "l4"]]
+    assert all(r is None for r in results)
+    assert d.stats() == {"pending": 0, "immediate": 2, "digested": 3, "digests": 1}
+
+
+def test_digest_is_split_by_max_lines():
+    _, digests, _, _ = _run_burst({"max_immediate": 0, "max_lines": 2}, [f"l{i}" for i in range(5)])
+    assert digests == [["l0", "l1"], ["l2", "l3"], ["l4"]]
+
+
+def test_digest_is_split_on_line_boundaries_by_max_chars():
+    lines = ["a" * 10, "b" * 10, "c" * 10, "d" * 30]
+    _, digests, _, _ = _run_burst({"max_immediate": 0, "max_chars": 25}, lines)
+    assert digests == [["a" * 10, "b" * 10], ["c" * 10], ["d" * 30]]  # длинная строка не режется
+    for chunk in digests[:-1]:
+        assert sum(len(x) + 1 for x in chunk) <= 25
+
+
+def test_failed_chunk_fails_only_its_own_waiters():
+    _, digests, results, _ = _run_burst(
+        {"max_immediate": 0, "max_lines": 2}, ["l0", "l1", "l2", "l3"], fail_on="l2"
+    )
+    assert digests == [["l0", "l1"]]
+    assert results[:2] == [None, None]
+    assert all(isinstance(r, RuntimeError) for r in results[2:])
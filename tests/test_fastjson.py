@@ -0,0 +1,33 @@
+import math
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from utils import fastjson  # noqa: E402
+
+PAYLOAD = {"ok": 1.5, "nan": math.nan, "inf": [math.inf, -math.inf], 7: "int key", "s": "привет"}
+EXPECTED = {"ok": 1.5, "nan": None, "inf": [None, None], "7": "int key", "s": "привет"}
+
+
+@pytest.fixture(params=["json", "orjson"])
+def backend(request, monkeypatch):
+    if request.param == "json":
+        monkeypatch.setattr(fastjson, "orjson", None)
+    elif fastjson.orjson is None:
+        pytest.skip("orjson не установлен")
+    return request.param
+
+
+def test_non_finite_floats_become_null_on_every_backend(backend):
+    assert fastjson.loads(fastjson.dumps(PAYLOAD)) == EXPECTED
+
+
+def test_finite_payload_is_compact_utf8(backend):
+    assert fastjson.dumps({"a": [1, 2], "b": "ё"}) == '{"a":[1,2],"b":"ё"}'.encode("utf-8")
+
+
+def test_response_renders_non_finite_floats(backend):
+    resp = fastjson.FastJSONResponse({"lag": math.nan})
+    assert resp.body == b'{"lag":null}'
+    assert resp.media_type == "application/json"
@@ -0,0 +1,24 @@
+import asyncio
+import time
+
+from utils.loopmon import LoopLagMonitor
+
+
+def test_reset_keeps_monotonic_stall_total():
+    async def main():
+        mon = LoopLagMonitor(interval=0.02, threshold=0.1)
+        mon.start()
+        await asyncio.sleep(0.05)
+        time.sleep(0.4)  # блокируем loop дольше порога
+        await asyncio.sleep(0.1)
+        mon.stop()
+        return mon
+
+    mon = asyncio.run(main())
+    assert mon.stalls >= 1
+    assert mon.stalls_total == mon.stalls
+    assert mon.report()["top_sites"]
+
+    mon.reset()
+    assert mon.stalls == 0 and not mon.report()["top_sites"]
+    assert mon.stalls_total >= 1  # счётчик для Prometheus не откатывается
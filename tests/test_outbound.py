@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from utils.outbound import PRIO_BULK, PRIO_USER, OutboundScheduler
+
+
+class RetryAfter(Exception):
+    def __init__(self, sec):
+        super().__init__(f"retry after {sec}")
+        self.retry_after = sec
+
+
+def test_global_tokens_go_to_higher_priority_first():
+    async def main():
+        sched = OutboundScheduler(global_per_sec=20, global_burst=1, chat_burst=10)
+        order = []
+
+        async def call(tag):
+            order.append(tag)
+
+        # первый вызов съедает единственный токен, остальные ждут пополнения в очереди
+        await sched.run(1, lambda: call("first"))
+        tasks = [asyncio.create_task(sched.run(10 + i, lambda i=i: call(f"bulk{i}"), PRIO_BULK)) for i in range(3)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(sched.run(2, lambda: call("user"), PRIO_USER)))
+        await asyncio.gather(*tasks)
+        return order
+
+    order = asyncio.run(main())
+    assert order[0] == "first"
+    assert order[1] == "user"
+
+
+def test_retry_after_pauses_chat_and_retries():
+    async def main():
+        sched = OutboundScheduler(global_per_sec=100, global_burst=100)
+        calls = []
+
+        async def flaky():
+            calls.append(asyncio.get_running_loop().time())
+            if len(calls) == 1:
+                raise RetryAfter(0.1)
+            return "ok"
+
+        res = await sched.run(5, flaky)
+        return res, calls, sched
+
+    res, calls, sched = asyncio.run(main())
+    assert res == "ok"
+    assert len(calls) == 2 and calls[1] - calls[0] >= 0.09
+    assert (sched.retry_after_hits, sched.sent, sched.failed) == (1, 1, 0)
+
+
+def test_retry_after_gives_up_after_max_retries():
+    async def main():
+        sched = OutboundScheduler(global_per_sec=100, global_burst=100, max_retries=1)
+
+        async def always():
+            raise RetryAfter(0.01)
+
+        with pytest.raises(RetryAfter):
+            await sched.run(5, always)
+        return sched
+
+    sched = asyncio.run(main())
+    assert sched.failed == 1
+
+
+def test_unlimited_call_skips_chat_bucket_and_does_not_retry():
+    async def main():
+        sched = OutboundScheduler(global_per_sec=100, global_burst=100, chat_per_sec=0.001, chat_burst=1)
+
+        async def ok():
+            return "ok"
+
+        await sched.run(7, ok)  # единственный токен чата
+        # второй обычный вызов ждал бы ~1000 с, а «печатает…» идёт мимо бакета чата
+        assert await asyncio.wait_for(sched.run(7, ok, chat_limited=False), 0.5) == "ok"
+
+        async def throttled():
+            raise RetryAfter(5)
+
+        with pytest.raises(RetryAfter):
+            await sched.run(8, throttled, chat_limited=False)
+        return sched
+
+    sched = asyncio.run(main())
+    assert sched.is_paused(8)
+    assert not sched.is_paused(7)
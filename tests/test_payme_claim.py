@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+pytest.importorskip("psycopg")
+
+from psycopg import connect  # noqa: E402
+from psycopg.rows import dict_row  # noqa: E402
+
+from payments import claim_order_for_trx  # noqa: E402
+from utils.db import InstrumentedCursor  # noqa: E402
+
+TEST_DB = os.getenv("TEST_DATABASE_URL")
+
+
+@pytest.fixture
+def cur():
+    if not TEST_DB:
+        pytest.skip("TEST_DATABASE_URL не задан")
+    with connect(TEST_DB, row_factory=dict_row, cursor_factory=InstrumentedCursor) as conn:
+        with conn.cursor() as c:
+            c.execute("SET TIME ZONE 'UTC'")
+            # временная таблица перекрывает настоящую orders только в этой сессии
+            c.execute(
+                "CREATE TEMP TABLE orders (id BIGINT PRIMARY KEY, provider_trx_id TEXT, "
+                "status TEXT, created_at TIMESTAMP)"
+            )
+            c.execute("INSERT INTO orders (id, status) VALUES (1, 'pending')")
+            yield c
+        conn.rollback()
+
+
+def test_claim_is_exclusive_and_idempotent(cur):
+    ms = claim_order_for_trx(cur, 1, "trx-a", 1_700_000_000_000)
+    assert ms == 1_700_000_000_000
+    # другой id Payme на уже захваченный заказ — отказ (-31099 в обработчике)
+    assert claim_order_for_trx(cur, 1, "trx-b", 1_700_000_001_000) is None
+    # повтор того же Create — тот же create_time из БД
+    assert claim_order_for_trx(cur, 1, "trx-a", 1_700_000_002_000) == ms
+    cur.execute("SELECT provider_trx_id, status FROM orders WHERE id=1")
+    assert cur.fetchone() == {"provider_trx_id": "trx-a", "status": "created"}
+
+
+def test_claim_unknown_order(cur):
+    assert claim_order_for_trx(cur, 999, "trx-a", 1_700_000_000_000) is None
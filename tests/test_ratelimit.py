@@ -0,0 +1,50 @@
+from utils.ratelimit import BucketRegistry, TokenBucket
+
+
+def test_bucket_starts_full_and_allows_burst():
+    b = TokenBucket(rate=1.0, capacity=3, now=0.0)
+    assert [b.try_acquire(now=0.0) for _ in range(4)] == [True, True, True, False]
+
+
+def test_bucket_refills_at_rate_up_to_capacity():
+    b = TokenBucket(rate=2.0, capacity=4, now=0.0)
+    for _ in range(4):
+        b.consume(now=0.0)
+    assert b.wait_time(now=0.0) == 0.5
+    assert b.wait_time(now=0.25) == 0.25
+    assert b.try_acquire(now=0.5)
+    assert not b.try_acquire(now=0.5)
+    # за долгий простой запас не превышает capacity
+    assert b.wait_time(n=4, now=100.0) == 0.0
+    assert b.wait_time(n=5, now=100.0) == 0.5
+
+
+def test_consume_goes_into_debt():
+    b = TokenBucket(rate=1.0, capacity=1, now=0.0)
+    b.consume(now=0.0)
+    b.consume(now=0.0)
+    assert b.wait_time(now=0.0) == 2.0
+    assert not b.is_full(now=1.5)
+    assert b.is_full(now=2.0)
+
+
+def test_zero_rate_never_refills():
+    b = TokenBucket(rate=0.0, capacity=1, now=0.0)
+    b.consume(now=0.0)
+    assert b.wait_time(now=1000.0) == float("inf")
+
+
+def test_registry_reuses_buckets_and_bounds_keys():
+    created = []
+
+    def factory(key):
+        created.append(key)
+        return TokenBucket(rate=1.0, capacity=1)
+
+    reg = BucketRegistry(factory, max_keys=3)
+    a = reg.get("a")
+    assert reg.get("a") is a
+    for k in "bcde":
+        reg.get(k)
+    assert len(reg) == 3
+    assert created == list("abcde")
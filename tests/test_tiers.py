@@ -0,0 +1,72 @@
+from types import SimpleNamespace as NS
+
+from utils.tiers import (
+    TIER_CORE, TIER_HEAVY, TIER_NAV, TIER_SEARCH, classify_update, default_tier_limits, should_shed,
+)
+
+LEADS = -100500
+
+
+def _classify(update, asking=()):
+    return classify_update(
+        update,
+        is_admin_chat=lambda chat_id: chat_id == LEADS,
+        asking=lambda uid: uid in asking,
+        is_menu=lambda text: text == "🎒 Найти туры",
+    )
+
+
+def _msg(text=None, chat_id=42, user_id=42, reply=False, **kw):
+    m = NS(
+        text=text, chat=NS(id=chat_id), from_user=NS(id=user_id),
+        reply_to_message=NS(text="q") if reply else None,
+        contact=kw.get("contact"), successful_payment=kw.get("successful_payment"),
+    )
+    return NS(pre_checkout_query=None, callback_query=None, message=m)
+
+
+def _cb(data):
+    return NS(pre_checkout_query=None, callback_query=NS(data=data), message=None)
+
+
+def test_payments_contacts_and_core_callbacks_are_core():
+    assert _classify(NS(pre_checkout_query=object(), callback_query=None, message=None)) == TIER_CORE
+    assert _classify(_msg(contact=object())) == TIER_CORE
+    assert _classify(_msg(successful_payment=object())) == TIER_CORE
+    assert _classify(_cb("sub:basic")) == TIER_CORE
+    assert _classify(_msg("мой вопрос", user_id=7), asking={7}) == TIER_CORE
+
+
+def test_only_admin_group_replies_are_core():
+    assert _classify(_msg("ответ", chat_id=LEADS, reply=True)) == TIER_CORE
+    # reply обычного пользователя не перепрыгивает очередь
+    assert _classify(_msg("Турция", reply=True)) == TIER_SEARCH
+    assert _classify(_msg("/start", reply=True)) == TIER_NAV
+
+
+def test_other_tiers():
+    assert _classify(_cb("wx:Анталья")) == TIER_HEAVY
+    assert _classify(_cb("more:tok:10")) == TIER_NAV
+    assert _classify(_cb("whatever")) == TIER_SEARCH
+    assert _classify(_msg("какая погода в Дубае")) == TIER_HEAVY
+    assert _classify(_msg("🎒 Найти туры")) == TIER_NAV
+    assert _classify(_msg("Египет до 800$")) == TIER_SEARCH
+    assert _classify(NS(pre_checkout_query=None, callback_query=None, message=None)) == TIER_NAV
+
+
+def test_shedding_only_slow_low_tiers():
+    kw = {"min_tier": TIER_SEARCH, "latency": 8.0}
+    assert should_shed(TIER_SEARCH, 9.0, **kw)
+    assert should_shed(TIER_HEAVY, 9.0, **kw)
+    assert not should_shed(TIER_SEARCH, 7.0, **kw)
+    assert not should_shed(TIER_CORE, 60.0, **kw)
+    assert not should_shed(TIER_NAV, 60.0, **kw)
+
+
+def test_default_limits_leave_headroom_for_core():
+    for workers in (1, 2, 4, 8, 16, 32):
+        limits = default_tier_limits(workers)
+        assert limits[0] == workers
+        assert all(n >= 1 for n in limits)
+        if workers >= 4:
+            assert sum(limits[1:]) < workers
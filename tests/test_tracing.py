@@ -0,0 +1,29 @@
+import json
+import time
+
+from utils.tracing import Tracer
+
+
+def test_flush_waits_for_batch_in_writer(tmp_path, monkeypatch):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer("test", enabled=True, path=str(path))
+    posted = []
+
+    def slow_post(batch):
+        time.sleep(0.3)  # писатель уже достал батч из очереди, но ещё не дописал
+        posted.extend(batch)
+
+    monkeypatch.setattr(tracer, "_post", slow_post)
+    tracer.collector_url = "http://collector.invalid/api/v2/spans"
+
+    for i in range(5):
+        with tracer.trace(f"op{i}"):
+            pass
+    t0 = time.monotonic()
+    tracer.flush(timeout=5.0)
+
+    assert len(posted) == 5
+    assert time.monotonic() - t0 < 1.0  # не ждём окно батча, когда идёт flush
+    names = [json.loads(line)["name"] for line in path.read_text(encoding="utf-8").splitlines()]
+    assert names == [f"op{i}" for i in range(5)]
+    tracer.configure(enabled=False)
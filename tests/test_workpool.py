@@ -0,0 +1,139 @@
+import asyncio
+
+from utils.workpool import KeyedWorkerPool
+
+
+def test_items_of_one_key_run_in_order_and_keys_in_parallel():
+    async def main():
+        log = []
+        running = set()
+        overlap = []
+
+        async def handler(item):
+            key, n = item
+            assert key not in running  # один ключ — не больше одного элемента одновременно
+            running.add(key)
+            overlap.append(len(running))
+            await asyncio.sleep(0.01)
+            running.discard(key)
+            log.append(item)
+
+        pool = KeyedWorkerPool(handler, workers=4)
+        pool.start()
+        for n in range(5):
+            for key in "ab":
+                assert pool.submit(key, (key, n))
+        assert await pool.drain(2.0)
+        await pool.stop()
+        return log, overlap, pool.processed
+
+    log, overlap, processed = asyncio.run(main())
+    assert [n for k, n in log if k == "a"] == list(range(5))
+    assert [n for k, n in log if k == "b"] == list(range(5))
+    assert max(overlap) == 2
+    assert processed == 10
+
+
+def test_submit_rejects_when_full_and_failures_do_not_stop_key():
+    async def main():
+        seen = []
+
+        async def handler(item):
+            seen.append(item)
+            if item == 1:
+                raise RuntimeError("boom")
+
+        pool = KeyedWorkerPool(handler, workers=1, max_queue=3)
+        assert [pool.submit("k", i) for i in range(4)] == [True, True, True, False]
+        pool.start()
+        assert await pool.drain(1.0)
+        await pool.stop()
+        return seen, pool
+
+    seen, pool = asyncio.run(main())
+    assert seen == [0, 1, 2]
+    assert (pool.processed, pool.failed, pool.rejected) == (2, 1, 1)
+
+
+def test_take_pending_and_stop_split_queued_and_inflight():
+    async def main():
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def handler(item):
+            started.set()
+            await release.wait()
+
+        pool = KeyedWorkerPool(handler, workers=1)
+        pool.start()
+        for i in range(3):
+            pool.submit("k", i)
+        await started.wait()
+        pending = pool.take_pending()
+        interrupted = await pool.stop()
+        return pending, interrupted, pool.stats()
+
+    pending, interrupted, stats = asyncio.run(main())
+    assert pending == [1, 2]
+    assert interrupted == [0]
+    assert stats["pending"] == 0 and stats["workers"] == 0
+
+
+def test_higher_priority_runs_first_and_limits_apply():
+    async def main():
+        order = []
+        active = [0, 0]
+        peak = [0, 0]
+
+        async def handler(item):
+            prio, n = item
+            active[prio] += 1
+            peak[prio] = max(peak[prio], active[prio])
+            await asyncio.sleep(0.01)
+            active[prio] -= 1
+            order.append(item)
+
+        pool = KeyedWorkerPool(handler, workers=3, limits=[3, 1])
+        for n in range(3):
+            pool.submit(f"low{n}", (1, n), priority=1)
+        for n in range(3):
+            pool.submit(f"high{n}", (0, n), priority=0)
+        pool.start()
+        assert await pool.drain(2.0)
+        await pool.stop()
+        return order, peak
+
+    order, peak = asyncio.run(main())
+    assert [p for p, _ in order[:3]] == [0, 0, 0]
+    assert peak[1] == 1  # уровень 1 не выше своего лимита
+
+
+def test_front_submit_runs_before_queued_items_of_key():
+    async def main():
+        log = []
+        started = asyncio.Event()
+        release = asyncio.Event()
+
+        async def handler(item):
+            if item == "live0":
+                started.set()
+                await release.wait()
+            log.append(item)
+
+        pool = KeyedWorkerPool(handler, workers=2)
+        pool.start()
+        pool.submit("k", "live0")
+        pool.submit("k", "live1")
+        await started.wait()
+        assert pool.has_key("k") and not pool.has_key("other")
+        # более старые (доигрываемые) — в голову очереди в обратном порядке
+        for item in ("old2", "old1"):
+            pool.submit("k", item, front=True)
+        release.set()
+        assert await pool.drain(1.0)
+        await pool.stop()
+        return log, pool.has_key("k")
+
+    log, still_has = asyncio.run(main())
+    assert log == ["live0", "old1", "old2", "live1"]
+    assert not still_has
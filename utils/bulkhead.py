@@ -0,0 +1,60 @@
+"""
+Переборка (bulkhead) для блокирующих вызовов: свой пул потоков, потолок одновременных
+вызовов и бюджет времени на каждый.
+
+Слот семафора освобождается, когда поток реально закончил, а не когда вызывающий
+перестал ждать: после таймаута поток ещё работает и держит соединение с БД, и новые
+вызовы не должны набиваться сверх лимита. Текущий contextvars-контекст (трейс)
+переносится в поток.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+from concurrent.futures import Executor
+from typing import Any, Callable, Optional
+
+
+class Bulkhead:
+    def __init__(self, executor: Executor, *, limit: int, timeout: float):
+        self._executor = executor
+        self.limit = max(1, int(limit))
+        self.timeout = float(timeout)
+        self._sem: Optional[asyncio.Semaphore] = None
+        self.busy = 0      # занятые слоты, включая потоки, дорабатывающие после таймаута
+        self.timeouts = 0
+
+    async def run(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """ Выполнить fn(*args) в пуле; asyncio.TimeoutError — если не уложились в бюджет. """
+        if self._sem is None:  # создаём на работающем loop
+            self._sem = asyncio.Semaphore(self.limit)
+        sem = self._sem
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        try:
+            await asyncio.wait_for(sem.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+        self.busy += 1
+        try:
+            ctx = contextvars.copy_context()
+            fut = loop.run_in_executor(self._executor, ctx.run, fn, *args)
+        except BaseException:
+            self.busy -= 1
+            sem.release()
+            raise
+
+        def _done(f: "asyncio.Future[Any]") -> None:
+            self.busy -= 1
+            sem.release()
+            if not f.cancelled():
+                f.exception()  # после таймаута результат никто не ждёт — не шумим «never retrieved»
+
+        fut.add_done_callback(_done)
+        # shield: таймаут не отменяет future — иначе семафор освободился бы при живом потоке
+        try:
+            return await asyncio.wait_for(asyncio.shield(fut), timeout=max(0.1, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
@@ -0,0 +1,88 @@
+"""
+Ограниченный LRU-кэш со статистикой попаданий.
+
+Ключи можно группировать (например, по tour_id): group(key) -> id группы,
+тогда invalidate_group() выкидывает все варианты одного объекта за O(вариантов).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+_MISSING = object()
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 1024, group: Optional[Callable[[Hashable], Hashable]] = None):
+        self.maxsize = max(1, int(maxsize))
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._group = group
+        self._groups: Dict[Hashable, Set[Hashable]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        val = self._data.get(key, _MISSING)
+        if val is _MISSING:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._data.move_to_end(key)
+        return val
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = value
+        if self._group is not None:
+            self._groups.setdefault(self._group(key), set()).add(key)
+        while len(self._data) > self.maxsize:
+            old, _ = self._data.popitem(last=False)
+            self._forget_group(old)
+            self.evictions += 1
+
+    def pop(self, key: Hashable) -> Any:
+        val = self._data.pop(key, None)
+        self._forget_group(key)
+        return val
+
+    def invalidate_group(self, group_id: Hashable) -> int:
+        keys = self._groups.pop(group_id, set())
+        for k in keys:
+            self._data.pop(k, None)
+        return len(keys)
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._groups.clear()
+
+    def _forget_group(self, key: Hashable) -> None:
+        if self._group is None:
+            return
+        gid = self._group(key)
+        keys = self._groups.get(gid)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._groups.pop(gid, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hit_ratio(), 3),
+        }
@@ -0,0 +1,111 @@
+"""
+Общий «тикер» индикатора «печатает…» для всех чатов.
+
+Вместо задачи на каждое сообщение — один цикл: хранит счётчик занятости по чатам,
+раз в interval шлёт по одному действию на занятый чат и сам завершается, когда занятых нет.
+Несколько одновременных обработок в одном чате схлопываются в один вызов.
+Каждая отправка — отдельная задача с коротким таймаутом: чат на паузе (RetryAfter) или
+под троттлингом не задерживает индикатор остальным; чаты, для которых skip(chat_id)
+истинно, на этом тике пропускаются.
+Модуль не зависит от aiogram: отправка передаётся как send(chat_id).
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TypingTicker:
+    def __init__(
+        self,
+        send: Callable[[Hashable], Awaitable[Any]],
+        interval: float = 4.0,
+        *,
+        timeout: float = 2.0,
+        skip: Optional[Callable[[Hashable], bool]] = None,
+    ):
+        self._send = send
+        self.interval = float(interval)
+        self.timeout = float(timeout)
+        self._skip = skip
+        self._sending: Set[asyncio.Task] = set()
+        self._refs: Dict[Hashable, int] = {}
+        self._due: Dict[Hashable, float] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.errors = 0
+        self.skipped = 0
+
+    @asynccontextmanager
+    async def busy(self, chat_id: Hashable):
+        """ Пока блок выполняется, чат считается занятым (показываем «печатает…»). """
+        self._enter(chat_id)
+        try:
+            yield
+        finally:
+            self._leave(chat_id)
+
+    def busy_chats(self) -> int:
+        return len(self._refs)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "busy": len(self._refs), "sent": self.sent, "errors": self.errors,
+            "skipped": self.skipped, "sending": len(self._sending),
+        }
+
+    # ---------- внутреннее ----------
+    def _enter(self, chat_id: Hashable) -> None:
+        n = self._refs.get(chat_id, 0)
+        self._refs[chat_id] = n + 1
+        if n == 0:
+            self._due[chat_id] = 0.0  # первое действие — сразу
+            self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop())
+
+    def _leave(self, chat_id: Hashable) -> None:
+        n = self._refs.get(chat_id, 0) - 1
+        if n > 0:
+            self._refs[chat_id] = n
+            return
+        self._refs.pop(chat_id, None)
+        self._due.pop(chat_id, None)
+
+    async def _send_one(self, chat_id: Hashable) -> None:
+        if chat_id not in self._refs:
+            return
+        try:
+            await asyncio.wait_for(self._send(chat_id), timeout=self.timeout)
+            self.sent += 1
+        except Exception as e:
+            self.errors += 1
+            logger.debug("typing ticker: send to %s failed: %s", chat_id, e)
+
+    async def _loop(self) -> None:
+        while self._refs:
+            self._wake.clear()
+            now = time.monotonic()
+            due = [c for c, t in self._due.items() if t <= now]
+            for c in due:
+                self._due[c] = now + self.interval
+            for c in due:
+                if self._skip is not None and self._skip(c):
+                    self.skipped += 1
+                    continue
+                t = asyncio.create_task(self._send_one(c))
+                self._sending.add(t)
+                t.add_done_callback(self._sending.discard)
+            if not self._due:
+                continue
+            timeout = max(0.0, min(self._due.values()) - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,162 @@
+"""
+Курсор psycopg с метриками: время, исход и число строк каждого запроса по имени.
+
+Имя запроса — явное (cur.execute(sql, params, name="fetch_tours.recent")) или,
+по умолчанию, имя функции, которая вызвала execute (fetch_tours_page, _get_order…).
+Подключается через connect(..., cursor_factory=InstrumentedCursor).
+Внутри активного трейса каждый запрос — дочерний спан db:<имя> (см. utils.tracing).
+
+Медленные запросы (дольше DB_SLOW_MS) пишутся в лог с SQL и параметрами, в которых
+значения заменены на тип/длину — телефоны, имена и токены в лог не попадают.
+DB_EXPLAIN_SLOW=1 — для медленного запроса дополнительно логируется EXPLAIN (без ANALYZE,
+т.е. без повторного выполнения), не чаще раза в DB_EXPLAIN_INTERVAL сек на имя.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from psycopg import Cursor
+from psycopg.rows import tuple_row
+
+from utils.metrics import REGISTRY
+from utils.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    "db_query_seconds", "Время SQL-запроса по имени", ("query", "status"),
+)
+DB_QUERY_ROWS = REGISTRY.histogram(
+    "db_query_rows", "Строк вернул/затронул SQL-запрос", ("query",),
+    buckets=(0, 1, 5, 10, 50, 100, 500, 1000, 5000),
+)
+DB_SLOW_QUERIES = REGISTRY.counter(
+    "db_slow_queries_total", "Запросы дольше DB_SLOW_MS", ("query",),
+)
+
+SLOW_QUERY_SEC = float(os.getenv("DB_SLOW_MS", "500")) / 1000
+EXPLAIN_SLOW = os.getenv("DB_EXPLAIN_SLOW", "0").strip().lower() in ("1", "true", "yes")
+EXPLAIN_INTERVAL_SEC = float(os.getenv("DB_EXPLAIN_INTERVAL", "600"))
+
+_EXPLAINED: Dict[str, float] = {}
+_EXPLAINED_LOCK = threading.Lock()
+_WS = re.compile(r"\s+")
+
+
+def _caller_name(depth: int = 2) -> str:
+    """ Первая функция вне psycopg/этого модуля в стеке вызова. """
+    f = sys._getframe(depth)
+    for _ in range(6):
+        if f is None:
+            break
+        mod = f.f_globals.get("__name__", "")
+        if not (mod.startswith("psycopg") or mod == __name__):
+            return f.f_code.co_name
+        f = f.f_back
+    return "unknown"
+
+
+def _redact_value(v: Any) -> str:
+    if v is None:
+        return "NULL"
+    if isinstance(v, (str, bytes, list, tuple, set)):
+        return f"<{type(v).__name__}:{len(v)}>"
+    return f"<{type(v).__name__}>"
+
+
+def redact_params(params: Any) -> Any:
+    """ Параметры запроса без значений: только типы и длины. """
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {k: _redact_value(v) for k, v in params.items()}
+    try:
+        return [_redact_value(v) for v in params]
+    except TypeError:
+        return _redact_value(params)
+
+
+def _sql_text(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = repr(query)  # psycopg.sql.Composed и т.п.
+    return _WS.sub(" ", query).strip()
+
+
+def _explain_due(qname: str) -> bool:
+    now = time.monotonic()
+    with _EXPLAINED_LOCK:
+        last = _EXPLAINED.get(qname)
+        if last is not None and now - last < EXPLAIN_INTERVAL_SEC:
+            return False
+        _EXPLAINED[qname] = now
+        return True
+
+
+class InstrumentedCursor(Cursor):
+    def execute(self, query, params=None, *, name: Optional[str] = None, **kwargs: Any):
+        qname = name or _caller_name()
+        status = "ok"
+        t0 = time.perf_counter()
+        with TRACER.span(f"db:{qname}", kind="CLIENT") as sp:
+            try:
+                return super().execute(query, params, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                elapsed = time.perf_counter() - t0
+                DB_QUERY_SECONDS.observe(elapsed, query=qname, status=status)
+                self._after(qname, query, redact_params(params), elapsed, status, sp)
+                if EXPLAIN_SLOW and status == "ok" and elapsed >= SLOW_QUERY_SEC and _explain_due(qname):
+                    self._explain(qname, query, params)
+
+    def executemany(self, query, params_seq, *, name: Optional[str] = None, **kwargs: Any):
+        qname = name or _caller_name()
+        status = "ok"
+        t0 = time.perf_counter()
+        with TRACER.span(f"db:{qname}", kind="CLIENT") as sp:
+            try:
+                return super().executemany(query, params_seq, **kwargs)
+            except Exception:
+                status = "error"
+                raise
+            finally:
+                elapsed = time.perf_counter() - t0
+                DB_QUERY_SECONDS.observe(elapsed, query=qname, status=status)
+                n = len(params_seq) if hasattr(params_seq, "__len__") else "?"
+                self._after(qname, query, f"<{n} param sets>", elapsed, status, sp)
+
+    # ---------- внутреннее ----------
+    def _after(self, qname: str, query, redacted, elapsed: float, status: str, sp) -> None:
+        rows = self.rowcount if status == "ok" else -1
+        if rows >= 0:
+            DB_QUERY_ROWS.observe(rows, query=qname)
+            sp.tag("db.rows", rows)
+        if elapsed < SLOW_QUERY_SEC:
+            return
+        DB_SLOW_QUERIES.inc(query=qname)
+        logger.warning(
+            "slow query %s: %.0f ms, status=%s rows=%s sql=%s params=%s",
+            qname, elapsed * 1000, status, rows, _sql_text(query)[:500], redacted,
+        )
+
+    def _explain(self, qname: str, query, params) -> None:
+        conn = self.connection
+        # в открытой транзакции ошибка EXPLAIN оборвала бы её — только для autocommit-соединений
+        if not conn.autocommit or not isinstance(query, str):
+            return
+        try:
+            with Cursor(conn, row_factory=tuple_row) as cur:  # обычный курсор: без метрик и рекурсии
+                cur.execute("EXPLAIN " + query, params)
+                plan = "\n".join(r[0] for r in cur.fetchall())
+            logger.warning("plan for %s:\n%s", qname, plan)
+        except Exception as e:
+            logger.info("EXPLAIN for %s failed: %s", qname, e)
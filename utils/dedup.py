@@ -0,0 +1,44 @@
+"""
+Окно недавних идентификаторов (update_id и т.п.) для отсева повторных доставок.
+
+RecentIds — кольцевой буфер + множество: проверка и вставка O(1), память ограничена maxlen.
+Старые id вытесняются в порядке поступления.
+"""
+from __future__ import annotations
+
+from collections import deque
+from typing import Deque, Hashable, Set
+
+
+class RecentIds:
+    def __init__(self, maxlen: int = 10_000):
+        self.maxlen = max(1, int(maxlen))
+        self._order: Deque[Hashable] = deque()
+        self._seen: Set[Hashable] = set()
+        self.duplicates = 0
+
+    def add(self, key: Hashable) -> bool:
+        """ Запомнить key; False — такой уже был в окне (повтор). """
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        self._order.append(key)
+        if len(self._order) > self.maxlen:
+            self._seen.discard(self._order.popleft())
+        return True
+
+    def discard(self, key: Hashable) -> None:
+        """ Забыть key (например, апдейт не приняли в очередь — пусть придёт повторно). """
+        if key in self._seen:
+            self._seen.discard(key)
+            try:
+                self._order.remove(key)
+            except ValueError:
+                pass
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._seen
+
+    def __len__(self) -> int:
+        return len(self._seen)
@@ -0,0 +1,119 @@
+"""
+Склейка всплесков уведомлений в один «дайджест».
+
+Первые max_immediate событий за окно window уходят сразу, как обычно. Всё, что пришло сверх
+лимита, копится и через window секунд отправляется одним сообщением (строка на событие).
+Так число вызовов API в один чат ограничено: max_immediate + 1 дайджест за окно
+(больше, только если строк больше max_lines или их суммарная длина больше max_chars —
+тогда сводка уходит несколькими сообщениями, строки не режутся и не теряются).
+
+submit(..., wait=True) ждёт фактической отправки (ошибка пробрасывается вызывающему —
+удобно для outbox с ретраями); wait=False — «отправил и забыл».
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class BurstDigest:
+    def __init__(
+        self,
+        send_digest: Callable[[List[str]], Awaitable[Any]],
+        *,
+        window: float = 60.0,
+        max_immediate: int = 3,
+        max_lines: int = 25,
+        max_chars: Optional[int] = None,
+    ):
+        self._send_digest = send_digest
+        self.window = float(window)
+        self.max_immediate = max(0, int(max_immediate))
+        self.max_lines = max(1, int(max_lines))
+        self.max_chars = int(max_chars) if max_chars else None
+        self._sent: Deque[float] = deque()
+        self._buffer: List[Tuple[str, Optional[asyncio.Future]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+
+        # метрики
+        self.immediate = 0
+        self.digested = 0
+        self.digests = 0
+
+    async def submit(self, send_single: Callable[[], Awaitable[Any]], line: str, *, wait: bool = True) -> None:
+        now = time.monotonic()
+        while self._sent and now - self._sent[0] > self.window:
+            self._sent.popleft()
+
+        if not self._buffer and len(self._sent) < self.max_immediate:
+            self._sent.append(now)
+            self.immediate += 1
+            await send_single()
+            return
+
+        fut = asyncio.get_running_loop().create_future() if wait else None
+        self._buffer.append((line, fut))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+        if fut is not None:
+            await fut
+
+    def pending(self) -> int:
+        return len(self._buffer)
+
+    def stats(self) -> dict:
+        return {
+            "pending": len(self._buffer),
+            "immediate": self.immediate,
+            "digested": self.digested,
+            "digests": self.digests,
+        }
+
+    async def drain(self) -> None:
+        """ Отправить накопленное прямо сейчас (например, при остановке). """
+        if self._flush_task and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self._flush()
+
+    # ---------- внутреннее ----------
+    async def _flush_later(self) -> None:
+        while self._buffer:
+            await asyncio.sleep(self.window)
+            await self._flush()
+
+    def _take_chunk(self) -> List[Tuple[str, Optional[asyncio.Future]]]:
+        """ Строки для одного сообщения: не больше max_lines и max_chars (но хотя бы одна). """
+        n, size = 0, 0
+        for line, _ in self._buffer[: self.max_lines]:
+            size += len(line) + 1
+            if n and self.max_chars and size > self.max_chars:
+                break
+            n += 1
+        chunk, self._buffer = self._buffer[:n], self._buffer[n:]
+        return chunk
+
+    async def _flush(self) -> None:
+        while self._buffer:
+            # будущие каждой строки разрешаются только после отправки её собственного сообщения
+            chunk = self._take_chunk()
+            err: Optional[BaseException] = None
+            try:
+                await self._send_digest([line for line, _ in chunk])
+                self.digests += 1
+                self.digested += len(chunk)
+                self._sent.append(time.monotonic())
+            except Exception as e:
+                err = e
+                logger.error("digest send failed (%s items): %s", len(chunk), e)
+            for _, fut in chunk:
+                if fut is None or fut.done():
+                    continue
+                if err is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(err)
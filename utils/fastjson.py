@@ -0,0 +1,57 @@
+"""
+Быстрый JSON для горячих эндпоинтов (Payme RPC, служебные ответы).
+
+Если установлен orjson — парсинг/сериализация через него (bytes на входе и выходе,
+без промежуточной str); иначе — stdlib json с теми же настройками, что у Starlette.
+NaN/Infinity на обоих путях пишутся как null (так делает orjson), а не роняют ответ.
+FastJSONResponse — замена fastapi.responses.JSONResponse с тем же интерфейсом.
+"""
+from __future__ import annotations
+
+import json
+import math
+from typing import Any, Union
+
+from fastapi.responses import JSONResponse
+
+try:  # orjson — опционально
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data: Union[bytes, bytearray, str]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _finite(obj: Any) -> Any:
+    """ Копия obj, в которой NaN/±Inf заменены на None. """
+    if isinstance(obj, float):
+        return obj if math.isfinite(obj) else None
+    if isinstance(obj, dict):
+        return {k: _finite(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_finite(v) for v in obj]
+    return obj
+
+
+def _json_dumps(obj: Any) -> bytes:
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    try:
+        return _json_dumps(obj)
+    except ValueError:  # NaN/Infinity — повторяем с null, как orjson; обычный путь без копии
+        return _json_dumps(_finite(obj))
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
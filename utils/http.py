@@ -0,0 +1,121 @@
+"""
+Общие httpx.AsyncClient на процесс — по одному на апстрим (OpenAI, Open-Meteo, прочее).
+
+Клиент держит пул соединений с keep-alive, поэтому повторные запросы к тому же хосту
+не платят за TCP/TLS-рукопожатие. HTTP/2 включается, если установлен пакет h2.
+Профили настраиваются через ENV: HTTP_<NAME>_TIMEOUT, HTTP_<NAME>_MAX_CONN, HTTP_<NAME>_KEEPALIVE.
+
+Использование:
+    from utils.http import get_client
+    r = await get_client("openai").post(url, json=payload)
+На остановке приложения — await aclose_all().
+"""
+from __future__ import annotations
+
+import logging
+import os
+import time
+from typing import Any, Dict
+
+import httpx
+
+from utils.metrics import REGISTRY
+from utils.tracing import TRACER
+
+logger = logging.getLogger(__name__)
+
+HTTP_CLIENT_SECONDS = REGISTRY.histogram(
+    "http_client_seconds", "Время внешнего HTTP-запроса (до заголовков ответа)", ("client", "status"),
+)
+
+try:  # HTTP/2 — опционально
+    import h2  # noqa: F401
+    _HAS_H2 = True
+except ImportError:
+    _HAS_H2 = False
+
+HTTP2_ENABLED = _HAS_H2 and os.getenv("HTTP2_ENABLED", "1").strip().lower() in ("1", "true", "yes")
+
+# дефолты профилей: timeout (сек), соединений всего, keep-alive соединений
+_PROFILES: Dict[str, Dict[str, Any]] = {
+    "openai": {"timeout": 15.0, "max_conn": 20, "keepalive": 10},
+    "open_meteo": {"timeout": 10.0, "max_conn": 10, "keepalive": 5},
+    "default": {"timeout": 8.0, "max_conn": 20, "keepalive": 10},
+}
+
+_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+
+def _profile(name: str) -> Dict[str, Any]:
+    base = dict(_PROFILES.get(name, _PROFILES["default"]))
+    env = name.upper()
+    base["timeout"] = float(os.getenv(f"HTTP_{env}_TIMEOUT", base["timeout"]))
+    base["max_conn"] = int(os.getenv(f"HTTP_{env}_MAX_CONN", base["max_conn"]))
+    base["keepalive"] = int(os.getenv(f"HTTP_{env}_KEEPALIVE", base["keepalive"]))
+    return base
+
+
+class _MeteredTransport(httpx.AsyncBaseTransport):
+    """ Транспорт-обёртка: время до заголовков ответа и исход (2xx/4xx/тип ошибки) по клиенту. """
+
+    def __init__(self, name: str, inner: httpx.AsyncBaseTransport):
+        self._name = name
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        status = "error"
+        t0 = time.perf_counter()
+        with TRACER.span(f"http:{self._name}", kind="CLIENT", method=request.method, host=request.url.host) as sp:
+            try:
+                resp = await self._inner.handle_async_request(request)
+                status = f"{resp.status_code // 100}xx"
+                sp.tag("http.status_code", resp.status_code)
+                return resp
+            except Exception as e:
+                status = type(e).__name__
+                raise
+            finally:
+                HTTP_CLIENT_SECONDS.observe(time.perf_counter() - t0, client=self._name, status=status)
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+def _build(name: str) -> httpx.AsyncClient:
+    p = _profile(name)
+    transport = httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(
+            max_connections=p["max_conn"],
+            max_keepalive_connections=p["keepalive"],
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "60")),
+        ),
+        http2=HTTP2_ENABLED,
+    )
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(p["timeout"], connect=min(5.0, p["timeout"])),
+        transport=_MeteredTransport(name, transport),
+    )
+
+
+def get_client(name: str = "default") -> httpx.AsyncClient:
+    """ Клиент профиля name; создаётся при первом обращении. """
+    cli = _CLIENTS.get(name)
+    if cli is None or cli.is_closed:
+        cli = _CLIENTS[name] = _build(name)
+    return cli
+
+
+def init_clients(*names: str) -> None:
+    """ Создать клиенты заранее (на старте), чтобы первый запрос не платил за инициализацию. """
+    for name in names or tuple(_PROFILES):
+        get_client(name)
+
+
+async def aclose_all() -> None:
+    for name, cli in list(_CLIENTS.items()):
+        try:
+            await cli.aclose()
+        except Exception as e:
+            logger.warning("http client %s close failed: %s", name, e)
+    _CLIENTS.clear()
+
@@ -0,0 +1,161 @@
+"""
+Монитор задержки event loop с атрибуцией блокирующих вызовов.
+
+Внутри loop крутится «тикер» (sleep(interval)) — разница между ожидаемым и фактическим
+пробуждением и есть лаг. Отдельный поток-сторож следит за «сердцебиением» тикера: если оно
+не обновлялось дольше threshold, loop чем-то заблокирован — сторож снимает стек главного
+потока (sys._current_frames) и засчитывает время ближайшему месту в коде проекта
+(синхронный psycopg, gspread и т.п. видны как «наша функция → библиотека»).
+Пока блокировка длится, снимки повторяются — вес места пропорционален длительности.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Dict, List, Optional, Sequence
+
+from utils.metrics import REGISTRY
+
+LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "loop_lag_seconds", "Задержка пробуждения event loop",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+
+
+class LoopLagMonitor:
+    def __init__(
+        self,
+        *,
+        interval: float = 0.1,
+        threshold: float = 0.2,
+        roots: Sequence[str] = (),
+        max_sites: int = 200,
+    ):
+        self.interval = float(interval)
+        self.threshold = float(threshold)
+        self.roots = tuple(os.path.abspath(r) for r in roots)
+        self.max_sites = max_sites
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._sites: Dict[str, Dict[str, Any]] = {}
+
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalled_sec = 0.0
+        self.stalls_total = 0  # монотонный — для метрики loop_stalls_total, reset() его не трогает
+
+    # ---------- публичное API ----------
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.get_running_loop().create_task(self._ticker())
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def lag_now(self) -> float:
+        """ Сколько тикер уже не просыпался сверх положенного (0 — loop отзывчив). """
+        return max(0.0, time.monotonic() - self._heartbeat - self.interval)
+
+    def report(self, top: int = 15) -> Dict[str, Any]:
+        with self._lock:
+            sites = sorted(self._sites.items(), key=lambda kv: kv[1]["seconds"], reverse=True)[:top]
+        return {
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "stalled_sec": round(self.stalled_sec, 3),
+            "threshold_ms": round(self.threshold * 1000, 1),
+            "top_sites": [
+                {"site": site, "samples": v["samples"], "seconds": round(v["seconds"], 3), "stack": v["stack"]}
+                for site, v in sites
+            ],
+        }
+
+    def reset(self) -> None:
+        """ Обнулить отчёт (места, max_lag, stalls); stalls_total остаётся монотонным. """
+        with self._lock:
+            self._sites.clear()
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.stalled_sec = 0.0
+
+    # ---------- внутреннее ----------
+    async def _ticker(self) -> None:
+        while True:
+            t0 = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - t0 - self.interval)
+            self._heartbeat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self) -> None:
+        step = max(0.01, self.threshold / 4)
+        in_stall = False
+        while not self._stop.wait(step):
+            behind = time.monotonic() - self._heartbeat - self.interval
+            if behind < self.threshold:
+                in_stall = False
+                continue
+            # первый снимок «оплачивает» всё время до порога, следующие — по шагу
+            weight = step if in_stall else behind
+            if not in_stall:
+                in_stall = True
+                self.stalls += 1
+                self.stalls_total += 1
+            self.stalled_sec += weight
+            self._sample(weight)
+
+    def _is_project(self, filename: str) -> bool:
+        if not self.roots:
+            return True
+        fn = os.path.abspath(filename)
+        return fn.startswith(self.roots) and "site-packages" not in fn
+
+    def _sample(self, weight: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame, limit=40)
+        if not stack:
+            return
+        # место — самый глубокий кадр нашего кода; к нему дописываем, во что он упёрся
+        own = next((fs for fs in reversed(stack) if self._is_project(fs.filename)), stack[-1])
+        leaf = stack[-1]
+        site = f"{os.path.basename(own.filename)}:{own.lineno} {own.name}"
+        if leaf is not own:
+            site += f" → {os.path.basename(leaf.filename)}:{leaf.lineno} {leaf.name}"
+        tail: List[str] = [f"{os.path.basename(fs.filename)}:{fs.lineno} {fs.name}" for fs in stack[-8:]]
+        with self._lock:
+            entry = self._sites.get(site)
+            if entry is None:
+                if len(self._sites) >= self.max_sites:
+                    return
+                entry = self._sites[site] = {"samples": 0, "seconds": 0.0, "stack": tail}
+            entry["samples"] += 1
+            entry["seconds"] += weight
+            entry["stack"] = tail
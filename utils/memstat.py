@@ -0,0 +1,172 @@
+"""
+Интроспекция памяти долгоживущего процесса.
+
+MemoryRegistry — реестр кэшей и словарей состояния: для каждого отдаёт число записей,
+«мелкий» размер контейнера и (по запросу) оценку полного размера по выборке элементов.
+Плюс обёртки над tracemalloc: базовый снимок и дифф «что выросло с тех пор» по месту аллокации.
+
+Контейнеры живут в event loop, поэтому snapshot() вызывается на loop: длины, «мелкие» размеры
+и выборка элементов копируются там, а тяжёлая оценка по копии может уйти в поток
+(summary(..., snapshot=snap) через asyncio.to_thread).
+"""
+from __future__ import annotations
+
+import itertools
+import os
+import sys
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+_SAMPLE = 50
+_MAX_DEPTH = 4
+
+
+def _deep_sizeof(obj: Any, seen: set, depth: int = 0) -> int:
+    if id(obj) in seen or depth > _MAX_DEPTH:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj, 0)
+    # tuple(...) копирует вложенный контейнер одним вызовом C — без итерации по живому объекту
+    if isinstance(obj, dict):
+        for k, v in tuple(obj.items()):
+            size += _deep_sizeof(k, seen, depth + 1) + _deep_sizeof(v, seen, depth + 1)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in tuple(obj):
+            size += _deep_sizeof(v, seen, depth + 1)
+    elif hasattr(obj, "__dict__"):
+        size += _deep_sizeof(vars(obj), seen, depth + 1)
+    return size
+
+
+def _sample(container: Any) -> List[Any]:
+    items = container.items() if isinstance(container, dict) else container
+    return list(itertools.islice(iter(items), _SAMPLE))
+
+
+def _estimate(shallow: int, n: int, sample: List[Any]) -> int:
+    if not n or not sample:
+        return shallow
+    per_item = sum(_deep_sizeof(it, set()) for it in sample) / len(sample)
+    return int(shallow + per_item * n)
+
+
+def estimate_deep_size(container: Any) -> int:
+    """ Размер контейнера + средний размер элемента по выборке × число элементов. """
+    shallow = sys.getsizeof(container, 0)
+    try:
+        n = len(container)
+    except TypeError:
+        return _deep_sizeof(container, set())
+    return _estimate(shallow, n, _sample(container) if n else [])
+
+
+def process_rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024  # Linux: КБ; пик, не текущее
+    except Exception:
+        return None
+
+
+class MemoryRegistry:
+    def __init__(self):
+        # имя -> функция, возвращающая сам контейнер (переприсваивание глобала не ломает реестр)
+        self._items: Dict[str, Callable[[], Any]] = {}
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+
+    def register(self, name: str, getter: Callable[[], Any]) -> None:
+        self._items[name] = getter
+
+    def snapshot(self, deep: bool = False) -> List[Dict[str, Any]]:
+        """ Длины, мелкие размеры и (для deep) выборка элементов — вызывать из потока-владельца. """
+        snap = []
+        for name, getter in self._items.items():
+            try:
+                obj = getter()
+                # объекты-обёртки (LRUCache и т.п.) меряем по их внутреннему хранилищу
+                inner = getattr(obj, "_data", obj)
+                n = len(obj)
+                row = {"name": name, "entries": n, "shallow": sys.getsizeof(inner, 0)}
+                if deep:
+                    row["sample"] = _sample(inner) if n else []
+            except Exception as e:
+                row = {"name": name, "error": str(e)}
+            snap.append(row)
+        return snap
+
+    def report(self, deep: bool = False, snapshot: Optional[List[Dict[str, Any]]] = None) -> List[Dict[str, Any]]:
+        rows = []
+        for s in (self.snapshot(deep) if snapshot is None else snapshot):
+            if "error" in s:
+                rows.append(s)
+                continue
+            row = {"name": s["name"], "entries": s["entries"], "shallow_kb": round(s["shallow"] / 1024, 1)}
+            if deep and "sample" in s:
+                try:
+                    row["deep_kb_est"] = round(_estimate(s["shallow"], s["entries"], s["sample"]) / 1024, 1)
+                except Exception as e:
+                    row["error"] = str(e)
+            rows.append(row)
+        key = "deep_kb_est" if deep else "shallow_kb"
+        rows.sort(key=lambda r: r.get(key, 0), reverse=True)
+        return rows
+
+    # ---------- tracemalloc ----------
+    @staticmethod
+    def tracing() -> bool:
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames: int = 10) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._baseline = tracemalloc.take_snapshot()
+
+    def stop_tracing(self) -> None:
+        self._baseline = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def set_baseline(self) -> None:
+        if tracemalloc.is_tracing():
+            self._baseline = tracemalloc.take_snapshot()
+
+    def diff(self, top: int = 20) -> List[Dict[str, Any]]:
+        if not tracemalloc.is_tracing() or self._baseline is None:
+            return []
+        snap = tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, "<frozen importlib._bootstrap>"))
+        )
+        stats = snap.compare_to(self._baseline, "lineno")
+        out = []
+        for st in stats[:top]:
+            fr = st.traceback[0]
+            out.append({
+                "site": f"{os.path.basename(fr.filename)}:{fr.lineno}",
+                "size_diff_kb": round(st.size_diff / 1024, 1),
+                "size_kb": round(st.size / 1024, 1),
+                "count_diff": st.count_diff,
+            })
+        return out
+
+    def summary(
+        self, deep: bool = False, top: int = 20, snapshot: Optional[List[Dict[str, Any]]] = None,
+    ) -> Dict[str, Any]:
+        rss = process_rss_bytes()
+        res: Dict[str, Any] = {
+            "rss_mb": round(rss / 1048576, 1) if rss else None,
+            "containers": self.report(deep=deep, snapshot=snapshot),
+            "tracemalloc": self.tracing(),
+        }
+        if self.tracing():
+            cur, peak = tracemalloc.get_traced_memory()
+            res["traced_mb"] = round(cur / 1048576, 1)
+            res["traced_peak_mb"] = round(peak / 1048576, 1)
+            res["growth_since_baseline"] = self.diff(top=top)
+        return res
@@ -0,0 +1,182 @@
+"""
+Минимальные метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей.
+
+Counter / Histogram с метками хранятся в памяти процесса; Gauge задаётся функцией,
+которая вызывается только при отдаче /metrics. CounterFunc — то же, но для монотонных
+счётчиков, которые уже ведёт сам объект (пул, планировщик): отдаётся с TYPE counter. Запись — O(1) (гистограмма — bisect
+по границам), поэтому держать включённым в проде дёшево.
+
+    from utils.metrics import REGISTRY
+    HANDLER_SEC = REGISTRY.histogram("bot_handler_seconds", "Время хэндлера", ("handler",))
+    with HANDLER_SEC.time(handler="cb_more"):
+        ...
+    REGISTRY.render()  # -> str
+"""
+from __future__ import annotations
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _esc(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_esc(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_esc(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()  # пишут и из потоков (to_thread, пул Payme)
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        out = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            out.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {v}")
+        return out
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # по ключу меток: [счётчики по бакетам..., +Inf], сумма
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                counts = self._counts[key] = [0] * (len(self.buckets) + 1)
+                self._sums[key] = 0.0
+            counts[idx] += 1
+            self._sums[key] += value
+
+    @contextmanager
+    def time(self, **labels):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - t0, **labels)
+
+    def render(self) -> List[str]:
+        out = self.header()
+        with self._lock:
+            snap = sorted((k, list(c), self._sums[k]) for k, c in self._counts.items())
+        for key, counts, total in snap:
+            acc = 0
+            for bound, c in zip(self.buckets, counts):
+                acc += c
+                out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', repr(bound)))} {acc}")
+            acc += counts[-1]
+            out.append(f"{self.name}_bucket{_fmt_labels(self.labelnames, key, ('le', '+Inf'))} {acc}")
+            out.append(f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {total}")
+            out.append(f"{self.name}_count{_fmt_labels(self.labelnames, key)} {acc}")
+        return out
+
+
+GaugeValue = Union[float, Dict[LabelValues, float]]
+
+
+class Gauge(_Metric):
+    """ Значение считается в момент отдачи: fn() -> число или {значения меток: число}. """
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), fn: Callable[[], GaugeValue] = lambda: 0.0):
+        super().__init__(name, help, labelnames)
+        self._fn = fn
+
+    def render(self) -> List[str]:
+        out = self.header()
+        try:
+            val = self._fn()
+        except Exception:
+            return out
+        if isinstance(val, dict):
+            for key, v in sorted(val.items()):
+                key = key if isinstance(key, tuple) else (key,)
+                out.append(f"{self.name}{_fmt_labels(self.labelnames, key)} {float(v)}")
+        else:
+            out.append(f"{self.name} {float(val)}")
+        return out
+
+
+class CounterFunc(Gauge):
+    """ Монотонный счётчик, значение которого читается из fn() при отдаче (имя — с _total). """
+    kind = "counter"
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _add(self, metric: _Metric) -> _Metric:
+        return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))  # type: ignore[return-value]
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))  # type: ignore[return-value]
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (),
+              fn: Callable[[], GaugeValue] = lambda: 0.0) -> Gauge:
+        return self._add(Gauge(name, help, labelnames, fn))  # type: ignore[return-value]
+
+    def counter_func(self, name: str, help: str, labelnames: Sequence[str] = (),
+                     fn: Callable[[], GaugeValue] = lambda: 0.0) -> CounterFunc:
+        return self._add(CounterFunc(name, help, labelnames, fn))  # type: ignore[return-value]
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for m in self._metrics.values():
+            lines.extend(m.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
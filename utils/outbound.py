@@ -0,0 +1,216 @@
+"""
+Планировщик исходящих вызовов Telegram Bot API.
+
+Telegram режет бота примерно на ~30 сообщений/сек глобально, ~1 сообщение/сек в личный чат
+и ~20 сообщений/мин в группу. OutboundScheduler держит:
+  — токен-бакет на чат (отдельные лимиты для групп/каналов),
+  — общий токен-бакет, который раздаётся ожидающим строго по приоритету
+    (ответы пользователю > админ-уведомления > массовые рассылки/карточки),
+  — бэкофф по RetryAfter (любое исключение с атрибутом retry_after),
+  — счётчики для метрик (глубина очереди, ожидание, 429-е).
+
+Модуль не зависит от aiogram: отправка передаётся как фабрика корутины.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+
+from utils.ratelimit import BucketRegistry, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+PRIO_USER = 0    # ответы пользователю
+PRIO_ADMIN = 1   # уведомления в админ-группу
+PRIO_BULK = 2    # подборки карточек, «печатает…», рассылки
+
+PRIO_NAMES = {PRIO_USER: "user", PRIO_ADMIN: "admin", PRIO_BULK: "bulk"}
+
+OUTBOUND_PRIORITY: ContextVar[int] = ContextVar("outbound_priority", default=PRIO_USER)
+
+
+@contextmanager
+def outbound_priority(prio: int):
+    """ Все вызовы API внутри блока получат указанный приоритет. """
+    token = OUTBOUND_PRIORITY.set(prio)
+    try:
+        yield
+    finally:
+        OUTBOUND_PRIORITY.reset(token)
+
+
+def _is_group(chat_id: Hashable) -> bool:
+    if isinstance(chat_id, int):
+        return chat_id < 0
+    return True  # '@channel' и прочие строковые id
+
+
+class OutboundScheduler:
+    def __init__(
+        self,
+        *,
+        global_per_sec: float = 28.0,
+        global_burst: float = 28.0,
+        chat_per_sec: float = 1.0,
+        chat_burst: float = 8.0,
+        group_per_min: float = 20.0,
+        group_burst: float = 5.0,
+        max_retries: int = 3,
+        max_chats: int = 20_000,
+    ):
+        self._global = TokenBucket(global_per_sec, global_burst)
+        self._chat_cfg = (chat_per_sec, chat_burst)
+        self._group_cfg = (group_per_min / 60.0, group_burst)
+        self._chats = BucketRegistry(self._chat_factory, max_keys=max_chats)
+        self._chat_paused: Dict[Hashable, float] = {}
+        self._paused_until = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump_task: Optional[asyncio.Task] = None
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+
+        # метрики
+        self.sent = 0
+        self.failed = 0
+        self.retry_after_hits = 0
+        self.inflight = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _chat_factory(self, chat_id: Hashable) -> TokenBucket:
+        rate, burst = self._group_cfg if _is_group(chat_id) else self._chat_cfg
+        return TokenBucket(rate, burst)
+
+    # ---------- публичное API ----------
+    async def run(
+        self,
+        chat_id: Optional[Hashable],
+        call: Callable[[], Awaitable[Any]],
+        priority: Optional[int] = None,
+        *,
+        chat_limited: bool = True,
+    ) -> Any:
+        """
+        Дождаться своей очереди и выполнить call(); на RetryAfter — подождать и повторить.
+        chat_limited=False — мимо бакета чата (только общий лимит) и без повторов:
+        для эфемерных вызовов вроде sendChatAction, которые не должны съедать токен ответа.
+        """
+        prio = OUTBOUND_PRIORITY.get() if priority is None else priority
+        retries = self.max_retries if chat_limited else 0
+        attempt = 0
+        while True:
+            t0 = time.monotonic()
+            await self._acquire(chat_id if chat_limited else None, prio)
+            waited = time.monotonic() - t0
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+
+            self.inflight += 1
+            try:
+                res = await call()
+                self.sent += 1
+                return res
+            except Exception as e:
+                retry_after = getattr(e, "retry_after", None)
+                if retry_after is None or attempt >= retries:
+                    self.failed += 1
+                    if retry_after is not None and chat_id is not None:
+                        self.retry_after_hits += 1
+                        self._pause(chat_id, float(retry_after))  # следующие вызовы в чат подождут
+                    raise
+                attempt += 1
+                self.retry_after_hits += 1
+                self._pause(chat_id, float(retry_after))
+                logger.warning(
+                    "outbound: RetryAfter %ss chat=%s prio=%s attempt=%s",
+                    retry_after, chat_id, PRIO_NAMES.get(prio, prio), attempt,
+                )
+            finally:
+                self.inflight -= 1
+
+    def is_paused(self, chat_id: Hashable) -> bool:
+        """ Чат на паузе после RetryAfter — слать в него сейчас бессмысленно. """
+        return self._chat_paused.get(chat_id, 0.0) > time.monotonic()
+
+    def queue_depth(self) -> Dict[str, int]:
+        depth = {name: 0 for name in PRIO_NAMES.values()}
+        for prio, _, fut in self._waiters:
+            if not fut.done():
+                name = PRIO_NAMES.get(prio, str(prio))
+                depth[name] = depth.get(name, 0) + 1
+        return depth
+
+    def stats(self) -> Dict[str, Any]:
+        done = self.sent + self.failed
+        return {
+            "queue": self.queue_depth(),
+            "inflight": self.inflight,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retry_after": self.retry_after_hits,
+            "wait_avg_ms": round(1000 * self.wait_total / done, 1) if done else 0.0,
+            "wait_max_ms": round(1000 * self.wait_max, 1),
+            "chats": len(self._chats),
+        }
+
+    async def drain(self, timeout: float) -> bool:
+        """ Дождаться, пока очередь и отправки в полёте опустеют (не дольше timeout). """
+        deadline = time.monotonic() + timeout
+        while (self._waiters or self.inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not (self._waiters or self.inflight)
+
+    # ---------- внутреннее ----------
+    def _pause(self, chat_id: Optional[Hashable], sec: float) -> None:
+        until = time.monotonic() + sec
+        if chat_id is None:
+            self._paused_until = max(self._paused_until, until)
+            return
+        self._chat_paused[chat_id] = max(self._chat_paused.get(chat_id, 0.0), until)
+        if len(self._chat_paused) > self.max_chats:
+            now = time.monotonic()
+            for k, v in list(self._chat_paused.items()):
+                if v <= now:
+                    self._chat_paused.pop(k, None)
+
+    async def _acquire(self, chat_id: Optional[Hashable], prio: int) -> None:
+        # 1) лимит чата
+        if chat_id is not None:
+            bucket = self._chats.get(chat_id)
+            while True:
+                now = time.monotonic()
+                paused = self._chat_paused.get(chat_id, 0.0) - now
+                if paused <= 0:
+                    self._chat_paused.pop(chat_id, None)
+                wait = max(paused, bucket.wait_time(now=now))
+                if wait <= 0:
+                    bucket.consume(now=now)
+                    break
+                await asyncio.sleep(wait)
+
+        # 2) глобальный лимит — по приоритету
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (prio, next(self._seq), fut))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await fut
+
+    async def _pump(self) -> None:
+        while self._waiters:
+            now = time.monotonic()
+            wait = max(self._paused_until - now, self._global.wait_time(now=now))
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done():  # ожидающего отменили
+                continue
+            self._global.consume()
+            fut.set_result(None)
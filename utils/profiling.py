@@ -0,0 +1,129 @@
+"""
+Выборочный cProfile для медленных операций (апдейты бота, проход коллектора, parse_post).
+
+Профилируем только долю вызовов (sample_rate) и только один вызов за раз (cProfile не
+умеет вкладываться). Если вызов уложился в threshold — профиль выбрасывается, иначе
+вливается в агрегат по имени. report() — топ функций в формате pstats, dump() — то же в файл.
+
+Для корутин профиль снимается между await'ами тоже: туда попадёт и работа соседних задач
+loop'а — для поиска «горячих» функций это приемлемо.
+"""
+from __future__ import annotations
+
+import cProfile
+import io
+import logging
+import pstats
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SlowProfiler:
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        threshold: float = 1.0,
+        sample_rate: float = 1.0,
+        out_path: Optional[str] = None,
+    ):
+        self.enabled = enabled
+        self.threshold = float(threshold)
+        self.sample_rate = float(sample_rate)
+        self.out_path = out_path
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats: Dict[str, pstats.Stats] = {}
+        self.profiled: Dict[str, int] = {}
+        self.captured: Dict[str, int] = {}
+        self.slowest: Dict[str, float] = {}
+
+    # ---------- обёртки ----------
+    async def run_async(self, name: str, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        prof = self._begin()
+        if prof is None:
+            return await fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            self._end(name, prof, time.perf_counter() - t0)
+
+    def run_sync(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        prof = self._begin()
+        if prof is None:
+            return fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self._end(name, prof, time.perf_counter() - t0)
+
+    # ---------- отчёты ----------
+    def report(self, name: Optional[str] = None, top: int = 30, sort: str = "cumulative") -> str:
+        out = io.StringIO()
+        with self._lock:
+            names = [name] if name else sorted(self._stats)
+            for n in names:
+                st = self._stats.get(n)
+                out.write(
+                    f"==== {n}: captured {self.captured.get(n, 0)} of {self.profiled.get(n, 0)} profiled, "
+                    f"slowest {self.slowest.get(n, 0.0) * 1000:.0f} ms ====\n"
+                )
+                if st is None:
+                    continue
+                st.stream = out
+                st.sort_stats(sort).print_stats(top)
+        return out.getvalue() or "no slow captures yet\n"
+
+    def dump(self, path: Optional[str] = None, **kwargs) -> Optional[str]:
+        path = path or self.out_path
+        if not path or not self._stats:
+            return None
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.report(**kwargs))
+            return path
+        except OSError as e:
+            logger.warning("profile dump to %s failed: %s", path, e)
+            return None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats.clear()
+            self.profiled.clear()
+            self.captured.clear()
+            self.slowest.clear()
+
+    # ---------- внутреннее ----------
+    def _begin(self) -> Optional[cProfile.Profile]:
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        if not self._busy.acquire(blocking=False):
+            return None
+        prof = cProfile.Profile()
+        try:
+            prof.enable()
+        except ValueError:  # уже активен другой профайлер
+            self._busy.release()
+            return None
+        return prof
+
+    def _end(self, name: str, prof: cProfile.Profile, elapsed: float) -> None:
+        prof.disable()
+        self._busy.release()
+        with self._lock:
+            self.profiled[name] = self.profiled.get(name, 0) + 1
+            if elapsed < self.threshold:
+                return
+            self.captured[name] = self.captured.get(name, 0) + 1
+            self.slowest[name] = max(self.slowest.get(name, 0.0), elapsed)
+            st = self._stats.get(name)
+            if st is None:
+                self._stats[name] = pstats.Stats(prof)
+            else:
+                st.add(prof)
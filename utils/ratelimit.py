@@ -0,0 +1,90 @@
+"""
+Токен-бакеты для ограничения частоты (GPT, исходящие сообщения и т.п.).
+
+TokenBucket — классический бакет: пополнение считается лениво при обращении (O(1)),
+никаких фоновых таймеров. BucketRegistry — набор бакетов по ключу (user_id/chat_id)
+с LRU-вытеснением, чтобы память не росла бесконечно.
+"""
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from typing import Callable, Hashable, Optional
+
+
+class TokenBucket:
+    """ rate — токенов в секунду, capacity — максимальный «запас» (бёрст). """
+
+    __slots__ = ("rate", "capacity", "tokens", "ts")
+
+    def __init__(self, rate: float, capacity: float, now: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.ts = time.monotonic() if now is None else now
+
+    def _refill(self, now: float) -> None:
+        if now > self.ts:
+            self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rate)
+            self.ts = now
+
+    def wait_time(self, n: float = 1.0, now: Optional[float] = None) -> float:
+        """ Сколько секунд ждать, пока в бакете будет n токенов (0 — можно сразу). """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= n:
+            return 0.0
+        if self.rate <= 0:
+            return float("inf")
+        return (n - self.tokens) / self.rate
+
+    def try_acquire(self, n: float = 1.0, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def consume(self, n: float = 1.0, now: Optional[float] = None) -> None:
+        """ Списать токены безусловно (баланс может уйти в минус — это «долг»). """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        self.tokens -= n
+
+    def is_full(self, now: Optional[float] = None) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class BucketRegistry:
+    """ Бакеты по ключу с ограничением на число ключей (LRU). """
+
+    def __init__(self, factory: Callable[[Hashable], TokenBucket], max_keys: int = 10_000):
+        self._factory = factory
+        self._max_keys = max(1, int(max_keys))
+        self._buckets: "OrderedDict[Hashable, TokenBucket]" = OrderedDict()
+
+    def get(self, key: Hashable) -> TokenBucket:
+        b = self._buckets.get(key)
+        if b is not None:
+            self._buckets.move_to_end(key)
+            return b
+        b = self._factory(key)
+        self._buckets[key] = b
+        if len(self._buckets) > self._max_keys:
+            self._evict()
+        return b
+
+    def _evict(self) -> None:
+        # сначала выкидываем полные бакеты (их состояние = «как новый»), затем самые старые
+        now = time.monotonic()
+        for k in list(self._buckets.keys())[: max(1, len(self._buckets) // 10)]:
+            if self._buckets[k].is_full(now):
+                self._buckets.pop(k, None)
+        while len(self._buckets) > self._max_keys:
+            self._buckets.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._buckets)
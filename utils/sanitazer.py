@@ -366,16 +366,15 @@ async def parse_and_store(db_exec, *, raw_text: str, source_chat: str, message_i
 # =====================================================
 #        ПРИМЕР БЕЗОПАСНОГО HTTP-ЗАПРОСА С РЕТРАЯМИ
 # =====================================================
-import httpx
+from utils.http import get_client
 
 async def http_get_json(url: str, *, timeout: float = 8.0, policy: RetryPolicy | None = None):
     policy = policy or RetryPolicy()
 
     async def _go():
-        async with httpx.AsyncClient(timeout=timeout) as cli:
-            r = await cli.get(url)
-            r.raise_for_status()
-            return r.json()
+        r = await get_client("default").get(url, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
 
     return await safe_run(_go, policy)
 
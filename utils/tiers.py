@@ -0,0 +1,76 @@
+"""
+Приоритеты (тиры) входящих апдейтов и решение о сбросе нагрузки.
+
+core — оплата/контакты/ответы менеджера; nav — кнопки навигации и команды;
+search — подбор туров; heavy — погода и прочие внешние API.
+Модуль не зависит от aiogram: апдейт читается по атрибутам, а знания бота
+(админ-группа, ожидание вопроса, тексты меню) передаются функциями.
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Callable, List
+
+TIER_CORE, TIER_NAV, TIER_SEARCH, TIER_HEAVY = range(4)
+TIER_NAMES = ("core", "nav", "search", "heavy")
+
+CORE_CB_PREFIXES = ("sub:", "want:")
+NAV_CB_PREFIXES = ("back_", "noop", "fav:", "lfav:", "open:", "lang:", "more:", "ask:")
+HEAVY_CB_PREFIXES = ("wx:",)
+WEATHER_RX = re.compile(r"(?iu)\b(погод\w*|ob[-\s]?havo|ауа\s*райы)\b")
+
+
+def default_tier_limits(workers: int) -> List[int]:
+    """core — без потолка; nav/search/heavy — 1/2, 1/4, 1/8 воркеров, но в сумме не больше
+    workers - резерв, чтобы оплата/контакты всегда находили свободный воркер."""
+    limits = [workers, max(1, workers // 2), max(1, workers // 4), max(1, workers // 8)]
+    allowed = max(len(limits) - 1, workers - max(1, workers // 8))
+    while sum(limits[1:]) > allowed:
+        i = max(range(1, len(limits)), key=lambda j: limits[j])
+        if limits[i] <= 1:
+            break
+        limits[i] -= 1
+    return limits
+
+
+def classify_update(
+    update: Any,
+    *,
+    is_admin_chat: Callable[[int], bool],
+    asking: Callable[[int], bool],
+    is_menu: Callable[[str], bool],
+) -> int:
+    if update.pre_checkout_query is not None:
+        return TIER_CORE
+    cb = update.callback_query
+    if cb is not None:
+        data = cb.data or ""
+        if data.startswith(CORE_CB_PREFIXES):
+            return TIER_CORE
+        if data.startswith(HEAVY_CB_PREFIXES):
+            return TIER_HEAVY
+        if data.startswith(NAV_CB_PREFIXES):
+            return TIER_NAV
+        return TIER_SEARCH
+    m = update.message
+    if m is None:
+        return TIER_NAV
+    if m.contact or m.successful_payment:
+        return TIER_CORE
+    # reply — core только в админ-группе (ответ менеджера через ANSWER_MAP);
+    # у обычного пользователя reply не даёт обойти очередь и сброс
+    if m.reply_to_message and is_admin_chat(m.chat.id):
+        return TIER_CORE
+    if m.from_user and asking(m.from_user.id):
+        return TIER_CORE  # текст вопроса менеджеру
+    text = m.text or ""
+    if text.startswith("/weather") or WEATHER_RX.search(text):
+        return TIER_HEAVY
+    if text.startswith("/") or is_menu(text):
+        return TIER_NAV
+    return TIER_SEARCH
+
+
+def should_shed(tier: int, waited: float, *, min_tier: int, latency: float) -> bool:
+    """ Апдейт прождал в очереди дольше latency, а его тир не важнее min_tier — отвечаем «занят». """
+    return tier >= min_tier and waited > latency
@@ -0,0 +1,251 @@
+"""
+Лёгкая трассировка: один трейс на апдейт Telegram / RPC Payme, дочерние спаны на БД,
+кэш, внешний HTTP и вызовы Bot API.
+
+Текущий спан живёт в ContextVar, поэтому вложенность сохраняется через await,
+asyncio.to_thread и run_in_executor с copy_context(). Спан вне трейса не создаётся
+(span() без активного трейса — пустышка), так что фоновые задачи ничего не пишут.
+
+Формат — Zipkin v2 JSON (по спану на строку) в ротируемый файл; опционально ещё и POST
+батчами на collector_url (Zipkin/Jaeger/любая локальная заглушка с /api/v2/spans).
+Запись идёт из отдельного потока через очередь: loop не ждёт диска и сети.
+"""
+from __future__ import annotations
+
+import json
+import logging
+import queue
+import random
+import threading
+import time
+import urllib.parse
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _new_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    __slots__ = ("trace_id", "id", "parent_id", "name", "kind", "ts_us", "_t0", "duration_us", "tags")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: Optional[str]):
+        self.trace_id = trace_id
+        self.id = _new_id()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.ts_us = time.time_ns() // 1000
+        self._t0 = time.perf_counter()
+        self.duration_us = 0
+        self.tags: Dict[str, str] = {}
+
+    def tag(self, key: str, value: Any) -> None:
+        self.tags[key] = str(value)
+
+    def to_zipkin(self, service: str) -> Dict[str, Any]:
+        d: Dict[str, Any] = {
+            "traceId": self.trace_id,
+            "id": self.id,
+            "name": self.name,
+            "timestamp": self.ts_us,
+            "duration": max(1, self.duration_us),
+            "localEndpoint": {"serviceName": service},
+        }
+        if self.parent_id:
+            d["parentId"] = self.parent_id
+        if self.kind:
+            d["kind"] = self.kind
+        if self.tags:
+            d["tags"] = self.tags
+        return d
+
+
+class _NoopSpan:
+    def tag(self, key: str, value: Any) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+_CURRENT: ContextVar[Optional[Span]] = ContextVar("trace_span", default=None)
+
+
+class Tracer:
+    def __init__(
+        self,
+        service: str,
+        *,
+        enabled: bool = False,
+        sample_rate: float = 1.0,
+        path: Optional[str] = None,
+        max_bytes: int = 20 * 1024 * 1024,
+        backups: int = 3,
+        collector_url: Optional[str] = None,
+        queue_max: int = 10_000,
+    ):
+        self.service = service
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.collector_url: Optional[str] = None
+        self._q: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=queue_max)
+        self._file: Optional[logging.Logger] = None
+        self._thread: Optional[threading.Thread] = None
+        self._flushing = threading.Event()  # flush() ждёт — писатель не копит батч до секунды
+        self.dropped = 0
+        self.configure(
+            enabled=enabled, sample_rate=sample_rate, path=path,
+            max_bytes=max_bytes, backups=backups, collector_url=collector_url,
+        )
+
+    def configure(
+        self,
+        *,
+        enabled: bool,
+        sample_rate: float = 1.0,
+        path: Optional[str] = None,
+        max_bytes: int = 20 * 1024 * 1024,
+        backups: int = 3,
+        collector_url: Optional[str] = None,
+        service: Optional[str] = None,
+    ) -> None:
+        """ Включение/настройка из env при старте процесса (бот, коллектор). """
+        if service:
+            self.service = service
+        self.enabled = enabled
+        self.sample_rate = float(sample_rate)
+        self.collector_url = None
+        if collector_url:
+            # urlopen понимает и file://, ftp:// — пускаем только http(s)
+            if urllib.parse.urlsplit(collector_url).scheme in ("http", "https"):
+                self.collector_url = collector_url
+            else:
+                logger.warning("tracing: collector_url must be http(s), export disabled: %r", collector_url)
+        if self._file is not None:
+            for h in list(self._file.handlers):
+                self._file.removeHandler(h)
+                h.close()
+            self._file = None
+        if enabled and path:
+            self._file = logging.getLogger(f"{__name__}.file")
+            self._file.propagate = False
+            self._file.setLevel(logging.INFO)
+            handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._file.addHandler(handler)
+
+    # ---------- API ----------
+    @contextmanager
+    def trace(self, name: str, kind: Optional[str] = "SERVER", **tags: Any) -> Iterator[Any]:
+        """ Корневой спан (новый трейс); сэмплирование решается здесь. """
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield NOOP_SPAN
+            return
+        with self._span(name, _new_id(), None, kind, tags) as sp:
+            yield sp
+
+    @contextmanager
+    def span(self, name: str, kind: Optional[str] = None, **tags: Any) -> Iterator[Any]:
+        """ Дочерний спан текущего трейса; вне трейса — пустышка. """
+        parent = _CURRENT.get()
+        if parent is None:
+            yield NOOP_SPAN
+            return
+        with self._span(name, parent.trace_id, parent.id, kind, tags) as sp:
+            yield sp
+
+    @staticmethod
+    def current_span() -> Any:
+        """ Текущий спан (для тегов без отдельного спана) или пустышка. """
+        return _CURRENT.get() or NOOP_SPAN
+
+    @staticmethod
+    def current_trace_id() -> Optional[str]:
+        sp = _CURRENT.get()
+        return sp.trace_id if sp else None
+
+    def flush(self, timeout: float = 2.0) -> None:
+        """ Дождаться, пока всё из очереди записано (при остановке); считаются и спаны
+        батча, который писатель уже достал из очереди, но ещё не дописал. """
+        deadline = time.monotonic() + timeout
+        self._flushing.set()
+        try:
+            with self._q.all_tasks_done:
+                while self._q.unfinished_tasks:
+                    left = deadline - time.monotonic()
+                    if left <= 0:
+                        break
+                    self._q.all_tasks_done.wait(left)
+        finally:
+            self._flushing.clear()
+
+    # ---------- внутреннее ----------
+    @contextmanager
+    def _span(self, name, trace_id, parent_id, kind, tags) -> Iterator[Span]:
+        sp = Span(name, trace_id, parent_id, kind)
+        for k, v in tags.items():
+            sp.tag(k, v)
+        token = _CURRENT.set(sp)
+        try:
+            yield sp
+        except BaseException as e:
+            sp.tag("error", type(e).__name__)
+            raise
+        finally:
+            _CURRENT.reset(token)
+            sp.duration_us = int((time.perf_counter() - sp._t0) * 1_000_000)
+            self._emit(sp)
+
+    def _emit(self, sp: Span) -> None:
+        try:
+            self._q.put_nowait(sp.to_zipkin(self.service))
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._writer, name=f"trace-writer-{self.service}", daemon=True)
+            self._thread.start()
+
+    def _writer(self) -> None:
+        while True:
+            batch: List[Dict[str, Any]] = [self._q.get()]
+            deadline = time.monotonic() + 1.0
+            while len(batch) < 200 and time.monotonic() < deadline:
+                try:
+                    batch.append(self._q.get(timeout=max(0.0, min(0.05, deadline - time.monotonic()))))
+                except queue.Empty:
+                    if self._flushing.is_set():
+                        break
+            try:
+                if self._file is not None:
+                    for d in batch:
+                        self._file.info(json.dumps(d, ensure_ascii=False, separators=(",", ":")))
+                if self.collector_url:
+                    self._post(batch)
+            finally:
+                for _ in batch:
+                    self._q.task_done()  # flush() ждёт именно этого, а не пустой очереди
+
+    def _post(self, batch: List[Dict[str, Any]]) -> None:
+        req = urllib.request.Request(
+            self.collector_url,
+            data=json.dumps(batch).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            # схема проверена в configure(): только http/https
+            urllib.request.urlopen(req, timeout=3).close()  # nosec B310
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.debug("trace export to %s failed: %s", self.collector_url, e)
+
+
+# общий трейсер процесса: utils.db / utils.http пишут в него дочерние спаны,
+# корневые открывает bot.py; по умолчанию выключен (TRACING=1)
+TRACER = Tracer("tour-bot")
@@ -0,0 +1,180 @@
+"""
+Пул асинхронных воркеров с упорядочиванием по ключу и приоритетами.
+
+Элементы с одним ключом (chat_id) обрабатываются строго по очереди, с разными — параллельно.
+Внутри: очередь на ключ (deque) + очереди «готовых» ключей, по одной на уровень приоритета
+(0 — самый важный). Ключ стоит в них не больше одного раза — на уровне своего головного
+элемента; после одного элемента ключ уходит в конец, чтобы болтливый чат не занимал воркер.
+
+limits — потолок одновременной обработки на уровень. Он проверяется ДО того, как воркер
+возьмёт элемент: упёршийся в лимит уровень просто не выбирается, и свободный воркер
+достаётся более важному уровню, а не висит на семафоре.
+Общее число ожидающих элементов ограничено max_queue — submit() вернёт False, если места нет.
+submit(..., front=True) ставит элемент в голову очереди ключа — для более старых элементов
+(доигрывание сохранённых), которые должны обработаться раньше уже ждущих.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedWorkerPool:
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[Any]],
+        *,
+        workers: int = 8,
+        max_queue: int = 1000,
+        name: str = "pool",
+        limits: Optional[Sequence[int]] = None,
+    ):
+        self._handler = handler
+        self.workers = max(1, int(workers))
+        self.max_queue = max(1, int(max_queue))
+        self.name = name
+        self.limits: List[int] = [max(1, int(n)) for n in (limits or [self.workers])]
+        levels = len(self.limits)
+        self._items: Dict[Hashable, Deque[Tuple[int, Any]]] = {}
+        self._scheduled: Set[Hashable] = set()   # ключ в одной из _ready или обрабатывается
+        self._ready: List[Deque[Hashable]] = [deque() for _ in range(levels)]
+        self._active: List[int] = [0] * levels
+        self._wake = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._inflight: Dict[int, Any] = {}      # номер воркера -> элемент в обработке
+        self.pending = 0
+        self.busy = 0
+
+        # метрики
+        self.processed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.max_seen = 0
+
+    # ---------- публичное API ----------
+    def start(self) -> None:
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"{self.name}-{i}") for i in range(self.workers)
+        ]
+
+    def submit(self, key: Hashable, item: Any, priority: int = 0, *, front: bool = False) -> bool:
+        """ Поставить элемент в очередь ключа; False — очередь переполнена. """
+        if self.pending >= self.max_queue:
+            self.rejected += 1
+            return False
+        prio = min(max(0, int(priority)), len(self._ready) - 1)
+        q = self._items.setdefault(key, deque())
+        if front:
+            q.appendleft((prio, item))
+        else:
+            q.append((prio, item))
+        self.pending += 1
+        self.max_seen = max(self.max_seen, self.pending)
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            self._ready[prio].append(key)
+            self._wake.set()
+        return True
+
+    def depth(self) -> int:
+        return self.pending
+
+    def has_key(self, key: Hashable) -> bool:
+        """ У ключа есть ожидающие элементы или один в обработке. """
+        return key in self._scheduled
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": self.pending,
+            "busy": self.busy,
+            "workers": len(self._tasks),
+            "keys": len(self._items),
+            "processed": self.processed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "max_seen": self.max_seen,
+            "active_by_level": list(self._active),
+            "ready_by_level": [len(q) for q in self._ready],
+            "limits": list(self.limits),
+        }
+
+    async def drain(self, timeout: float) -> bool:
+        """ Дождаться обработки всего, что уже в очереди (не дольше timeout). """
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.busy) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        return not (self.pending or self.busy)
+
+    def take_pending(self) -> List[Any]:
+        """ Забрать из очередей всё, что ещё не начато (чтобы сохранить при остановке). """
+        items = [item for q in self._items.values() for _, item in q]
+        for q in self._items.values():
+            q.clear()
+        self.pending = 0
+        return items
+
+    async def stop(self) -> List[Any]:
+        """ Остановить воркеры; возвращает элементы, прерванные посреди обработки. """
+        interrupted = list(self._inflight.values())
+        for t in self._tasks:
+            t.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._inflight.clear()
+        return interrupted
+
+    # ---------- внутреннее ----------
+    def _next_key(self) -> Optional[Tuple[Hashable, int]]:
+        """ Самый важный уровень, где есть готовый ключ и не исчерпан лимит. """
+        for prio, ready in enumerate(self._ready):
+            if ready and self._active[prio] < self.limits[prio]:
+                return ready.popleft(), prio
+        return None
+
+    def _reschedule(self, key: Hashable) -> None:
+        q = self._items.get(key)
+        if q:
+            self._ready[q[0][0]].append(key)
+        else:
+            self._items.pop(key, None)
+            self._scheduled.discard(key)
+
+    async def _worker(self, idx: int) -> None:
+        while True:
+            picked = self._next_key()
+            if picked is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            key, prio = picked
+            q = self._items.get(key)
+            if not q:
+                self._reschedule(key)
+                continue
+            _, item = q.popleft()
+            self.pending -= 1
+            self.busy += 1
+            self._active[prio] += 1
+            self._inflight[idx] = item
+            try:
+                await self._handler(item)
+                self.processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logger.exception("%s: handler failed (key=%s)", self.name, key)
+            finally:
+                self.busy -= 1
+                self._active[prio] -= 1
+                self._inflight.pop(idx, None)
+                self._reschedule(key)
+                self._wake.set()  # освободился слот уровня / ключ снова готов